@@ -0,0 +1,128 @@
+######################################################################
+# The ATCA Sensitivity Calculator
+# Persistent cache of model atmosphere calculations.
+# Copyright 2015 Jamie Stevens, CSIRO
+#
+# This file is part of the ATCA Sensitivity Calculator.
+#
+# The ATCA Sensitivity Calculator is free software: you can
+# redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# The ATCA Sensitivity Calculator is distributed in the hope
+# that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with the ATCA Sensitivity Calculator.
+# If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+import numpy as np
+import refract as refract
+import tsysstore as tsysstore
+
+# Change this whenever the atmosphere model or what is kept in an entry changes,
+# so the entries made before are no longer found.
+cacheVersion = 1
+# The arrays from refract.calcOpacity that we keep in the cache.
+cachedQuantities = [ 'tau', 'fac', 'Tb', 'pwv' ]
+# The values that are only kept if the calculation returned them, like the
+# number of frequencies refract.calcOpacityAdaptive ran the model at.
+optionalQuantities = [ 'samples' ]
+
+def cacheKey(freq, el, t0, p0, h0, nLayers, tolerance=None, spacing="uniform"):
+    # Make the name of the cache entry for a model atmosphere calculation. The
+    # name is a hash of everything the result depends on: the weather, the
+    # elevation (or elevations, which are set by the declination and hour
+    # angles), the exact frequency grid, the number and spacing of the layers
+    # and, for adaptively sampled atmospheres, the tolerance. The version of the
+    # cache is included too.
+    k = hashlib.sha1()
+    k.update(np.array([ cacheVersion ], dtype=np.int64).tobytes())
+    k.update(np.concatenate((np.atleast_1d(el), [ t0, p0, h0 ])).astype(float).tobytes())
+    k.update(np.array([ nLayers ], dtype=np.int64).tobytes())
+    k.update(np.ascontiguousarray(freq, dtype=float).tobytes())
+    if (tolerance is not None):
+        k.update(np.array([ tolerance ], dtype=float).tobytes())
+    if (spacing != "uniform"):
+        k.update(spacing.encode())
+    return k.hexdigest()
+
+def readCache(directory, key):
+    # Return the cached arrays for the specified key, or None if they aren't
+    # in the cache.
+    filename = os.path.join(directory, key + ".npz")
+    try:
+        with np.load(filename) as d:
+            atmos = dict((q, d[q]) for q in cachedQuantities)
+            for q in optionalQuantities:
+                if (q in d.files):
+                    atmos[q] = d[q]
+    except (IOError, OSError, KeyError, ValueError):
+        # Missing, partially written or corrupt entries are just misses.
+        return None
+    # Mark this entry as recently used so it is the last to be evicted.
+    try:
+        os.utime(filename, None)
+    except OSError:
+        pass
+    return atmos
+
+def writeCache(directory, key, atmos):
+    # Store the arrays for the specified key. An entry that can't be stored is
+    # just calculated again the next time it is needed.
+    try:
+        tsysstore.writeFile(os.path.join(directory, key + ".npz"),
+                            lambda f: np.savez(f, **dict((q, np.asarray(atmos[q]))
+                                                         for q in (cachedQuantities + optionalQuantities)
+                                                         if (q in atmos))))
+    except (IOError, OSError):
+        pass
+
+def pruneCache(directory, maxBytes):
+    # Remove the least recently used entries until the cache is no larger
+    # than maxBytes.
+    entries = []
+    totalBytes = 0
+    for name in os.listdir(directory):
+        if (name.endswith(".npz")):
+            try:
+                st = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            totalBytes += st.st_size
+    entries.sort()
+    for mtime, size, name in entries:
+        if (totalBytes <= maxBytes):
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+        totalBytes -= size
+
+def calcOpacity(freq, el, t0, p0, h0, nLayers, directory, maxBytes, tolerance=None,
+                spacing="uniform"):
+    # A version of refract.calcOpacity that first looks for the result in the
+    # cache in the specified directory, and stores any result it has to
+    # compute there. The cache is then trimmed back to maxBytes. If a tolerance
+    # is given, the atmosphere is computed with refract.calcOpacityAdaptive
+    # using the spacing of freq as the finest step.
+    key = cacheKey(freq, el, t0, p0, h0, nLayers, tolerance, spacing)
+    atmos = readCache(directory, key)
+    if (atmos is None):
+        if (tolerance is None):
+            atmos = refract.calcOpacity(freq, el, t0, p0, h0, nLayers, spacing)
+        else:
+            atmos = refract.calcOpacityAdaptive(freq, el, t0, p0, h0, nLayers, tolerance,
+                                                spacing=spacing)
+        writeCache(directory, key, atmos)
+        pruneCache(directory, maxBytes)
+    return atmos
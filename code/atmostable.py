@@ -0,0 +1,224 @@
+######################################################################
+# The ATCA Sensitivity Calculator
+# Precomputed model atmosphere lookup tables.
+# Copyright 2015 Jamie Stevens, CSIRO
+#
+# This file is part of the ATCA Sensitivity Calculator.
+#
+# The ATCA Sensitivity Calculator is free software: you can
+# redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# The ATCA Sensitivity Calculator is distributed in the hope
+# that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with the ATCA Sensitivity Calculator.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# For each ATCA band, the zenith opacity and sky brightness temperature
+# from refract.calcOpacity are tabulated on a grid of frequency,
+# ground temperature, pressure and relative humidity. Any weather inside
+# the grid can then be answered by multilinear interpolation in all four
+# dimensions, instead of running the Liebe model.
+#
+# The interpolation error is largest where the opacity curves most steeply
+# with the weather: at high temperatures, where the saturation vapour
+# pressure rises quickly, and in dry air, where the water vapour continuum
+# makes the opacity curve upwards with humidity. With the grid below, the
+# largest errors found at the centres of the grid cells are about 0.4% of
+# the opacity in the 16cm, 4cm and 15mm bands, 0.6% in the 7mm band and
+# 0.75% in the 3mm band, and up to about 1 K of sky brightness temperature
+# in the 3mm band (less than 0.25 K at the lower frequencies).
+# The actual largest errors found for each band are measured when the
+# table is built, by comparing against refract.calcOpacity at randomly
+# chosen cell centres, and are stored in the table as 'errorTau' (a
+# fraction of the opacity) and 'errorTb' (K).
+#
+# The tables are made once by running this file:
+#   python atmostable.py [band ...]
+# (or when the persistent web service starts, see atsenscalc_bigcat_wsgi).
+# They are never made during a calculation, which uses the model instead
+# for any band whose table hasn't been made.
+
+import os
+import sys
+import math
+import numpy as np
+import refract as refract
+import tsysstore as tsysstore
+
+# Where the tables are kept.
+tableDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "atmosphere_tables")
+# Change this whenever the table layout or the atmosphere model changes.
+tableVersion = 1
+
+# The grid axes. Frequencies extend beyond each band by half the widest
+# window, so the edges of any window centred in the band are covered.
+gridFrequencyStep = 50.0 # MHz
+gridFrequencyMargin = 1024.0 # MHz
+gridTemperature = np.arange(-10.0, 45.01, 2.5) # C
+gridPressure = np.arange(960.0, 1040.01, 40.0) # hPa
+# The water vapour continuum makes the opacity curve upwards with humidity,
+# most sharply when the air is dry, so the humidity axis is denser there.
+gridHumidity = np.array([ 0.0, 1.0, 2.5, 5.0, 7.5, 10.0, 12.5, 15.0, 20.0, 25.0, 30.0,
+                          35.0, 40.0, 50.0, 60.0, 70.0, 80.0, 90.0, 100.0, 110.0 ]) # %
+
+# The number of randomly chosen grid cells used to measure the interpolation
+# error when a table is built.
+nErrorSamples = 24
+
+# Tables already read in by this process.
+loadedTables = {}
+
+def tableFilename(band, nLayers):
+    return os.path.join(tableDirectory, "%s_%d.npz" % (band, nLayers))
+
+def bandFrequencies(low, high):
+    # The table frequency axis for a band covering low - high (MHz).
+    lowFreq = math.floor((low - gridFrequencyMargin) / gridFrequencyStep) * gridFrequencyStep
+    highFreq = math.ceil((high + gridFrequencyMargin) / gridFrequencyStep) * gridFrequencyStep
+    nFreq = int(round((highFreq - lowFreq) / gridFrequencyStep)) + 1
+    return lowFreq + gridFrequencyStep * np.arange(0, nFreq)
+
+def evaluate(freq, t, p, h, nLayers):
+    # Run the model atmosphere at the zenith for frequencies in MHz, and weather
+    # in the units of the table (C, hPa, %).
+    return refract.calcOpacity(freq * 1e6, math.radians(90.0), (t + 273.15), (p * 100.0),
+                               (h / 100.0), nLayers)
+
+def buildTable(band, low, high, nLayers):
+    # Compute the table for a band, and measure its interpolation error.
+    freq = bandFrequencies(low, high)
+    shape = (len(freq), len(gridTemperature), len(gridPressure), len(gridHumidity))
+    tau = np.empty(shape)
+    Tb = np.empty(shape)
+    pwv = np.empty(shape[1:])
+    for i, t in enumerate(gridTemperature):
+        for j, p in enumerate(gridPressure):
+            for k, h in enumerate(gridHumidity):
+                atmos = evaluate(freq, t, p, h, nLayers)
+                tau[:, i, j, k] = atmos['tau']
+                Tb[:, i, j, k] = atmos['Tb']
+                pwv[i, j, k] = atmos['pwv'][0]
+    table = { 'version': tableVersion, 'band': band, 'layers': nLayers,
+              'frequency': freq, 'temperature': gridTemperature,
+              'pressure': gridPressure, 'humidity': gridHumidity,
+              'tau': tau, 'Tb': Tb, 'pwv': pwv }
+
+    # Measure the error at the centres of some cells, and half way between
+    # the tabulated frequencies.
+    rng = np.random.RandomState(len(freq))
+    mfreq = freq[:-1] + gridFrequencyStep / 2.0
+    errorTau = 0.0
+    errorTb = 0.0
+    for s in range(0, nErrorSamples):
+        i = rng.randint(0, len(gridTemperature) - 1)
+        j = rng.randint(0, len(gridPressure) - 1)
+        k = rng.randint(0, len(gridHumidity) - 1)
+        t = 0.5 * (gridTemperature[i] + gridTemperature[i + 1])
+        p = 0.5 * (gridPressure[j] + gridPressure[j + 1])
+        h = 0.5 * (gridHumidity[k] + gridHumidity[k + 1])
+        atmos = evaluate(mfreq, t, p, h, nLayers)
+        approx = interpolate(table, mfreq, t, p, h)
+        errorTau = max(errorTau, np.max(np.abs(approx['tau'] - atmos['tau']) / atmos['tau']))
+        errorTb = max(errorTb, np.max(np.abs(approx['Tb'] - atmos['Tb'])))
+    table['errorTau'] = errorTau
+    table['errorTb'] = errorTb
+    return table
+
+def writeTable(table):
+    # Store a table, raising an error if it can't be.
+    tsysstore.writeFile(tableFilename(table['band'], table['layers']), lambda f: np.savez(f, **table))
+
+def readTable(band, nLayers):
+    # Read the table for a band from disk, returning None if it isn't there or
+    # it was made by a different version of this code.
+    try:
+        with np.load(tableFilename(band, nLayers)) as d:
+            table = dict((q, d[q]) for q in d.files)
+    except (IOError, OSError, ValueError):
+        return None
+    if (int(table['version']) != tableVersion):
+        return None
+    return table
+
+def getTable(band, nLayers):
+    # Return the table for a band, reading it if we don't already have it, or
+    # None if it hasn't been made. Making a table takes minutes, so that is
+    # never done here; a missing table is looked for again the next time.
+    key = (band, nLayers)
+    if (key not in loadedTables):
+        table = readTable(band, nLayers)
+        if (table is None):
+            return None
+        loadedTables[key] = table
+    return loadedTables[key]
+
+def makeTables(bands, nLayers, rebuild=True):
+    # Make and store the tables for the bands, given as a dictionary of the
+    # band ranges by name, and return them by name. Unless rebuild is True,
+    # tables that have already been made are kept.
+    tables = {}
+    for b in sorted(bands.keys()):
+        table = None if rebuild else readTable(b, nLayers)
+        if (table is None):
+            table = buildTable(b, bands[b]['low'], bands[b]['high'], nLayers)
+            writeTable(table)
+        loadedTables[(b, nLayers)] = table
+        tables[b] = table
+    return tables
+
+def cellPosition(axis, value):
+    # Return the index of the lower grid point of the cell containing value,
+    # and the fractional position within that cell.
+    i = int(np.searchsorted(axis, value, side='right')) - 1
+    i = min(max(i, 0), len(axis) - 2)
+    return i, (value - axis[i]) / (axis[i + 1] - axis[i])
+
+def inTable(table, freq, t, p, h):
+    # Check whether the frequencies (MHz) and weather can be answered by the table.
+    return ((np.min(freq) >= table['frequency'][0]) and (np.max(freq) <= table['frequency'][-1]) and
+            (t >= table['temperature'][0]) and (t <= table['temperature'][-1]) and
+            (p >= table['pressure'][0]) and (p <= table['pressure'][-1]) and
+            (h >= table['humidity'][0]) and (h <= table['humidity'][-1]))
+
+def interpolate(table, freq, t, p, h):
+    # Interpolate the opacity, sky brightness temperature and precipitable water
+    # vapour for frequencies freq (MHz) and ground temperature t (C), pressure
+    # p (hPa) and relative humidity h (%). The weather is interpolated first,
+    # giving spectra at the tabulated frequencies, which are then interpolated
+    # onto the requested frequencies.
+    i, ft = cellPosition(table['temperature'], t)
+    j, fp = cellPosition(table['pressure'], p)
+    k, fh = cellPosition(table['humidity'], h)
+    tau = np.zeros(len(table['frequency']))
+    Tb = np.zeros(len(table['frequency']))
+    pwv = 0.0
+    for di, wi in ((0, 1.0 - ft), (1, ft)):
+        for dj, wj in ((0, 1.0 - fp), (1, fp)):
+            for dk, wk in ((0, 1.0 - fh), (1, fh)):
+                w = wi * wj * wk
+                tau += w * table['tau'][:, (i + di), (j + dj), (k + dk)]
+                Tb += w * table['Tb'][:, (i + di), (j + dj), (k + dk)]
+                pwv += w * table['pwv'][(i + di), (j + dj), (k + dk)]
+    tau = np.interp(freq, table['frequency'], tau)
+    Tb = np.interp(freq, table['frequency'], Tb)
+    return { 'tau': tau, 'fac': np.exp(-1.0 * tau), 'Tb': Tb, 'pwv': np.full(len(tau), pwv) }
+
+if __name__ == "__main__":
+    # Make the tables for the named bands, or all the bands.
+    import atsenscalc_bigcat_routines as sens
+    bands = sys.argv[1:]
+    if (len(bands) == 0):
+        bands = sens.frequencyBands.keys()
+    tables = makeTables(dict((b, sens.frequencyBands[b]) for b in bands), 50)
+    for b in sorted(tables.keys()):
+        table = tables[b]
+        print("%s: %d frequencies, opacity error < %.2f%%, sky temperature error < %.3f K" %
+              (b, len(table['frequency']), (table['errorTau'] * 100.0), table['errorTb']))
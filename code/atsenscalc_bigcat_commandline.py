@@ -33,6 +33,18 @@ if __name__ == "__main__":
             sys.argv[i] = ' ' + arg
             
     parser = argparse.ArgumentParser() 
+    parser.add_argument("--atmosphere-cache",
+                        help="a directory in which to keep computed model atmospheres for reuse")
+    parser.add_argument("--atmosphere-cache-size", type=float, default=100.0,
+                        help="the maximum size of the model atmosphere cache (MB)")
+    parser.add_argument("--atmosphere-engine", default="zenith", choices=[ "zenith", "slant" ],
+                        help="scale the zenith atmosphere by 1/sin(elevation), or calculate the atmosphere along the line of sight at each hour angle")
+    parser.add_argument("--atmosphere-layer-tolerance", type=float,
+                        help="use as few model atmosphere layers as give this fractional accuracy, instead of 50")
+    parser.add_argument("--atmosphere-lookup", action="store_true",
+                        help="interpolate the atmosphere from the tables made by atmostable.py instead of running the model")
+    parser.add_argument("--atmosphere-tolerance", type=float,
+                        help="sample the atmosphere adaptively in frequency to this fractional accuracy, instead of every --per-freq MHz")
     parser.add_argument("--ca06", action="store_true",
                         help="include CA06 for the calculations")
     parser.add_argument("-a", "--halimit", type=float, default=6,
@@ -48,16 +60,26 @@ if __name__ == "__main__":
                                   "h214", "H214", "h168", "H168", "h75", "H75" ]);
     parser.add_argument("-C", "--calculate-time", action="store_true",
                         help="the calculator will determine the time required to reach the target sensitivity")
+    parser.add_argument("--data-bundle",
+                        help="use the tables in the shared data bundle with this name (see databundle.py)")
     parser.add_argument("-d", "--dec", type=float, default=-30,
                         help="the declination of the source (decimal degrees)")
     parser.add_argument("-e", "--ellimit", type=float, default=12,
                         help="the elevation limit to use (decimal degrees)")
     parser.add_argument("-E", "--edge", type=int, default=0,
                         help="the number of edge channels to flag")
+    parser.add_argument("--executor", default="serial", choices=[ "serial", "process" ],
+                        help="evaluate the weather conditions one after the other, or in parallel worker processes")
     parser.add_argument("-f", "--frequency", type=int,
                         help="the central frequency of the observations (MHz)")
     parser.add_argument("-F", "--per-freq", type=float, default=50.0,
                         help="the minimum frequency spacing between atmospheric corrections (MHz)")
+    parser.add_argument("--ha-average", default="sample", choices=[ "sample", "quadrature" ],
+                        help="average the atmosphere over the hour angle range from per-ha samples an hour (sample) or with Gauss-Legendre quadrature (quadrature)")
+    parser.add_argument("--ha-nodes", type=int, default=8,
+                        help="the number of nodes for the hour angle quadrature")
+    parser.add_argument("--humidity", type=float,
+                        help="the relative humidity at the ground, instead of the seasonal conditions (%%)")
     parser.add_argument("-H", "--ha-min", type=float,
                         help="the lowest hour angle observed (decimal hours)")
     parser.add_argument("-K", "--ha-max", type=float,
@@ -70,22 +92,34 @@ if __name__ == "__main__":
                         help="make human readable output (default for command line version)")
     parser.add_argument("-P", "--per-ha", type=float, default=5.0,
                         help="the number of calculations of atmosphere made per hour")
+    parser.add_argument("--pressure", type=float,
+                        help="the air pressure at the ground, instead of the seasonal conditions (hPa)")
     parser.add_argument("-q", "--quiet", action="store_true",
                         help="do not output progress messages")
     parser.add_argument("-r", "--restfreq", type=float,
                         help="use this rest frequency to calculate the velocity parameters (GHz)")
     parser.add_argument("-R", "--rfi", action="store_true",
                         help="flag known RFI-affected regions of the continuum spectrum")
-    parser.add_argument("-s", "--smoothing", type=int, default=1,
-                        help="the number of continuum spectral channels to bin together in the output")
+    parser.add_argument("--rfi-mask",
+                        help="flag the RFI-affected regions listed in this file (low and high frequency in MHz on each line) instead of the known regions")
+    parser.add_argument("-s", "--smoothing", type=int, nargs="+", default=[ 1 ],
+                        help="the number of continuum spectral channels to bin together in the output; the continuum sensitivities are also given for any further numbers")
     parser.add_argument("-S", "--season", default="ANNUAL",
                         choices=[ "JAN", "FEB", "MAR", "APR", "MAY", "JUN",
                                   "JUL", "AUG", "SEP", "OCT", "NOV", "DEC",
                                   "SUMMER", "AUTUMN", "WINTER", "SPRING",
                                   "APRS", "OCTS", "ANNUAL" ],
                         help="the conditions to assume for weather dependence")
+    parser.add_argument("--sweep-seasons", nargs="+",
+                        choices=[ "JAN", "FEB", "MAR", "APR", "MAY", "JUN",
+                                  "JUL", "AUG", "SEP", "OCT", "NOV", "DEC",
+                                  "SUMMER", "AUTUMN", "WINTER", "SPRING",
+                                  "APRS", "OCTS", "ANNUAL" ],
+                        help="also calculate the sensitivities for these seasons")
     parser.add_argument("-t", "--integration", type=float, default=720,
                         help="the amount of on-source integration time (min)")
+    parser.add_argument("--temperature", type=float,
+                        help="the air temperature at the ground, instead of the seasonal conditions (C)")
     parser.add_argument("-T", "--target", type=float, default=0.0,
                         help="the target sensitivity to reach")
     parser.add_argument("--target-continuum", action="store_true",
@@ -106,11 +140,15 @@ if __name__ == "__main__":
                         help="the target sensitivity is to be obtained in typical weather conditions")
     parser.add_argument("--target-worst", action="store_true",
                         help="the target sensitivity is to be obtained in the worst weather conditions")
+    parser.add_argument("--time-solver", default="analytic", choices=[ "analytic", "iterative" ],
+                        help="find the integration time in time calculation mode directly (analytic) or by repeating the calculation until the sensitivity is within 1%% of the target (iterative)")
     parser.add_argument("-w", "--weighting", default="R2",
                         help="the image weighting scheme",
                         choices=[ "R2", "R1", "R0", "R-1", "R-2" ])
     parser.add_argument("-W", "--zoom-bandwidth", default=2.0, type=float,
                         help="the bandwidth of a zoom band in MHz")
+    parser.add_argument("--workers", type=int,
+                        help="the number of worker processes to use with --executor process (default: one per CPU)")
     parser.add_argument("-y", "--zoom-smoothing", type=int, default=1,
                         help="the number of zoom spectral channels to bin together in the output")
     parser.add_argument("-z", "--zoomfreq", type=int,
@@ -21,14 +21,58 @@
 # along with the ATCA Sensitivity Calculator.
 # If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import math
 import sys
 import json
+import copy
+import time
+import collections
+import concurrent.futures
 import numpy as np
 import atsenscalc_bigcat_routines as sens
 
+# The number of calculated results to keep (see cachedMain).
+resultCacheSize = 64
+# How long (s) a calculated result can be used for.
+resultCacheLifetime = 3600.0
+# The calculated results we have, by canonical request, most recently used last.
+# The cache and its counts belong to this process only: the workers of a server
+# each have their own, and don't see each other's results.
+resultCache = collections.OrderedDict()
+# How many requests have been found in (or missing from) the result cache, how many
+# of the misses were for results that had expired, and how many results have had to
+# be dropped to make room.
+resultCacheCounts = { 'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0 }
+# The pool of worker processes that conditions are evaluated in, which is kept
+# between calculations (see getExecutor), and the number of workers and data
+# bundle it was made with.
+executorPool = None
+executorSettings = None
+# The arguments that don't change the result of a calculation.
+resultIndependentArguments = [ 'output', 'plot_location', 'quiet', 'human_readable', 'executor',
+                               'workers', 'data_bundle', 'atmosphere_cache', 'atmosphere_cache_size' ]
+# The values used for the optional arguments when they aren't given.
+argumentDefaults = { 'time_solver': "analytic", 'ha_average': "sample", 'ha_nodes': 8,
+                     'atmosphere_engine': "zenith", 'atmosphere_lookup': False,
+                     'sweep_seasons': [], 'smoothing': [ 1 ] }
+# The names of the array configurations that are the same as another.
+configurationAliases = { '6km': "6000", '3km': "3000", '1.5km': "1500", '750m': "750",
+                         'EW367': "367", 'EW352/367': "367", 'h214': "H214", 'h168': "H168",
+                         'h75': "H75" }
+# The number of decimal places that matter for each of the floating point arguments;
+# any others are kept to 6 significant figures.
+argumentPrecision = { 'frequency': 3, 'zoomfreq': 3, 'restfreq': 6, 'dec': 4, 'ellimit': 4,
+                      'halimit': 4, 'ha_min': 4, 'ha_max': 4, 'ha_middle': 4, 'per_freq': 3,
+                      'per_ha': 3, 'integration': 3, 'zoom_bandwidth': 3, 'temperature': 2,
+                      'pressure': 2, 'humidity': 2 }
+
 def checkArguments(args):
     cargs = vars(args)
+    # Use the tables in a shared data bundle if we have been given one.
+    if ('data_bundle' in cargs and args.data_bundle is not None):
+        sens.useBundle(args.data_bundle)
+
     # Check the frequency exists and is within a known band.
     if 'frequency' in cargs:
         b = sens.frequencyBand(int(args.frequency))
@@ -67,6 +111,61 @@ def checkArguments(args):
     if (args.dec < -90 or args.dec > (90 - 30.313 - args.ellimit)):
         raise sens.CalcError("Declination not observable with specified elevation limit.")
 
+    # Check that any user specified weather is complete and reasonable.
+    customWeather = [ ('temperature' in cargs and args.temperature is not None),
+                      ('pressure' in cargs and args.pressure is not None),
+                      ('humidity' in cargs and args.humidity is not None) ]
+    if (any(customWeather)):
+        if (not all(customWeather)):
+            raise sens.CalcError("Temperature, pressure and humidity must all be specified.")
+        if (args.temperature < -30 or args.temperature > 50):
+            raise sens.CalcError("Temperature out of range.")
+        if (args.pressure < 800 or args.pressure > 1100):
+            raise sens.CalcError("Pressure out of range.")
+        if (args.humidity < 0 or args.humidity > 110):
+            raise sens.CalcError("Humidity out of range.")
+
+    # Check how the conditions are to be evaluated.
+    executor = "serial"
+    if ('executor' in cargs and args.executor is not None):
+        executor = args.executor
+    if (executor not in [ "serial", "process" ]):
+        raise sens.CalcError("Unknown executor.")
+    if ('workers' in cargs and args.workers is not None and args.workers < 1):
+        raise sens.CalcError("Number of workers must be at least 1.")
+    # Check how the atmosphere away from the zenith is to be calculated.
+    if ('atmosphere_engine' in cargs and args.atmosphere_engine is not None and
+        args.atmosphere_engine not in [ "zenith", "slant" ]):
+        raise sens.CalcError("Unknown atmosphere engine.")
+    # Any other seasons to compute the sensitivities for.
+    sweepSeasons = []
+    if ('sweep_seasons' in cargs and args.sweep_seasons is not None):
+        for season in args.sweep_seasons:
+            if (season != args.season and season not in sweepSeasons):
+                sweepSeasons.append(season)
+
+    # Check for a file of RFI ranges.
+    rfiMask = None
+    if ('rfi_mask' in cargs and args.rfi_mask is not None):
+        if (not os.path.isfile(args.rfi_mask)):
+            raise sens.CalcError("Can't find RFI mask file %s." % args.rfi_mask)
+        rfiMask = args.rfi_mask
+
+    # Check how the integration time is to be found in time calculation mode.
+    timeSolver = "analytic"
+    if ('time_solver' in cargs and args.time_solver is not None):
+        timeSolver = args.time_solver
+    if (timeSolver not in [ "analytic", "iterative" ]):
+        raise sens.CalcError("Unknown time solver.")
+
+    # Check the smoothing factors. The first is used for the continuum band, and the
+    # continuum sensitivities are also found with any others.
+    smoothing = args.smoothing
+    if (type(smoothing) is not list):
+        smoothing = [ smoothing ]
+    if (len(smoothing) == 0 or min(smoothing) < 1):
+        raise sens.CalcError("Smoothing factor must be at least 1.")
+
     # Check we have a positive integration time.
     if (args.integration <= 0):
         raise sens.CalcError("Integration time must be greater than 0 minutes.")
@@ -75,6 +174,18 @@ def checkArguments(args):
     if (args.per_ha <= 0):
         raise sens.CalcError("Number of integrations per hour angle is invalid.")
 
+    # Check how the atmosphere is to be averaged over the hour angles; the number of
+    # quadrature nodes is only set if it's not to be sampled perHa times an hour.
+    haNodes = None
+    if ('ha_average' in cargs and args.ha_average is not None and args.ha_average != "sample"):
+        if (args.ha_average != "quadrature"):
+            raise sens.CalcError("Unknown hour angle averaging.")
+        haNodes = 8
+        if ('ha_nodes' in cargs and args.ha_nodes is not None):
+            haNodes = args.ha_nodes
+        if (haNodes < 2):
+            raise sens.CalcError("Number of hour angle quadrature nodes must be at least 2.")
+
     # Check for a specified rest frequency.
     if ('restfreq' in cargs and args.restfreq is not None):
         restfreq = args.restfreq * 1000.0 # Conversion from GHz to MHz.
@@ -131,7 +242,250 @@ def checkArguments(args):
 
     # Return the interpreted values we made.
     return { 'hourAngle_min': hourAngle_min, 'hourAngle_max': hourAngle_max,
-             'restfreq': restfreq }
+             'restfreq': restfreq, 'customWeather': all(customWeather),
+             'sweepSeasons': sweepSeasons, 'rfiMask': rfiMask,
+             'timeSolver': timeSolver, 'haNodes': haNodes, 'smoothing': smoothing }
+
+def getExecutor(args):
+    # Return the pool of worker processes to evaluate the conditions with, or
+    # None if they are to be evaluated one after the other in this process. The
+    # pool is made the first time it is needed and kept for later calculations,
+    # so the noise factor and fill plan caches in its workers stay warm; it is
+    # only replaced when a different number of workers or data bundle is asked for.
+    global executorPool, executorSettings
+    cargs = vars(args)
+    if ('executor' in cargs and args.executor == "process"):
+        workers = None
+        if ('workers' in cargs and args.workers is not None):
+            workers = args.workers
+        settings = (workers, sens.bundleName)
+        if (executorPool is not None and executorSettings != settings):
+            closeExecutor()
+        if (executorPool is None):
+            if (sens.bundleName is not None):
+                # The workers use the same data bundle we do.
+                executorPool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                                      initializer=sens.useBundle,
+                                                                      initargs=(sens.bundleName,))
+            else:
+                executorPool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            executorSettings = settings
+        return executorPool
+    return None
+
+def closeExecutor():
+    # Shut down the pool of worker processes, if we have one.
+    global executorPool, executorSettings
+    if (executorPool is not None):
+        executorPool.shutdown()
+    executorPool = None
+    executorSettings = None
+
+def runTasks(function, tasks, executor):
+    # Run the function for each of the tasks, and return the results in the
+    # same order as the tasks.
+    if (executor is None):
+        return [ function(task) for task in tasks ]
+    return list(executor.map(function, tasks))
+
+def conditionAtmosphere(task):
+    # Make the zenith opacity and sky temperature templates at the continuum
+    # resolution (and for the specific zoom, if required) for a single weather
+    # condition. This may run in a worker process, so everything it needs is
+    # in the task.
+    result = {}
+    result['opacity'] = sens.makeTemplate(task['frequency'], task['bandwidth'], task['continuumResolution'])
+    result['temperature'] = sens.makeTemplate(task['frequency'], task['bandwidth'], task['continuumResolution'])
+    if (task['options']['tolerance'] is not None):
+        # The adaptive sampling fills the continuum templates directly.
+        tempOpacity = result['opacity']
+        tempTemperature = result['temperature']
+    else:
+        tempOpacity = sens.makeTemplate(task['frequency'], task['bandwidth'], task['atmosphereResolution'])
+        tempTemperature = sens.makeTemplate(task['frequency'], task['bandwidth'], task['atmosphereResolution'])
+    pwv = sens.fillAtmosphereTemplate(tempOpacity, tempTemperature,
+                                      (task['weather']['temperature'] + 273.15),
+                                      (task['weather']['pressure'] * 100.0),
+                                      (task['weather']['humidity'] / 100.0),
+                                      task['options'], task['elevations'])
+    #print("found pwv = %.3f m" % pwv[0])
+    if (tempOpacity is not result['opacity']):
+        sens.templateFill(tempOpacity, result['opacity'])
+        sens.templateFill(tempTemperature, result['temperature'])
+    if (task['specificZoom'] is not None):
+        # Make the specific zoom templates if we need to, and fill them from the already
+        # computed templates for the continuum band.
+        sz = task['specificZoom']
+        result['sz-opacity'] = sens.makeTemplate(sz['frequency'], sz['bandwidth'], sz['resolution'])
+        result['sz-temperature'] = sens.makeTemplate(sz['frequency'], sz['bandwidth'], sz['resolution'])
+        sens.templateFill(result['opacity'], result['sz-opacity'])
+        sens.templateFill(result['temperature'], result['sz-temperature'])
+    if ('slant' in tempTemperature):
+        # Interpolate the sky temperature at each elevation onto the continuum (and specific
+        # zoom) channels, to be used directly as the excess temperature.
+        result['slant'] = slantInterpolate(tempTemperature, result['temperature'])
+        if (task['specificZoom'] is not None):
+            result['sz-slant'] = slantInterpolate(tempTemperature, result['sz-temperature'])
+    # Pass back how the atmosphere was calculated.
+    for q in [ 'atmosphereMethod', 'atmosphereError', 'atmosphereSamples', 'atmosphereLayers' ]:
+        if (q in tempOpacity):
+            result[q] = tempOpacity[q]
+    return result
+
+def slantInterpolate(srcTemplate, destTemplate):
+    # Resample the (elevation, frequency) sky temperatures in srcTemplate['slant']
+    # to the channels of destTemplate, which has already been filled with the zenith
+    # sky temperatures from srcTemplate. The ratio to the zenith value varies
+    # smoothly with frequency, so we interpolate that, and the zenith row comes out
+    # exactly the same as the zenith template.
+    return np.array([ destTemplate['value'] *
+                      np.interp(destTemplate['centreFrequency'], srcTemplate['centreFrequency'],
+                                (row / srcTemplate['value']))
+                      for row in srcTemplate['slant'] ])
+
+def conditionNoise(task):
+    # Compute the RMS noise templates and the derived sensitivities for a single
+    # weather condition. This may run in a worker process, so everything it needs
+    # is in the task.
+    return conditionsNoise([ task ])[0]
+
+def conditionsNoise(tasks):
+    # Compute the RMS noise templates and the derived sensitivities for a list of tasks
+    # that differ only in their weather condition (they were made by noiseTask from the
+    # same common inputs and integration time). The noise in each band is calculated for
+    # all the conditions at once, and the results are returned in the same order as
+    # the tasks.
+    results = [ {} for task in tasks ]
+    if (len(tasks) == 0):
+        return results
+    c = tasks[0]
+    # The unsmoothed continuum band gives us the "general" zoom sensitivity, since smoothing
+    # the continuum won't help improve the zoom sensitivity, and the smoothed continuum band
+    # is made from it. We only need the specific zoom band after it is smoothed.
+    bands = [ [ 'continuum', 'continuum-efficiency', 'opacity', 'temperature', 'slant',
+                'continuum-rms', 'sensRes', 'continuum-smooth', 'continuum-smooth-rms', 'sensResSmooth' ] ]
+    if (c['specificZoom'] is not None):
+        bands.append([ 'specificZoom', 'specificZoom-efficiency', 'sz-opacity', 'sz-temperature', 'sz-slant',
+                       None, None, 'specificZoom-smooth', 'specificZoom-rms', 'szSensRes' ])
+    for (tsys, efficiency, opacity, temperature, slant, rms, sensRes,
+         smooth, smoothedRms, smoothSensRes) in bands:
+        # The RMS noise in the band, for each channel.
+        rmsTemplates = sens.calculateRmsConditions(c[tsys], c[efficiency],
+                                                   [ task[opacity] for task in tasks ],
+                                                   [ task[temperature] for task in tasks ],
+                                                   c['hourAngle_min'], c['hourAngle_max'], c['per_ha'],
+                                                   c['nant'], c['integration'], c['imageWeights'],
+                                                   c['sind'], c['cosd'],
+                                                   [ task[slant] for task in tasks ],
+                                                   haNodes=c['haNodes'])
+        # The RMS noise after smoothing.
+        smoothTemplates = [ sens.smoothRms(t, c[smooth]) for t in rmsTemplates ]
+        # Then derive the global average values in the band.
+        if (rms is not None):
+            sensResults = sens.calculateSensitivityConditions(rmsTemplates, c['nant'], c['args'])
+        smoothSensResults = sens.calculateSensitivityConditions(smoothTemplates, c['nant'], c['args'])
+        for i in range(0, len(tasks)):
+            if (rms is not None):
+                results[i][rms] = rmsTemplates[i]
+                results[i][sensRes] = sensResults[i]
+            results[i][smoothedRms] = smoothTemplates[i]
+            results[i][smoothSensRes] = smoothSensResults[i]
+    # The global average values in the continuum band with any other smoothing factors.
+    for i in range(0, len(tasks)):
+        results[i]['sensResExtra'] = []
+    for factor, smooth in c['continuum-smooth-extra']:
+        smoothSensResults = sens.calculateSensitivityConditions([ sens.smoothRms(r['continuum-rms'], smooth)
+                                                                  for r in results ], c['nant'], c['args'])
+        for i in range(0, len(tasks)):
+            results[i]['sensResExtra'].append(smoothSensResults[i])
+    return results
+
+def runNoiseTasks(tasks, executor):
+    # Compute the noise for each of the tasks made by noiseTask, all at once if we're
+    # doing the work here, or one condition per worker otherwise.
+    if (executor is None):
+        return conditionsNoise(tasks)
+    return runTasks(conditionNoise, tasks, executor)
+
+def noiseTask(common, atmosphere, integration):
+    # Make the task for conditionNoise from the inputs that are common to all
+    # the conditions, the templates made by conditionAtmosphere for one
+    # condition, and the integration time.
+    task = dict(common)
+    task['integration'] = integration
+    for q in [ 'opacity', 'temperature', 'sz-opacity', 'sz-temperature', 'slant', 'sz-slant' ]:
+        task[q] = atmosphere.get(q)
+    return task
+
+def conditionSummary(noise, args, synthBeamContinuum, synthBeamZoom):
+    # Make the rounded RMS noise levels, brightness temperature sensitivities and
+    # SEFDs that we output, from the results of conditionNoise for one condition.
+    # The unrounded sensitivities are kept in summary['exact'].
+    summary = { 'rms': {}, 'btrms': {}, 'exact': { 'rms': {}, 'btrms': {} } }
+    sensRes = noise['sensRes']
+    sensResSmooth = noise['sensResSmooth']
+    for t in [ 'continuum', 'spectral', 'zoom' ]:
+        if (t == 'zoom'):
+            # Since we don't make a template for the "general" zoom, we have to manually
+            # adjust for the zoom smoothing factor now.
+            # The RMS noise goes down with the square-root of the smoothed bandwidth over the
+            # normal bandwidth.
+            sensRes['rms'][t] /= math.sqrt(float(args.zoom_smoothing))
+            summary['rms'][t] = float("%.3f" % sensRes['rms'][t])
+            summary['exact']['rms'][t] = sensRes['rms'][t]
+            # Calculate the brightness temperature sensitivity using the synthesised beam at
+            # the centre of the continuum band.
+            bts = sens.brightnessTemperatureSensitivity(sensRes['rms'][t], synthBeamContinuum,
+                                                        args.frequency)
+        else:
+            # We calculate the continuum and continuum-spectral sensitivities in the
+            # same way.
+            summary['rms'][t] = float("%.3f" % sensResSmooth['rms'][t])
+            summary['exact']['rms'][t] = sensResSmooth['rms'][t]
+            # Calculate the brightness temperature sensitivity using the synthesised beam at
+            # the centre of the continuum band.
+            bts = sens.brightnessTemperatureSensitivity(sensResSmooth['rms'][t], synthBeamContinuum,
+                                                        args.frequency)
+        # We put the brightness sensitivity in mK for readability.
+        summary['btrms'][t] = float("%.2f" % (bts * 1000.0))
+        summary['exact']['btrms'][t] = bts * 1000.0
+    # We keep the SEFDs in Jy.
+    summary['SEFD'] = {
+        'antenna': float( "%.1f" % (sensRes['sefd']['antenna']) ),
+        'array': float( "%.1f" % (sensRes['sefd']['array'])) }
+
+    if ('szSensRes' in noise):
+        # The spectral RMS of the specific zoom band.
+        summary['rms']['specificZoom'] = float("%.3f" % noise['szSensRes']['rms']['spectral'])
+        summary['exact']['rms']['specificZoom'] = noise['szSensRes']['rms']['spectral']
+        # Calculate the brightness temperature sensitivity using the synthesised beam at the
+        # nominated specific zoom band frequency.
+        bts = sens.brightnessTemperatureSensitivity(noise['szSensRes']['rms']['spectral'], synthBeamZoom,
+                                                    args.zoomfreq)
+        # The brightness sensitivity is again in mK.
+        summary['btrms']['specificZoom'] = float("%.2f" % (bts * 1000.0))
+        summary['exact']['btrms']['specificZoom'] = bts * 1000.0
+    return summary
+
+def smoothingSummary(sensResExtra, factors, resolution, synthBeamContinuum, frequency):
+    # Make the output for the continuum sensitivities with each of the other smoothing
+    # factors, from the sensitivities for each weather condition.
+    summary = {}
+    for i, factor in enumerate(factors):
+        smoothed = {
+            'channel_bandwidth': (resolution * float(factor)),
+            'effective_bandwidth': sensResExtra['typical'][i]['bandwidth']['unflagged'],
+            'rms_noise_level': {},
+            'brightness_temperature_sensitivity': {} }
+        for t in [ 'continuum', 'spectral' ]:
+            rms = [ sensResExtra[c][i]['rms'][t] for c in [ 'best', 'typical', 'worst' ] ]
+            smoothed['rms_noise_level'][t] = [ float("%.3f" % r) for r in rms ]
+            # The brightness sensitivity is in mK.
+            smoothed['brightness_temperature_sensitivity'][t] = [
+                float("%.2f" % (sens.brightnessTemperatureSensitivity(r, synthBeamContinuum, frequency) * 1000.0))
+                for r in rms ]
+        summary["%d" % factor] = smoothed
+    return summary
 
 def thingToString(t):
     if (type(t) is str):
@@ -162,7 +516,125 @@ def humanOutputDict(d, description, units, l):
                 ov = thingToString(d[p])
                 print("%s %s = %s %s" % ((" " * l), od, ov, ou))
 
-def main(args):
+def canonicalArguments(args):
+    # Return a copy of the arguments with the floating point values rounded to the
+    # precision that matters.
+    canonical = copy.copy(args)
+    cargs = vars(args)
+    for a in cargs:
+        if (isinstance(cargs[a], float)):
+            if (a in argumentPrecision):
+                setattr(canonical, a, round(cargs[a], argumentPrecision[a]))
+            else:
+                setattr(canonical, a, float("%.6g" % cargs[a]))
+    return canonical
+
+def requestKey(args):
+    # Return a name for the calculation that the (canonical) arguments ask for, which
+    # is the same for every request that would give the same result.
+    cargs = vars(args)
+    request = dict(argumentDefaults)
+    for a in cargs:
+        if (a not in resultIndependentArguments and cargs[a] is not None):
+            request[a] = cargs[a]
+            if (isinstance(cargs[a], (int, float)) and not isinstance(cargs[a], bool)):
+                request[a] = float(cargs[a])
+    if ('configuration' in request):
+        request['configuration'] = configurationAliases.get(request['configuration'],
+                                                            request['configuration'])
+    if (not isinstance(request['smoothing'], list)):
+        request['smoothing'] = [ request['smoothing'] ]
+    request['smoothing'] = [ int(f) for f in request['smoothing'] ]
+    if (request['ha_average'] == "sample"):
+        # The number of nodes is only used for quadrature.
+        del request['ha_nodes']
+    if (all((w in request) for w in [ 'temperature', 'pressure', 'humidity' ])):
+        # The season is replaced by the weather we were given.
+        request['season'] = "CUSTOM"
+    if ('rfi_mask' in request and os.path.isfile(request['rfi_mask'])):
+        # The mask file may have changed.
+        request['rfi_mask'] = [ request['rfi_mask'], os.path.getmtime(request['rfi_mask']) ]
+    return json.dumps(request, sort_keys=True)
+
+def findResult(key):
+    # Return the result kept for a request, or None if we don't have it (any more).
+    if (key in resultCache):
+        if ((time.time() - resultCache[key]['time']) <= resultCacheLifetime):
+            resultCache.move_to_end(key)
+            resultCacheCounts['hits'] += 1
+            return resultCache[key]
+        del resultCache[key]
+        resultCacheCounts['expired'] += 1
+    resultCacheCounts['misses'] += 1
+    return None
+
+def keepResult(key, result):
+    # Keep the result of a request, dropping the least recently used results if
+    # there are too many.
+    result['time'] = time.time()
+    resultCache[key] = result
+    while (len(resultCache) > resultCacheSize):
+        resultCache.popitem(last=False)
+        resultCacheCounts['evicted'] += 1
+
+def resultCacheStatistics():
+    # Return how well the result cache of this process is working. With several
+    # worker processes, these are the statistics of only one of them, which is
+    # identified by its pid.
+    statistics = dict(resultCacheCounts)
+    statistics['scope'] = "process"
+    statistics['pid'] = os.getpid()
+    statistics['size'] = len(resultCache)
+    statistics['capacity'] = resultCacheSize
+    statistics['lifetime'] = resultCacheLifetime
+    return statistics
+
+def cachedMain(args):
+    # Run the calculator, unless the same calculation has been made recently, in which
+    # case we output its result again, with new copies of its plots. Requests are the
+    # same if they are after rounding their values, filling in the defaults and using
+    # the same name for each array configuration.
+    canonical = canonicalArguments(args)
+    key = requestKey(canonical)
+    result = findResult(key)
+    if (result is None):
+        result = {}
+        main(canonical, result)
+        # Keep the plots themselves, since their files belong to this request.
+        for p in result['plots']:
+            with open(result['plots'][p], "rb") as f:
+                result['plots'][p] = f.read()
+        keepResult(key, result)
+        return
+
+    output = copy.deepcopy(result['output'])
+    output['parameters']['configuration'] = args.configuration
+    for p, suffix in [ ('output_plot', '.png'), ('output_zoom_plot', '.sz.png') ]:
+        if (p in result['plots']):
+            outfile = args.output.replace('.png', '') + suffix
+            with open(args.plot_location + '/' + outfile, "wb") as f:
+                f.write(result['plots'][p])
+            output[p] = outfile
+    if (args.human_readable):
+        humanOutputDict(output, output['description'], output['units'], 0)
+    else:
+        print (json.dumps(output))
+
+def main(args, keep=None):
+    # Calculate the sensitivity for the arguments, and output the results. If keep
+    # is a dict, the output and the names of the plot files are also put in it.
+    # The conditions are evaluated in worker processes if the user asked for that.
+    executor = getExecutor(args)
+    try:
+        calculate(args, keep, executor)
+    except concurrent.futures.BrokenExecutor:
+        # A worker has died, and the pool can't be used again.
+        closeExecutor()
+        raise
+
+def calculate(args, keep, executor):
+    # Do the calculation for main, evaluating the conditions with the executor (or
+    # in this process if it is None).
     ####################################################################################################
     # Do some argument checking first.
     try:
@@ -196,6 +668,11 @@ def main(args):
     hourAngle_min = argsInterpreted['hourAngle_min']
     hourAngle_max = argsInterpreted['hourAngle_max']
 
+    # The smoothing factor for the continuum band, and any others we also want the
+    # continuum sensitivities for.
+    smoothing = argsInterpreted['smoothing'][0]
+    extraSmoothing = argsInterpreted['smoothing'][1:]
+
     coshaAtElLimit = sinel / (cosd * sens.cosl) - (sind * sens.sinl) / (cosd * sens.cosl)
     if (abs(coshaAtElLimit) <= 1):
         haAtElLimit = math.degrees(math.acos(coshaAtElLimit)) # in degrees
@@ -392,30 +869,35 @@ def main(args):
     # Do template flagging.
     if (not args.quiet):
         print ("MESSAGE: Flagging...")
-    if (args.rfi):
-        sens.flagTemplate(workArea['continuum'], 'rfi')
+    if (args.rfi or argsInterpreted['rfiMask'] is not None):
+        sens.flagTemplate(workArea['continuum'], 'rfi', argsInterpreted['rfiMask'])
     #\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
 
 
 
     ####################################################################################################
-    # Do any bin smoothing now. We need to smooth the system temperature and efficiency templates.
+    # Set up any bin smoothing now. The RMS noise in each smoothed channel is found from the
+    # RMS noise of the unsmoothed channels in it, so we only need the smoothed channels.
     # The continuum frequency resolution after smoothing.
-    contSmoothRes = workArea['resolutions']['continuum'] * float(args.smoothing)
-    sens.addToOutput(output, 'source_imaging', 'smoothing_window', args.smoothing,
+    contSmoothRes = workArea['resolutions']['continuum'] * float(smoothing)
+    sens.addToOutput(output, 'source_imaging', 'smoothing_window', smoothing,
                      "Smoothing Window", "channels")
     # Check that we will end up with at least 2 channels per subband, otherwise we die.
-    if ((128.0 * args.number_subbands / contSmoothRes) < (2 * args.number_subbands)):
-        if (args.human_readable):
-            print ("FATAL: Smoothing factor too large.")
-        else:
-            print ('{ "error": "Smoothing factor too large." }')
-        sys.exit(-1)
-    # Make the smoothed templates and fill them from the unsmoothed templates.
+    for factor in argsInterpreted['smoothing']:
+        if ((128.0 * args.number_subbands / (workArea['resolutions']['continuum'] * float(factor))) <
+            (2 * args.number_subbands)):
+            if (args.human_readable):
+                print ("FATAL: Smoothing factor too large.")
+            else:
+                print ('{ "error": "Smoothing factor too large." }')
+            sys.exit(-1)
+    # Make the smoothed templates.
     workArea['continuum-smooth'] = sens.makeTemplate(args.frequency, (128.0 * args.number_subbands), contSmoothRes)
-    sens.templateFill(workArea['continuum'], workArea['continuum-smooth'])
-    workArea['continuum-efficiency-smooth'] = sens.makeTemplate(args.frequency, (128.0 * args.number_subbands), contSmoothRes)
-    sens.templateFill(workArea['continuum-efficiency'], workArea['continuum-efficiency-smooth'])
+    # And those for the other smoothing factors.
+    workArea['continuum-smooth-extra'] = [ (factor, sens.makeTemplate(args.frequency, (128.0 * args.number_subbands),
+                                                                      (workArea['resolutions']['continuum'] *
+                                                                       float(factor))))
+                                           for factor in extraSmoothing ]
     sens.addToOutput(output, 'continuum', 'channel_bandwidth', contSmoothRes,
                      "Channel Bandwidth", "MHz")
 
@@ -444,10 +926,6 @@ def main(args):
         # Make the specific zoom smoothed template.
         workArea['specificZoom-smooth'] = sens.makeTemplate(closestCentreFreq, szBandwidths,
                                                             zoomSmoothRes)
-        sens.templateFill(workArea['specificZoom'], workArea['specificZoom-smooth'])
-        workArea['specificZoom-efficiency-smooth'] = sens.makeTemplate(closestCentreFreq, szBandwidths,
-                                                                       zoomSmoothRes)
-        sens.templateFill(workArea['specificZoom-efficiency'], workArea['specificZoom-efficiency-smooth'])
     #\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
     
 
@@ -496,6 +974,7 @@ def main(args):
     sens.addToOutput(output, 'source_imaging', 'synthesised_beam_size_range', 
                 [ synthBeamLowFreq, synthBeamHighFreq ],
                 "Synthesised Beam Size Range (FWHM)", "arcsec")
+    synthBeamZoom = None
     if (specificZoomCalc):
         # The synthesised beam for the frequency the user wanted in the specific zoom band.
         synthBeamZoom = sens.synthesisedBeamSize(args.zoomfreq, maxBaselineLength, args.dec, hourAngle_min,
@@ -531,8 +1010,8 @@ def main(args):
     contResCosm = (output['continuum']['highz_spectral_bandwidth'] /
                    float(len(workArea['continuum']['centreFrequency'])))
     # We now compensate for continuum band smoothing.
-    chanRes = float("%.3f" % (contRes * float(args.smoothing)))
-    chanResCosm = float("%.3f" % (contResCosm * float(args.smoothing)))
+    chanRes = float("%.3f" % (contRes * float(smoothing)))
+    chanResCosm = float("%.3f" % (contResCosm * float(smoothing)))
     sens.addToOutput(output, 'continuum', 'spectral_channel_resolution', chanRes,
                      "Spectral Channel Resolution", "km/s")
     sens.addToOutput(output, 'continuum', 'highz_spectral_channel_resolution', chanResCosm,
@@ -619,69 +1098,29 @@ def main(args):
     if (not args.quiet):
         print ("MESSAGE: Calculating weather effects...")
 
-    # The weather conditions that we will use for computing the atmosphere later.
-    weatherConditions = {
-        'JAN': { 'best': { 'temperature': 32.7, 'pressure': 986.8, 'humidity': 27.5 },
-                 'typical': { 'temperature': 30.6, 'pressure': 989.8, 'humidity': 50.5 },
-                 'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } }, 
-        'FEB': { 'best': { 'temperature': 29.6, 'pressure': 987.2, 'humidity': 36.0 },
-                 'typical': { 'temperature': 24.2, 'pressure': 989.6, 'humidity': 65.0 },
-                 'worst': { 'temperature': 23.7, 'pressure': 990.4, 'humidity': 86.0 } },
-        'MAR': { 'best': { 'temperature': 27.4, 'pressure': 989.7, 'humidity': 33.0 },
-                 'typical': { 'temperature': 18.9, 'pressure': 995.5, 'humidity': 82.0 },
-                 'worst': { 'temperature': 28.2, 'pressure': 988.0, 'humidity': 69.7 } },
-        'APR': { 'best': { 'temperature': 9.5, 'pressure': 1011.7, 'humidity': 76.0 },
-                 'typical': { 'temperature': 16.8, 'pressure': 1013.4, 'humidity': 73.0 },
-                 'worst': { 'temperature': 19.7, 'pressure': 1001.6, 'humidity': 85.0 } },
-        'MAY': { 'best': { 'temperature': 19.6, 'pressure': 1008.0, 'humidity': 31.0 },
-                 'typical': { 'temperature': 9.7, 'pressure': 1009.7, 'humidity': 86.0 },
-                 'worst': { 'temperature': 18.7, 'pressure': 1012.3, 'humidity': 78.0 } },
-        'JUN': { 'best': { 'temperature': -1.6, 'pressure': 1016.9, 'humidity': 95.0 },
-                 'typical': { 'temperature': 8.1, 'pressure': 1002.7, 'humidity': 95.0 },
-                 'worst': { 'temperature': 15.0, 'pressure': 997.7, 'humidity': 101.1 } },
-        'JUL': { 'best': { 'temperature': 1.9, 'pressure': 1019.0, 'humidity': 91.0 },
-                 'typical': { 'temperature': 18.8, 'pressure': 999.4, 'humidity': 50.5 },
-                 'worst': { 'temperature': 15.6, 'pressure': 1004.2, 'humidity': 100.0 } },
-        'AUG': { 'best': { 'temperature': 3.6, 'pressure': 1017.2, 'humidity': 73.0 },
-                 'typical': { 'temperature': 8.2, 'pressure': 1010.5, 'humidity': 87.0 },
-                 'worst': { 'temperature': 16.6, 'pressure': 1012.4, 'humidity': 93.0 } },
-        'SEP': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
-                 'typical': { 'temperature': 15.4, 'pressure': 993.5, 'humidity': 61.0 },
-                 'worst': { 'temperature': 20.3, 'pressure': 993.6, 'humidity': 66.0 } },
-        'OCT': { 'best': { 'temperature': 26.6, 'pressure': 986.6, 'humidity': 22.0 },
-                 'typical': { 'temperature': 28.6, 'pressure': 986.5, 'humidity': 33.0 },
-                 'worst': { 'temperature': 25.8, 'pressure': 996.6, 'humidity': 57.0 } },
-        'NOV': { 'best': { 'temperature': 32.5, 'pressure': 986.7, 'humidity': 19.7 },
-                 'typical': { 'temperature': 22.1, 'pressure': 990.2, 'humidity': 58.0 },
-                 'worst': { 'temperature': 24.7, 'pressure': 989.5, 'humidity': 71.9 } },
-        'DEC': { 'best': { 'temperature': 29.5, 'pressure': 986.8, 'humidity': 30.0 },
-                 'typical': { 'temperature': 21.8, 'pressure': 987.0, 'humidity': 70.0 },
-                 'worst': { 'temperature': 27.9, 'pressure': 984.5, 'humidity': 71.0 } },
-        'SUMMER': { 'best': { 'temperature': 29.5, 'pressure': 986.8, 'humidity': 30.0 },
-                    'typical': { 'temperature': 29.9, 'pressure': 989.1, 'humidity': 49.0 },
-                    'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } },
-        'AUTUMN': { 'best': { 'temperature': 19.5, 'pressure': 1008.0, 'humidity': 31.0 },
-                    'typical': { 'temperature': 23.6, 'pressure': 1016.5, 'humidity': 51.0 },
-                    'worst': { 'temperature': 28.2, 'pressure': 988.0, 'humidity': 69.7 } },
-        'WINTER': { 'best': { 'temperature': -1.6, 'pressure': 1016.9, 'humidity': 95.0 },
-                    'typical': { 'temperature': 9.7, 'pressure': 1004.6, 'humidity': 83.0 },
-                    'worst': { 'temperature': 15.6, 'pressure': 1004.2, 'humidity': 100.0 } },
-        'SPRING': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
-                    'typical': { 'temperature': 14.9, 'pressure': 997.5, 'humidity': 68.7 },
-                    'worst': { 'temperature': 24.7, 'pressure': 989.5, 'humidity': 71.9 } },
-        'APRS': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
-                  'typical': { 'temperature': 12.7, 'pressure': 1011.1, 'humidity': 72.0 },
-                  'worst': { 'temperature': 19.7, 'pressure': 1001.6, 'humidity': 85.0 } },
-        'OCTS': { 'best': { 'temperature': 26.6, 'pressure': 986.6, 'humidity': 22.0 },
-                  'typical': { 'temperature': 22.1, 'pressure': 988.7, 'humidity': 66.7 },
-                  'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } },
-        'ANNUAL': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
-                    'typical': { 'temperature': 16.6, 'pressure': 1010.3, 'humidity': 57.5 },
-                    'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } }
-        }
-
-    # This is the frequency resolution of the atmospheric corrections.
+    # The weather conditions that we will use for computing the atmosphere later. We
+    # may add the user's own weather to them, so we take a copy.
+    weatherConditions = dict(sens.weatherConditions)
+    if (argsInterpreted['customWeather']):
+        # The user has given us the weather, which we use for all the conditions.
+        args.season = 'CUSTOM'
+        weatherConditions['CUSTOM'] = {}
+        for condition in [ 'best', 'typical', 'worst' ]:
+            weatherConditions['CUSTOM'][condition] = { 'temperature': args.temperature,
+                                                       'pressure': args.pressure,
+                                                       'humidity': args.humidity }
+
+    # How the atmosphere is to be calculated.
+    workArea['atmosphereOptions'] = sens.atmosphereOptions(args)
+    # This is the frequency resolution of the atmospheric corrections. When the
+    # atmosphere is sampled adaptively, it is interpolated straight to the continuum
+    # channels.
     atmosRes = max(workArea['resolutions']['continuum'], args.per_freq)
+    if (workArea['atmosphereOptions']['tolerance'] is not None):
+        atmosRes = workArea['resolutions']['continuum']
+        sens.addToOutput(output, 'parameters', 'atmosphere_tolerance',
+                         workArea['atmosphereOptions']['tolerance'],
+                         "Fractional accuracy of adaptively sampled atmospheric parameters", None)
     sens.addToOutput(output, 'parameters', 'atmosphere_frequency_resolution', atmosRes,
                      "Frequency resolution of atmospheric parameters", "MHz")
     # Include the weather parameters we use in the output.
@@ -694,36 +1133,74 @@ def main(args):
     output['units']['humidity'] = "%"
     output['units']['pressure'] = "hPa"
 
+    # Check that any other seasons we have been asked for are known.
+    for season in argsInterpreted['sweepSeasons']:
+        if (season not in weatherConditions):
+            if (args.human_readable):
+                print ("FATAL: Unknown season %s." % season)
+            else:
+                print ('{ "error": "Unknown season %s." }' % season)
+            sys.exit(-1)
+    seasons = [ args.season ] + argsInterpreted['sweepSeasons']
+    # The elevations of the source at each hour angle the atmosphere is evaluated at,
+    # if the atmosphere is to be calculated along the line of sight.
+    elevations = None
+    if (workArea['atmosphereOptions']['engine'] == "slant"):
+        elevations = [ math.asin(e) for e in sens.haSamples(hourAngle_min, hourAngle_max, args.per_ha,
+                                                            sind, cosd, argsInterpreted['haNodes'])['sinel'] ]
+        sens.addToOutput(output, 'parameters', 'atmosphere_engine', "slant",
+                         "Atmosphere calculated along the line of sight", None)
+
     # Form the opacity and temperature templates for each of the weather conditions
-    # (best, typical, worst).
+    # (best, typical, worst) in each season.
+    atmosphereTasks = []
+    for season in seasons:
+        for condition in weatherConditions[season]:
+            task = { 'season': season, 'condition': condition,
+                     'weather': weatherConditions[season][condition],
+                     'frequency': args.frequency, 'bandwidth': (128.0 * args.number_subbands),
+                     'continuumResolution': workArea['resolutions']['continuum'],
+                     'atmosphereResolution': atmosRes,
+                     'options': workArea['atmosphereOptions'], 'specificZoom': None,
+                     'elevations': elevations }
+            if (specificZoomCalc):
+                task['specificZoom'] = { 'frequency': closestCentreFreq, 'bandwidth': szBandwidths,
+                                         'resolution': workArea['resolutions']['zoom'] }
+            atmosphereTasks.append(task)
+    atmosphereResults = runTasks(conditionAtmosphere, atmosphereTasks, executor)
+    workArea['atmosphere'] = {}
     workArea['opacity'] = {}
     workArea['temperature'] = {}
     workArea['sz-opacity'] = {}
     workArea['sz-temperature'] = {}
-    for condition in weatherConditions[args.season]:
-        # Make the continuum templates first.
-        tempOpacity = sens.makeTemplate(args.frequency, (128.0 * args.number_subbands), atmosRes)
-        tempTemperature = sens.makeTemplate(args.frequency, (128.0 * args.number_subbands), atmosRes)
-        workArea['opacity'][condition] = sens.makeTemplate(args.frequency, (128.0 * args.number_subbands),
-                                                      workArea['resolutions']['continuum'])
-        workArea['temperature'][condition] = sens.makeTemplate(args.frequency, (128.0 * args.number_subbands),
-                                                          workArea['resolutions']['continuum'])
-        pwv = sens.fillAtmosphereTemplate(tempOpacity, tempTemperature, 
-                                          (weatherConditions[args.season][condition]['temperature'] + 273.15),
-                                          (weatherConditions[args.season][condition]['pressure'] * 100.0),
-                                          (weatherConditions[args.season][condition]['humidity'] / 100.0))
-        #print("found pwv = %.3f m" % pwv[0])
-        sens.templateFill(tempOpacity, workArea['opacity'][condition])
-        sens.templateFill(tempTemperature, workArea['temperature'][condition])
+    for task, result in zip(atmosphereTasks, atmosphereResults):
+        season = task['season']
+        condition = task['condition']
+        if (season not in workArea['atmosphere']):
+            workArea['atmosphere'][season] = {}
+        workArea['atmosphere'][season][condition] = result
+        if (season != args.season):
+            continue
+        workArea['opacity'][condition] = result['opacity']
+        workArea['temperature'][condition] = result['temperature']
         if (specificZoomCalc):
-            # Make the specific zoom templates if we need to, and fill them from the already
-            # computed templates for the continuum band.
-            workArea['sz-opacity'][condition] = sens.makeTemplate(closestCentreFreq, szBandwidths,
-                                                             workArea['resolutions']['zoom'])
-            workArea['sz-temperature'][condition] = sens.makeTemplate(closestCentreFreq, szBandwidths,
-                                                                 workArea['resolutions']['zoom'])
-            sens.templateFill(workArea['opacity'][condition], workArea['sz-opacity'][condition])
-            sens.templateFill(workArea['temperature'][condition], workArea['sz-temperature'][condition])
+            workArea['sz-opacity'][condition] = result['sz-opacity']
+            workArea['sz-temperature'][condition] = result['sz-temperature']
+        if ('atmosphereSamples' in result):
+            # Say how many frequencies the model atmosphere was needed at.
+            sens.addToOutput(output, 'parameters', [ 'atmosphere_model_frequencies', condition ],
+                             result['atmosphereSamples'],
+                             "Number of frequencies the model atmosphere was calculated at", None)
+        if ('atmosphereLayers' in result):
+            # Say how many layers the model atmosphere needed.
+            sens.addToOutput(output, 'parameters', [ 'atmosphere_layers', condition ],
+                             result['atmosphereLayers'],
+                             "Number of layers in the model atmosphere", None)
+        if (result['atmosphereMethod'] == "lookup"):
+            # Tell the user how accurate the interpolated atmosphere is.
+            sens.addToOutput(output, 'parameters', 'atmosphere_lookup_error', result['atmosphereError'],
+                             "Maximum atmosphere table interpolation error (opacity fraction, sky temperature)",
+                             None)
     #\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
 
 
@@ -734,8 +1211,8 @@ def main(args):
         print ("MESSAGE: Calculating sensitivities...")
     workArea['continuum-rms'] = {}
     workArea['continuum-smooth-rms'] = {}
+    workArea['sensResExtra'] = {}
     workArea['specificZoom-rms'] = {}
-    computeBands = { 'continuum': 0, 'spectral': 0, 'zoom': 0 }
     workArea['rms'] = {
         'continuum': {},
         'spectral': {},
@@ -748,21 +1225,39 @@ def main(args):
         'zoom': {},
         'specificZoom': {}
     }
+    # The unrounded sensitivities for each condition.
+    workArea['exact'] = {}
     workArea['SEFD'] = {}
 
+    # Everything the noise calculations need, apart from the atmosphere and the
+    # integration time.
+    noiseCommon = { 'continuum': workArea['continuum'],
+                    'continuum-efficiency': workArea['continuum-efficiency'],
+                    'continuum-smooth': workArea['continuum-smooth'],
+                    'continuum-smooth-extra': workArea['continuum-smooth-extra'],
+                    'specificZoom': None, 'specificZoom-efficiency': None, 'specificZoom-smooth': None,
+                    'hourAngle_min': hourAngle_min, 'hourAngle_max': hourAngle_max,
+                    'per_ha': args.per_ha, 'nant': nant, 'imageWeights': imageWeights,
+                    'sind': sind, 'cosd': cosd, 'haNodes': argsInterpreted['haNodes'],
+                    'args': args }
+    if (specificZoomCalc):
+        noiseCommon['specificZoom'] = workArea['specificZoom']
+        noiseCommon['specificZoom-efficiency'] = workArea['specificZoom-efficiency']
+        noiseCommon['specificZoom-smooth'] = workArea['specificZoom-smooth']
+
     # Sensitivities are computed for each of the different weather conditions we expect.
     sensitivityReached = False
+    timeSolved = False
     while (sensitivityReached == False):
-        for condition in weatherConditions[args.season]:
-            # The RMS noise in the smoothed continuum band, for each channel.
-            workArea['continuum-smooth-rms'][condition] = sens.calculateRms(workArea['continuum-smooth'],
-                                                                       workArea['continuum-efficiency-smooth'],
-                                                                       workArea['opacity'][condition],
-                                                                       workArea['temperature'][condition],
-                                                                       hourAngle_min, hourAngle_max, args.per_ha,
-                                                                       nant, args.integration, imageWeights, sind, cosd)
-            # Then derive the global average values in the continuum band.
-            sensResSmooth = sens.calculateSensitivity(workArea['continuum-smooth-rms'][condition], nant, args)
+        conditions = list(weatherConditions[args.season])
+        noiseResults = runNoiseTasks([ noiseTask(noiseCommon, workArea['atmosphere'][args.season][condition],
+                                                 args.integration) for condition in conditions ],
+                                     executor)
+        for condition, noise in zip(conditions, noiseResults):
+            workArea['continuum-smooth-rms'][condition] = noise['continuum-smooth-rms']
+            workArea['continuum-rms'][condition] = noise['continuum-rms']
+            workArea['sensResExtra'][condition] = noise['sensResExtra']
+            sensResSmooth = noise['sensResSmooth']
             # Check whether we have any unflagged continuum channels.
             if (sensResSmooth['bandwidth']['unflagged'] < 1.0):
                 if (args.human_readable):
@@ -770,65 +1265,16 @@ def main(args):
                 else:
                     print ('{ "error": "No continuum bandwidth remains unflagged." }')
                 sys.exit(-1)
-
-            # We get the "general" zoom sensitivity from the unsmoothed continuum data, since smoothing
-            # the continuum won't help improve the zoom sensitivity.
-            workArea['continuum-rms'][condition] = sens.calculateRms(workArea['continuum'],
-                                                                workArea['continuum-efficiency'],
-                                                                workArea['opacity'][condition],
-                                                                workArea['temperature'][condition],
-                                                                hourAngle_min, hourAngle_max, args.per_ha,
-                                                                nant, args.integration, imageWeights, sind, cosd)
-            # Then derive the global average values in the "general" zoom band.
-            sensRes = sens.calculateSensitivity(workArea['continuum-rms'][condition], nant, args)
-
             if (specificZoomCalc):
-                # The RMS noise in the smoothed specific zoom band, for each channel.
-                workArea['specificZoom-rms'][condition] = sens.calculateRms(workArea['specificZoom-smooth'],
-                                                                       workArea['specificZoom-efficiency-smooth'],
-                                                                       workArea['sz-opacity'][condition],
-                                                                       workArea['sz-temperature'][condition],
-                                                                       hourAngle_min, hourAngle_max, args.per_ha,
-                                                                       nant, args.integration, imageWeights, sind, cosd)
-                # Then derive the global average values in the specific zoom band.
-                szSensRes = sens.calculateSensitivity(workArea['specificZoom-rms'][condition], nant, args)
-
-            for t in computeBands:
-                if (t == 'zoom'):
-                    # Since we don't make a template for the "general" zoom, we have to manually
-                    # adjust for the zoom smoothing factor now.
-                    # The RMS noise goes down with the square-root of the smoothed bandwidth over the
-                    # normal bandwidth.
-                    sensRes['rms'][t] /= math.sqrt(float(args.zoom_smoothing))
-                    workArea['rms'][t][condition] = float("%.3f" % sensRes['rms'][t])
-                    # Calculate the brightness temperature sensitivity using the synthesised beam at
-                    # the centre of the continuum band.
-                    bts = sens.brightnessTemperatureSensitivity(sensRes['rms'][t], synthBeamContinuum,
-                                                           args.frequency)
-                else:
-                    # We calculate the continuum and continuum-spectral sensitivities in the
-                    # same way.
-                    workArea['rms'][t][condition] = float("%.3f" % sensResSmooth['rms'][t])
-                    # Calculate the brightness temperature sensitivity using the synthesised beam at
-                    # the centre of the continuum band.
-                    bts = sens.brightnessTemperatureSensitivity(sensResSmooth['rms'][t], synthBeamContinuum,
-                                                           args.frequency)
-                # We put the brightness sensitivity in mK for readability.
-                workArea['btrms'][t][condition] = float("%.2f" % (bts * 1000.0))
-                # We keep the SEFDs in Jy.
-                workArea['SEFD'][condition] = {
-                    'antenna': float( "%.1f" % (sensRes['sefd']['antenna']) ),
-                    'array': float( "%.1f" % (sensRes['sefd']['array'])) }
+                workArea['specificZoom-rms'][condition] = noise['specificZoom-rms']
 
-            if (specificZoomCalc):
-                # The spectral RMS of the specific zoom band.
-                workArea['rms']['specificZoom'][condition] = float("%.3f" % szSensRes['rms']['spectral'])
-                # Calculate the brightness temperature sensitivity using the synthesised beam at the
-                # nominated specific zoom band frequency.
-                bts = sens.brightnessTemperatureSensitivity(szSensRes['rms']['spectral'], synthBeamZoom,
-                                                       args.zoomfreq)
-                # The brightness sensitivity is again in mK.
-                workArea['btrms']['specificZoom'][condition] = float("%.2f" % (bts * 1000.0))
+            summary = conditionSummary(noise, args, synthBeamContinuum,
+                                       synthBeamZoom)
+            for t in summary['rms']:
+                workArea['rms'][t][condition] = summary['rms'][t]
+                workArea['btrms'][t][condition] = summary['btrms'][t]
+            workArea['SEFD'][condition] = summary['SEFD']
+            workArea['exact'][condition] = summary['exact']
 
         # Check if we need to adjust the integration time.
         if (args.calculate_time == False):
@@ -857,15 +1303,28 @@ def main(args):
             elif (args.target_brightness_temperature):
                 modeTarget = 'btrms'
 
-            compareSensitivity = workArea[modeTarget][bandTarget][conditionTarget]
-            # Calculate the ratio of the obtained sensitivity to that desired.
-            sensRatio = compareSensitivity / args.target
-            # We stop if we're within 1% of the target sensitivity.
-            if (abs(sensRatio - 1.0) < 0.01):
-                sensitivityReached = True
+            if (argsInterpreted['timeSolver'] == "analytic"):
+                if (timeSolved):
+                    # The sensitivities are now those at the required time.
+                    sensitivityReached = True
+                else:
+                    # The RMS noise goes exactly as 1 / sqrt(time), so the time needed
+                    # to reach the target follows from the unrounded sensitivity. We
+                    # go around once more to get everything at that time.
+                    compareSensitivity = workArea['exact'][conditionTarget][modeTarget][bandTarget]
+                    sensRatio = compareSensitivity / args.target
+                    args.integration *= sensRatio * sensRatio
+                    timeSolved = True
             else:
-                # Change the integration time appropriately.
-                args.integration *= sensRatio * sensRatio
+                compareSensitivity = workArea[modeTarget][bandTarget][conditionTarget]
+                # Calculate the ratio of the obtained sensitivity to that desired.
+                sensRatio = compareSensitivity / args.target
+                # We stop if we're within 1% of the target sensitivity.
+                if (abs(sensRatio - 1.0) < 0.01):
+                    sensitivityReached = True
+                else:
+                    # Change the integration time appropriately.
+                    args.integration *= sensRatio * sensRatio
             
 
     # We now stick all this information into the output.
@@ -883,6 +1342,12 @@ def main(args):
                   workArea['continuum-rms']['typical']['systemTemperature'],
                   workArea['continuum-rms']['worst']['systemTemperature'] ],
                 "System Temperature", "K")
+    if (argsInterpreted['haNodes'] is not None):
+        # The estimated error in the system temperatures from averaging over the hour angles.
+        sens.addToOutput(output, 'sensitivities', 'hour_angle_average_error',
+                    [ float("%.3g" % workArea['continuum-rms'][c]['haError'])
+                      for c in [ 'best', 'typical', 'worst' ] ],
+                    "Hour Angle Averaging Error", "K")
 
     # The continuum sensitivities, for each weather condition, in mJy/beam.
     sens.addToOutput(output, 'sensitivities', [ 'rms_noise_level', 'continuum' ],
@@ -952,6 +1417,46 @@ def main(args):
     sens.addToOutput(output, 'source_imaging', 'integration_time', inttime,
                 "Time on Source", "minutes")
 
+    if (len(extraSmoothing) > 0):
+        # The continuum sensitivities with each of the other smoothing factors, with the same
+        # integration time.
+        output['smoothing_sweep'] = smoothingSummary(workArea['sensResExtra'], extraSmoothing,
+                                                     workArea['resolutions']['continuum'],
+                                                     synthBeamContinuum, args.frequency)
+
+    if (len(argsInterpreted['sweepSeasons']) > 0):
+        # Compute the same sensitivities for each of the other seasons, with the
+        # same integration time.
+        sweepTasks = []
+        for season in argsInterpreted['sweepSeasons']:
+            for condition in [ 'best', 'typical', 'worst' ]:
+                sweepTasks.append(noiseTask(noiseCommon, workArea['atmosphere'][season][condition],
+                                            args.integration))
+        sweepResults = runNoiseTasks(sweepTasks, executor)
+        output['season_sweep'] = {}
+        for i, season in enumerate(argsInterpreted['sweepSeasons']):
+            noises = sweepResults[(3 * i):(3 * i + 3)]
+            summaries = [ conditionSummary(n, args, synthBeamContinuum,
+                                           synthBeamZoom) for n in noises ]
+            sweep = {
+                'atmospheric_conditions': weatherConditions[season],
+                'system_temperature': [ n['continuum-rms']['systemTemperature'] for n in noises ],
+                'rms_noise_level': {},
+                'brightness_temperature_sensitivity': {},
+                'antenna_sensitivity': [ m['SEFD']['antenna'] for m in summaries ],
+                'array_sensitivity': [ m['SEFD']['array'] for m in summaries ] }
+            for t in summaries[0]['rms']:
+                o = t
+                if (t == 'specificZoom'):
+                    o = 'specific_zoom'
+                sweep['rms_noise_level'][o] = [ m['rms'][t] for m in summaries ]
+                sweep['brightness_temperature_sensitivity'][o] = [ m['btrms'][t] for m in summaries ]
+            if (specificZoomCalc):
+                sweep['specific_zoom_system_temperature'] = [ n['specificZoom-rms']['systemTemperature']
+                                                              for n in noises ]
+            output['season_sweep'][season] = sweep
+        output['description']['season_sweep'] = "Sensitivities in other seasons"
+
     #\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
 
 
@@ -964,6 +1469,7 @@ def main(args):
     sens.plotSpectrum(workArea['continuum-smooth-rms'], [ 'typical', 'best', 'worst' ], fullOutfile)
     # Put the name of the output file in the output dictionary.
     output['output_plot'] = outfile
+    plotFiles = { 'output_plot': fullOutfile }
 
     if (specificZoomCalc):
         # We make an output plot of the RMS spectral noise of the specific zoom as well.
@@ -972,6 +1478,7 @@ def main(args):
         sens.plotSpectrum(workArea['specificZoom-rms'], [ 'typical', 'best', 'worst'], szFullOutfile)
         # Put the name of this output file in the output dictionary.
         output['output_zoom_plot'] = szoutfile
+        plotFiles['output_zoom_plot'] = szFullOutfile
     #\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
 
 
@@ -984,5 +1491,8 @@ def main(args):
     else:
         # Output the JSON.
         print (json.dumps(output))
+    if (keep is not None):
+        keep['output'] = output
+        keep['plots'] = plotFiles
     #\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
     # SENSITIVITY CALCULATOR ENDS
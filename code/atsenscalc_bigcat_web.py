@@ -23,7 +23,6 @@
 # along with the ATCA Sensitivity Calculator.
 # If not, see <http://www.gnu.org/licenses/>.
 
-import cgi
 import random
 import os
 import socket
@@ -43,12 +42,9 @@ class Struct:
     def __iter__(self):
         return iter(self.__dict__.items())
 
-if __name__ == "__main__":
-    # Get the form values.
-    form = cgi.FieldStorage()
-
-    # Set up the temporary argument dictionary. This is done in the same
-    # order as in the command line version of the calculator.
+def formArguments(form):
+    # Set up the temporary argument dictionary from the form values. This is
+    # done in the same order as in the command line version of the calculator.
     fargs = {}
     
     # Include CA06 for the calculations.
@@ -148,6 +144,14 @@ if __name__ == "__main__":
     else:
         fargs['per_ha'] = 5.0
 
+    # How the atmosphere is averaged over the hour angles ("sample" or "quadrature"),
+    # and the number of quadrature nodes.
+    # Default "sample".
+    if ("ha_average" in form):
+        fargs['ha_average'] = form['ha_average'].value
+    if ("ha_nodes" in form):
+        fargs['ha_nodes'] = int(form['ha_nodes'].value)
+
     # Do not output progress messages.
     # Default true (because we run on the server).
     fargs['quiet'] = True
@@ -160,12 +164,13 @@ if __name__ == "__main__":
     fargs['rfi'] = ("rfi" in form)
 
     # The number of continuum spectral channels to bin together in the
-    # output.
+    # output. The continuum sensitivities are also given for any other
+    # numbers of channels, if the field is repeated.
     # Default 1.
     if ("smoothing" in form):
-        fargs['smoothing'] = int(form['smoothing'].value)
+        fargs['smoothing'] = [ int(v) for v in form.getlist('smoothing') ]
     else:
-        fargs['smoothing'] = 1
+        fargs['smoothing'] = [ 1 ]
 
     # The conditions to assume for weather dependence
     # [ "JAN", "FEB", "MAR", "APR", "MAY", "JUN",
@@ -178,6 +183,27 @@ if __name__ == "__main__":
     else:
         fargs['season'] = "ANNUAL"
 
+    # The weather at the ground to use instead of the seasonal conditions;
+    # temperature (C), pressure (hPa) and relative humidity (%).
+    for w in [ 'temperature', 'pressure', 'humidity' ]:
+        if (w in form):
+            fargs[w] = float(form[w].value)
+
+    # Interpolate the atmosphere from the precomputed tables.
+    fargs['atmosphere_lookup'] = ("atmosphere_lookup" in form)
+
+    # How the atmosphere away from the zenith is calculated.
+    if ("atmosphere_engine" in form):
+        fargs['atmosphere_engine'] = form['atmosphere_engine'].value
+
+    # The fractional accuracy to choose the number of atmosphere layers for.
+    if ("atmosphere_layer_tolerance" in form):
+        fargs['atmosphere_layer_tolerance'] = float(form['atmosphere_layer_tolerance'].value)
+
+    # The fractional accuracy to sample the atmosphere to adaptively in frequency.
+    if ("atmosphere_tolerance" in form):
+        fargs['atmosphere_tolerance'] = float(form['atmosphere_tolerance'].value)
+
     # The amount of on-source integration time (min).
     # Default 720.
     if ("integration" in form):
@@ -252,9 +278,24 @@ if __name__ == "__main__":
 
     fargs['human_readable'] = False
 
+    # The shared data bundle the server has loaded the tables into, if any.
+    fargs['data_bundle'] = os.environ.get('ATSENSCALC_DATA_BUNDLE')
+
     # The location to write the plots.
     fargs['plot_location'] = "/var/www/vhosts/www.narrabri.atnf.csiro.au/writeable/cgi-bin/obstools"
-    
+
+    # The location to keep computed model atmospheres, and its maximum size (MB).
+    fargs['atmosphere_cache'] = fargs['plot_location'] + "/atmosphere_cache"
+    fargs['atmosphere_cache_size'] = 100.0
+    return fargs
+
+if __name__ == "__main__":
+    # Get the form values. Only the CGI script needs the cgi module, so the
+    # persistent service (atsenscalc_bigcat_wsgi) can import this one without it.
+    import cgi
+    form = cgi.FieldStorage()
+    fargs = formArguments(form)
+
     # Start the JSON output.
     sys.stdout.write("Content-type: text/json\r\n\r\n")
     sys.stdout.flush()
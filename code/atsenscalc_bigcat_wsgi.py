@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+######################################################################
+# The ATCA Sensitivity Calculator
+# Persistent web service.
+# Copyright 2015 Jamie Stevens, CSIRO
+#
+# This file is part of the ATCA Sensitivity Calculator.
+#
+# The ATCA Sensitivity Calculator is free software: you can
+# redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# The ATCA Sensitivity Calculator is distributed in the hope
+# that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with the ATCA Sensitivity Calculator.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# This is a long-running replacement for the CGI script
+# atsenscalc_bigcat_web.py: it takes the same form fields and returns the
+# same JSON, but the modules are only imported, and the tables only loaded,
+# once, and the caches stay warm between requests. Each worker also keeps
+# the results of recent calculations, so a request that has already been
+# made (or one that differs only in ways that don't change the result) is
+# answered straight away by that worker. The workers don't share these
+# results: a request to any path ending in /cache_statistics returns the
+# statistics of the cache of whichever worker answers it, along with its
+# pid, and not those of the whole server.
+#
+# application is a WSGI application, which can be run by any WSGI server.
+# Running this file starts a server of its own: it loads the tables into a
+# shared data bundle (see databundle), listens on the port, and then forks
+# a pool of worker processes that each take requests from it. A worker that
+# dies is replaced, and the bundle is removed when the server is stopped.
+# Any atmosphere tables (see atmostable) that haven't been made yet can be
+# made before the server starts listening.
+#   python atsenscalc_bigcat_wsgi.py [--port 8080] [--workers 4] [--atmosphere-tables]
+
+import io
+import os
+import sys
+import json
+import random
+import signal
+import argparse
+import urllib.parse
+import traceback
+import contextlib
+import wsgiref.simple_server
+import atsenscalc_bigcat_web as web
+import databundle as databundle
+import atmostable as atmostable
+
+# Where the plots and model atmospheres go, if not where the CGI script puts them.
+plotLocation = None
+
+class FormFields:
+    # The fields of a submitted form, read from the query string and any URL-encoded
+    # body, which can be used by formArguments in place of the cgi.FieldStorage the
+    # CGI script gives it. As there, fields that are left blank aren't included.
+    def __init__(self, environ):
+        self.fields = urllib.parse.parse_qs(environ.get('QUERY_STRING', ""))
+        contentType = environ.get('CONTENT_TYPE', "").split(";")[0].strip()
+        if (environ.get('REQUEST_METHOD', "GET") == "POST" and
+            contentType in [ "", "application/x-www-form-urlencoded" ]):
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            body = environ['wsgi.input'].read(length).decode("utf-8", "replace")
+            for k, v in urllib.parse.parse_qs(body).items():
+                self.fields.setdefault(k, []).extend(v)
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def __getitem__(self, name):
+        # The first value given for the field.
+        return web.Struct(value=self.fields[name][0])
+
+    def getlist(self, name):
+        return self.fields.get(name, [])
+
+def runCalculation(fargs):
+    # Run the calculator with the arguments made from a form, and return the JSON
+    # it outputs. The calculator writes its output and exits itself, so we catch both.
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            web.sens.cachedMain(web.Struct(**fargs))
+        except SystemExit:
+            pass
+    return output.getvalue()
+
+def application(environ, start_response):
+    # Calculate the sensitivity for the form submitted in a request, which is turned
+    # into arguments exactly as the CGI script does it.
+    status = "200 OK"
+    if (environ.get('PATH_INFO', "").endswith("/cache_statistics")):
+        body = json.dumps(web.sens.resultCacheStatistics()).encode()
+        start_response(status, [ ("Content-type", "text/json"), ("Content-Length", str(len(body))) ])
+        return [ body ]
+    try:
+        fargs = web.formArguments(FormFields(environ))
+        if (plotLocation is not None):
+            fargs['plot_location'] = plotLocation
+            fargs['atmosphere_cache'] = plotLocation + "/atmosphere_cache"
+        body = runCalculation(fargs)
+    except Exception:
+        traceback.print_exc(file=environ['wsgi.errors'])
+        status = "500 Internal Server Error"
+        body = json.dumps({ 'error': str(sys.exc_info()[1]) }) + "\n"
+    body = body.encode()
+    start_response(status, [ ("Content-type", "text/json"), ("Content-Length", str(len(body))) ])
+    return [ body ]
+
+def startWorker(server):
+    # Fork a worker process to take requests from the server, and return its pid.
+    pid = os.fork()
+    if (pid != 0):
+        return pid
+    # Each worker needs its own random plot names.
+    random.seed()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+def serve(host, port, nWorkers, useBundle=True):
+    # Listen on the port and run the pool of worker processes until we are stopped.
+    server = wsgiref.simple_server.make_server(host, port, application)
+    bundle = None
+    if (useBundle):
+        bundle = databundle.createBundle(web.sens.sens.bundleContents())
+        os.environ['ATSENSCALC_DATA_BUNDLE'] = bundle['name']
+    print("Serving on %s:%d with %d workers" % (host, port, nWorkers))
+    sys.stdout.flush()
+
+    # Stop when we are told to, replacing any worker that stops before then.
+    def stop(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    workers = set()
+    try:
+        while True:
+            while (len(workers) < nWorkers):
+                workers.add(startWorker(server))
+            pid, _ = os.wait()
+            workers.discard(pid)
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        server.server_close()
+        if (bundle is not None):
+            databundle.closeBundle(bundle)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="the address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8080,
+                        help="the port to listen on")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="the number of worker processes")
+    parser.add_argument("--plot-location",
+                        help="the directory to write the plots and keep the model atmospheres in, instead of the web server's")
+    parser.add_argument("--no-bundle", action="store_true",
+                        help="don't load the tables into a shared data bundle")
+    parser.add_argument("--atmosphere-tables", action="store_true",
+                        help="make any atmosphere tables that haven't been made before starting")
+    args = parser.parse_args()
+    if (args.workers < 1):
+        parser.error("there must be at least one worker")
+
+    # The calculator reads its tables relative to this directory.
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    plotLocation = args.plot_location
+    if (args.atmosphere_tables):
+        # The calculations never make these themselves, as it takes minutes per band.
+        atmostable.makeTables(web.sens.sens.frequencyBands, 50, rebuild=False)
+    serve(args.host, args.port, args.workers, (not args.no_bundle))
@@ -49,6 +49,8 @@ if __name__ == "__main__":
                                   "h214", "H214", "h168", "H168", "h75", "H75" ]);
     parser.add_argument("-C", "--calculate-time", action="store_true",
                         help="the calculator will determine the time required to reach the target sensitivity")
+    parser.add_argument("--data-bundle",
+                        help="use the tables in the shared data bundle with this name (see databundle.py)")
     parser.add_argument("-d", "--dec", type=float, default=-30,
                         help="the declination of the source (decimal degrees)")
     parser.add_argument("-e", "--ellimit", type=float, default=12,
@@ -59,6 +61,10 @@ if __name__ == "__main__":
                         help="the central frequency of the observations (MHz)")
     parser.add_argument("-F", "--per-freq", type=float, default=50.0,
                         help="the minimum frequency spacing between atmospheric corrections (MHz)")
+    parser.add_argument("--ha-average", default="sample", choices=[ "sample", "quadrature" ],
+                        help="average the atmosphere over the hour angle range from per-ha samples an hour (sample) or with Gauss-Legendre quadrature (quadrature)")
+    parser.add_argument("--ha-nodes", type=int, default=8,
+                        help="the number of nodes for the hour angle quadrature")
     parser.add_argument("-H", "--ha-min", type=float,
                         help="the lowest hour angle observed (decimal hours)")
     parser.add_argument("-K", "--ha-max", type=float,
@@ -77,8 +83,10 @@ if __name__ == "__main__":
                         help="use this rest frequency to calculate the velocity parameters (GHz)")
     parser.add_argument("-R", "--rfi", action="store_true",
                         help="flag known RFI-affected regions of the continuum spectrum")
-    parser.add_argument("-s", "--smoothing", type=int, default=1,
-                        help="the number of continuum spectral channels to bin together in the output")
+    parser.add_argument("--rfi-mask",
+                        help="flag the RFI-affected regions listed in this file (low and high frequency in MHz on each line) instead of the known regions")
+    parser.add_argument("-s", "--smoothing", type=int, nargs="+", default=[ 1 ],
+                        help="the number of continuum spectral channels to bin together in the output; the continuum sensitivities are also given for any further numbers")
     parser.add_argument("-S", "--season", default="ANNUAL",
                         choices=[ "JAN", "FEB", "MAR", "APR", "MAY", "JUN",
                                   "JUL", "AUG", "SEP", "OCT", "NOV", "DEC",
@@ -107,6 +115,8 @@ if __name__ == "__main__":
                         help="the target sensitivity is to be obtained in typical weather conditions")
     parser.add_argument("--target-worst", action="store_true",
                         help="the target sensitivity is to be obtained in the worst weather conditions")
+    parser.add_argument("--time-solver", default="analytic", choices=[ "analytic", "iterative" ],
+                        help="find the integration time in time calculation mode directly (analytic) or by repeating the calculation until the sensitivity is within 1%% of the target (iterative)")
     parser.add_argument("-w", "--weighting", default="R2",
                         help="the image weighting scheme",
                         choices=[ "R2", "R1", "R0", "R-1", "R-2" ])
@@ -21,6 +21,7 @@
 # along with the ATCA Sensitivity Calculator.
 # If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import math
 import sys
 import json
@@ -29,6 +30,10 @@ import atsenscalc_routines as sens
 
 def checkArguments(args):
     cargs = vars(args)
+    # Use the tables in a shared data bundle if we have been given one.
+    if ('data_bundle' in cargs and args.data_bundle is not None):
+        sens.useBundle(args.data_bundle)
+
     # Check the frequency exists and is within a known band.
     if 'frequency' in cargs:
         b = sens.frequencyBand(int(args.frequency))
@@ -66,6 +71,28 @@ def checkArguments(args):
     if (args.dec < -90 or args.dec > (90 - 30.313 - args.ellimit)):
         raise sens.CalcError("Declination not observable with specified elevation limit.")
 
+    # Check for a file of RFI ranges.
+    rfiMask = None
+    if ('rfi_mask' in cargs and args.rfi_mask is not None):
+        if (not os.path.isfile(args.rfi_mask)):
+            raise sens.CalcError("Can't find RFI mask file %s." % args.rfi_mask)
+        rfiMask = args.rfi_mask
+
+    # Check how the integration time is to be found in time calculation mode.
+    timeSolver = "analytic"
+    if ('time_solver' in cargs and args.time_solver is not None):
+        timeSolver = args.time_solver
+    if (timeSolver not in [ "analytic", "iterative" ]):
+        raise sens.CalcError("Unknown time solver.")
+
+    # Check the smoothing factors. The first is used for the continuum band, and the
+    # continuum sensitivities are also found with any others.
+    smoothing = args.smoothing
+    if (type(smoothing) is not list):
+        smoothing = [ smoothing ]
+    if (len(smoothing) == 0 or min(smoothing) < 1):
+        raise sens.CalcError("Smoothing factor must be at least 1.")
+
     # Check we have a positive integration time.
     if (args.integration <= 0):
         raise sens.CalcError("Integration time must be greater than 0 minutes.")
@@ -74,6 +101,18 @@ def checkArguments(args):
     if (args.per_ha <= 0):
         raise sens.CalcError("Number of integrations per hour angle is invalid.")
 
+    # Check how the atmosphere is to be averaged over the hour angles; the number of
+    # quadrature nodes is only set if it's not to be sampled perHa times an hour.
+    haNodes = None
+    if ('ha_average' in cargs and args.ha_average is not None and args.ha_average != "sample"):
+        if (args.ha_average != "quadrature"):
+            raise sens.CalcError("Unknown hour angle averaging.")
+        haNodes = 8
+        if ('ha_nodes' in cargs and args.ha_nodes is not None):
+            haNodes = args.ha_nodes
+        if (haNodes < 2):
+            raise sens.CalcError("Number of hour angle quadrature nodes must be at least 2.")
+
     # Check for a specified rest frequency.
     if ('restfreq' in cargs and args.restfreq is not None):
         restfreq = args.restfreq * 1000.0 # Conversion from GHz to MHz.
@@ -130,7 +169,28 @@ def checkArguments(args):
 
     # Return the interpreted values we made.
     return { 'hourAngle_min': hourAngle_min, 'hourAngle_max': hourAngle_max,
-             'restfreq': restfreq }
+             'restfreq': restfreq, 'rfiMask': rfiMask,
+             'timeSolver': timeSolver, 'haNodes': haNodes, 'smoothing': smoothing }
+
+def smoothingSummary(sensResExtra, factors, resolution, synthBeamContinuum, frequency):
+    # Make the output for the continuum sensitivities with each of the other smoothing
+    # factors, from the sensitivities for each weather condition.
+    summary = {}
+    for i, factor in enumerate(factors):
+        smoothed = {
+            'channel_bandwidth': (resolution * float(factor)),
+            'effective_bandwidth': sensResExtra['typical'][i]['bandwidth']['unflagged'],
+            'rms_noise_level': {},
+            'brightness_temperature_sensitivity': {} }
+        for t in [ 'continuum', 'spectral' ]:
+            rms = [ sensResExtra[c][i]['rms'][t] for c in [ 'best', 'typical', 'worst' ] ]
+            smoothed['rms_noise_level'][t] = [ float("%.3f" % r) for r in rms ]
+            # The brightness sensitivity is in mK.
+            smoothed['brightness_temperature_sensitivity'][t] = [
+                float("%.2f" % (sens.brightnessTemperatureSensitivity(r, synthBeamContinuum, frequency) * 1000.0))
+                for r in rms ]
+        summary["%d" % factor] = smoothed
+    return summary
 
 def thingToString(t):
     if (type(t) is str):
@@ -195,6 +255,11 @@ def main(args):
     hourAngle_min = argsInterpreted['hourAngle_min']
     hourAngle_max = argsInterpreted['hourAngle_max']
 
+    # The smoothing factor for the continuum band, and any others we also want the
+    # continuum sensitivities for.
+    smoothing = argsInterpreted['smoothing'][0]
+    extraSmoothing = argsInterpreted['smoothing'][1:]
+
     coshaAtElLimit = sinel / (cosd * sens.cosl) - (sind * sens.sinl) / (cosd * sens.cosl)
     if (abs(coshaAtElLimit) <= 1):
         haAtElLimit = math.degrees(math.acos(coshaAtElLimit)) # in degrees
@@ -338,15 +403,10 @@ def main(args):
         # specific zoom frequency.
         closestCentreFreq = 0.0
         closestCentreOffs = 3000.0
-        for i in range(0, len(workArea['continuum']['centreFrequency'])):
-            offs = abs(workArea['continuum']['centreFrequency'][i] - args.zoomfreq)
+        for t in [ 'continuum', 'alternate' ]:
+            freq, offs = sens.closestChannel(workArea[t], args.zoomfreq)
             if (offs < closestCentreOffs):
-                closestCentreFreq = workArea['continuum']['centreFrequency'][i]
-                closestCentreOffs = offs
-        for i in range(0, len(workArea['alternate']['centreFrequency'])):
-            offs = abs(workArea['alternate']['centreFrequency'][i] - args.zoomfreq)
-            if (offs < closestCentreOffs):
-                closestCentreFreq = workArea['alternate']['centreFrequency'][i]
+                closestCentreFreq = freq
                 closestCentreOffs = offs
         # Compute how the bandwidth is distributed around the centre frequency.
         bandwidthAbove = (0.125 * (2.0 * float(args.zoom_width) + (-1.0) ** float(args.zoom_width) + 3.0) *
@@ -420,30 +480,34 @@ def main(args):
         sens.flagTemplate(workArea['specificZoom'], 'edge', args.corrconfig, args.zoom_edge)
     if (args.birdies):
         sens.flagTemplate(workArea['continuum'], 'birdies', args.corrconfig, 0)
-    if (args.rfi):
-        sens.flagTemplate(workArea['continuum'], 'rfi', args.corrconfig, 0)
+    if (args.rfi or argsInterpreted['rfiMask'] is not None):
+        sens.flagTemplate(workArea['continuum'], 'rfi', args.corrconfig, 0, argsInterpreted['rfiMask'])
     #\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
 
 
 
     ####################################################################################################
-    # Do any bin smoothing now. We need to smooth the system temperature and efficiency templates.
+    # Set up any bin smoothing now. The RMS noise in each smoothed channel is found from the
+    # RMS noise of the unsmoothed channels in it, so we only need the smoothed channels.
     # The continuum frequency resolution after smoothing.
-    contSmoothRes = workArea['resolutions']['continuum'] * float(args.smoothing)
-    sens.addToOutput(output, 'source_imaging', 'smoothing_window', args.smoothing,
+    contSmoothRes = workArea['resolutions']['continuum'] * float(smoothing)
+    sens.addToOutput(output, 'source_imaging', 'smoothing_window', smoothing,
                      "Smoothing Window", "channels")
     # Check that we will end up with at least 2 channels, otherwise we die.
-    if ((sens.continuumBandwidth / contSmoothRes) < 2):
-        if (args.human_readable):
-            print ("FATAL: Smoothing factor too large.")
-        else:
-            print ('{ "error": "Smoothing factor too large." }')
-        sys.exit(-1)
-    # Make the smoothed templates and fill them from the unsmoothed templates.
+    for factor in argsInterpreted['smoothing']:
+        if ((sens.continuumBandwidth / (workArea['resolutions']['continuum'] * float(factor))) < 2):
+            if (args.human_readable):
+                print ("FATAL: Smoothing factor too large.")
+            else:
+                print ('{ "error": "Smoothing factor too large." }')
+            sys.exit(-1)
+    # Make the smoothed templates.
     workArea['continuum-smooth'] = sens.makeTemplate(args.frequency, sens.continuumBandwidth, contSmoothRes)
-    sens.templateFill(workArea['continuum'], workArea['continuum-smooth'])
-    workArea['continuum-efficiency-smooth'] = sens.makeTemplate(args.frequency, sens.continuumBandwidth, contSmoothRes)
-    sens.templateFill(workArea['continuum-efficiency'], workArea['continuum-efficiency-smooth'])
+    # And those for the other smoothing factors.
+    workArea['continuum-smooth-extra'] = [ (factor, sens.makeTemplate(args.frequency, sens.continuumBandwidth,
+                                                                      (workArea['resolutions']['continuum'] *
+                                                                       float(factor))))
+                                           for factor in extraSmoothing ]
     sens.addToOutput(output, 'continuum', 'channel_bandwidth', contSmoothRes,
                      "Channel Bandwidth", "MHz")
 
@@ -472,10 +536,6 @@ def main(args):
         # Make the specific zoom smoothed template.
         workArea['specificZoom-smooth'] = sens.makeTemplate(closestCentreFreq, szBandwidths,
                                                             zoomSmoothRes)
-        sens.templateFill(workArea['specificZoom'], workArea['specificZoom-smooth'])
-        workArea['specificZoom-efficiency-smooth'] = sens.makeTemplate(closestCentreFreq, szBandwidths,
-                                                                       zoomSmoothRes)
-        sens.templateFill(workArea['specificZoom-efficiency'], workArea['specificZoom-efficiency-smooth'])
     #\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
     
 
@@ -559,8 +619,8 @@ def main(args):
     contResCosm = (output['continuum']['highz_spectral_bandwidth'] /
                    float(len(workArea['continuum']['centreFrequency']) - 2 * args.edge))
     # We now compensate for continuum band smoothing.
-    chanRes = float("%.3f" % (contRes * float(args.smoothing)))
-    chanResCosm = float("%.3f" % (contResCosm * float(args.smoothing)))
+    chanRes = float("%.3f" % (contRes * float(smoothing)))
+    chanResCosm = float("%.3f" % (contResCosm * float(smoothing)))
     sens.addToOutput(output, 'continuum', 'spectral_channel_resolution', chanRes,
                      "Spectral Channel Resolution", "km/s")
     sens.addToOutput(output, 'continuum', 'highz_spectral_channel_resolution', chanResCosm,
@@ -650,65 +710,7 @@ def main(args):
         print ("MESSAGE: Calculating weather effects...")
 
     # The weather conditions that we will use for computing the atmosphere later.
-    weatherConditions = {
-        'JAN': { 'best': { 'temperature': 32.7, 'pressure': 986.8, 'humidity': 27.5 },
-                 'typical': { 'temperature': 30.6, 'pressure': 989.8, 'humidity': 50.5 },
-                 'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } }, 
-        'FEB': { 'best': { 'temperature': 29.6, 'pressure': 987.2, 'humidity': 36.0 },
-                 'typical': { 'temperature': 24.2, 'pressure': 989.6, 'humidity': 65.0 },
-                 'worst': { 'temperature': 23.7, 'pressure': 990.4, 'humidity': 86.0 } },
-        'MAR': { 'best': { 'temperature': 27.4, 'pressure': 989.7, 'humidity': 33.0 },
-                 'typical': { 'temperature': 18.9, 'pressure': 995.5, 'humidity': 82.0 },
-                 'worst': { 'temperature': 28.2, 'pressure': 988.0, 'humidity': 69.7 } },
-        'APR': { 'best': { 'temperature': 9.5, 'pressure': 1011.7, 'humidity': 76.0 },
-                 'typical': { 'temperature': 16.8, 'pressure': 1013.4, 'humidity': 73.0 },
-                 'worst': { 'temperature': 19.7, 'pressure': 1001.6, 'humidity': 85.0 } },
-        'MAY': { 'best': { 'temperature': 19.6, 'pressure': 1008.0, 'humidity': 31.0 },
-                 'typical': { 'temperature': 9.7, 'pressure': 1009.7, 'humidity': 86.0 },
-                 'worst': { 'temperature': 18.7, 'pressure': 1012.3, 'humidity': 78.0 } },
-        'JUN': { 'best': { 'temperature': -1.6, 'pressure': 1016.9, 'humidity': 95.0 },
-                 'typical': { 'temperature': 8.1, 'pressure': 1002.7, 'humidity': 95.0 },
-                 'worst': { 'temperature': 15.0, 'pressure': 997.7, 'humidity': 101.1 } },
-        'JUL': { 'best': { 'temperature': 1.9, 'pressure': 1019.0, 'humidity': 91.0 },
-                 'typical': { 'temperature': 18.8, 'pressure': 999.4, 'humidity': 50.5 },
-                 'worst': { 'temperature': 15.6, 'pressure': 1004.2, 'humidity': 100.0 } },
-        'AUG': { 'best': { 'temperature': 3.6, 'pressure': 1017.2, 'humidity': 73.0 },
-                 'typical': { 'temperature': 8.2, 'pressure': 1010.5, 'humidity': 87.0 },
-                 'worst': { 'temperature': 16.6, 'pressure': 1012.4, 'humidity': 93.0 } },
-        'SEP': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
-                 'typical': { 'temperature': 15.4, 'pressure': 993.5, 'humidity': 61.0 },
-                 'worst': { 'temperature': 20.3, 'pressure': 993.6, 'humidity': 66.0 } },
-        'OCT': { 'best': { 'temperature': 26.6, 'pressure': 986.6, 'humidity': 22.0 },
-                 'typical': { 'temperature': 28.6, 'pressure': 986.5, 'humidity': 33.0 },
-                 'worst': { 'temperature': 25.8, 'pressure': 996.6, 'humidity': 57.0 } },
-        'NOV': { 'best': { 'temperature': 32.5, 'pressure': 986.7, 'humidity': 19.7 },
-                 'typical': { 'temperature': 22.1, 'pressure': 990.2, 'humidity': 58.0 },
-                 'worst': { 'temperature': 24.7, 'pressure': 989.5, 'humidity': 71.9 } },
-        'DEC': { 'best': { 'temperature': 29.5, 'pressure': 986.8, 'humidity': 30.0 },
-                 'typical': { 'temperature': 21.8, 'pressure': 987.0, 'humidity': 70.0 },
-                 'worst': { 'temperature': 27.9, 'pressure': 984.5, 'humidity': 71.0 } },
-        'SUMMER': { 'best': { 'temperature': 29.5, 'pressure': 986.8, 'humidity': 30.0 },
-                    'typical': { 'temperature': 29.9, 'pressure': 989.1, 'humidity': 49.0 },
-                    'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } },
-        'AUTUMN': { 'best': { 'temperature': 19.5, 'pressure': 1008.0, 'humidity': 31.0 },
-                    'typical': { 'temperature': 23.6, 'pressure': 1016.5, 'humidity': 51.0 },
-                    'worst': { 'temperature': 28.2, 'pressure': 988.0, 'humidity': 69.7 } },
-        'WINTER': { 'best': { 'temperature': -1.6, 'pressure': 1016.9, 'humidity': 95.0 },
-                    'typical': { 'temperature': 9.7, 'pressure': 1004.6, 'humidity': 83.0 },
-                    'worst': { 'temperature': 15.6, 'pressure': 1004.2, 'humidity': 100.0 } },
-        'SPRING': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
-                    'typical': { 'temperature': 14.9, 'pressure': 997.5, 'humidity': 68.7 },
-                    'worst': { 'temperature': 24.7, 'pressure': 989.5, 'humidity': 71.9 } },
-        'APRS': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
-                  'typical': { 'temperature': 12.7, 'pressure': 1011.1, 'humidity': 72.0 },
-                  'worst': { 'temperature': 19.7, 'pressure': 1001.6, 'humidity': 85.0 } },
-        'OCTS': { 'best': { 'temperature': 26.6, 'pressure': 986.6, 'humidity': 22.0 },
-                  'typical': { 'temperature': 22.1, 'pressure': 988.7, 'humidity': 66.7 },
-                  'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } },
-        'ANNUAL': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
-                    'typical': { 'temperature': 16.6, 'pressure': 1010.3, 'humidity': 57.5 },
-                    'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } }
-        }
+    weatherConditions = sens.weatherConditions
 
     # This is the frequency resolution of the atmospheric corrections.
     atmosRes = max(workArea['resolutions']['continuum'], args.per_freq)
@@ -764,6 +766,7 @@ def main(args):
         print ("MESSAGE: Calculating sensitivities...")
     workArea['continuum-rms'] = {}
     workArea['continuum-smooth-rms'] = {}
+    workArea['sensResExtra'] = {}
     workArea['specificZoom-rms'] = {}
     computeBands = { 'continuum': 0, 'spectral': 0, 'zoom': 0 }
     workArea['rms'] = {
@@ -778,21 +781,52 @@ def main(args):
         'zoom': {},
         'specificZoom': {}
     }
+    # The unrounded sensitivities for each condition.
+    workArea['exact'] = {}
     workArea['SEFD'] = {}
 
     # Sensitivities are computed for each of the different weather conditions we expect.
     sensitivityReached = False
+    timeSolved = False
     while (sensitivityReached == False):
-        for condition in weatherConditions[args.season]:
+        conditions = list(weatherConditions[args.season])
+        # The RMS noise in each band, for each channel, is calculated for all the conditions
+        # at once, along with the global average values in each band.
+        # We get the "general" zoom sensitivity from the unsmoothed continuum data, since smoothing
+        # the continuum won't help improve the zoom sensitivity.
+        continuumRms = sens.calculateRmsConditions(workArea['continuum'],
+                                                   workArea['continuum-efficiency'],
+                                                   [ workArea['opacity'][c] for c in conditions ],
+                                                   [ workArea['temperature'][c] for c in conditions ],
+                                                   hourAngle_min, hourAngle_max, args.per_ha,
+                                                   nant, args.integration, imageWeights, sind, cosd,
+                                                   haNodes=argsInterpreted['haNodes'])
+        continuumSens = sens.calculateSensitivityConditions(continuumRms, nant)
+        # The smoothed continuum band is made from the unsmoothed continuum band.
+        smoothRms = [ sens.smoothRms(t, workArea['continuum-smooth']) for t in continuumRms ]
+        smoothSens = sens.calculateSensitivityConditions(smoothRms, nant)
+        # And the same for any other smoothing factors.
+        extraSens = [ sens.calculateSensitivityConditions([ sens.smoothRms(t, smoothTemplate)
+                                                            for t in continuumRms ], nant)
+                      for factor, smoothTemplate in workArea['continuum-smooth-extra'] ]
+        if (specificZoomCalc):
+            # The smoothed specific zoom band, made from the unsmoothed specific zoom band.
+            szRms = sens.calculateRmsConditions(workArea['specificZoom'],
+                                                workArea['specificZoom-efficiency'],
+                                                [ workArea['sz-opacity'][c] for c in conditions ],
+                                                [ workArea['sz-temperature'][c] for c in conditions ],
+                                                hourAngle_min, hourAngle_max, args.per_ha,
+                                                nant, args.integration, imageWeights, sind, cosd,
+                                                haNodes=argsInterpreted['haNodes'])
+            szRms = [ sens.smoothRms(t, workArea['specificZoom-smooth']) for t in szRms ]
+            szSens = sens.calculateSensitivityConditions(szRms, nant)
+
+        for i, condition in enumerate(conditions):
+            workArea['exact'][condition] = { 'rms': {}, 'btrms': {} }
             # The RMS noise in the smoothed continuum band, for each channel.
-            workArea['continuum-smooth-rms'][condition] = sens.calculateRms(workArea['continuum-smooth'],
-                                                                       workArea['continuum-efficiency-smooth'],
-                                                                       workArea['opacity'][condition],
-                                                                       workArea['temperature'][condition],
-                                                                       hourAngle_min, hourAngle_max, args.per_ha,
-                                                                       nant, args.integration, imageWeights, sind, cosd)
-            # Then derive the global average values in the continuum band.
-            sensResSmooth = sens.calculateSensitivity(workArea['continuum-smooth-rms'][condition], nant)
+            workArea['continuum-smooth-rms'][condition] = smoothRms[i]
+            # Then the global average values in the continuum band.
+            sensResSmooth = smoothSens[i]
             # Check whether we have any unflagged continuum channels.
             if (sensResSmooth['bandwidth']['unflagged'] < 1.0):
                 if (args.human_readable):
@@ -801,27 +835,18 @@ def main(args):
                     print ('{ "error": "No continuum bandwidth remains unflagged." }')
                 sys.exit(-1)
 
-            # We get the "general" zoom sensitivity from the unsmoothed continuum data, since smoothing
-            # the continuum won't help improve the zoom sensitivity.
-            workArea['continuum-rms'][condition] = sens.calculateRms(workArea['continuum'],
-                                                                workArea['continuum-efficiency'],
-                                                                workArea['opacity'][condition],
-                                                                workArea['temperature'][condition],
-                                                                hourAngle_min, hourAngle_max, args.per_ha,
-                                                                nant, args.integration, imageWeights, sind, cosd)
-            # Then derive the global average values in the "general" zoom band.
-            sensRes = sens.calculateSensitivity(workArea['continuum-rms'][condition], nant)
+            # The RMS noise in the unsmoothed continuum band, and the global average values
+            # in the "general" zoom band.
+            workArea['continuum-rms'][condition] = continuumRms[i]
+            sensRes = continuumSens[i]
+            # The global average values in the continuum band with the other smoothing factors.
+            workArea['sensResExtra'][condition] = [ e[i] for e in extraSens ]
 
             if (specificZoomCalc):
-                # The RMS noise in the smoothed specific zoom band, for each channel.
-                workArea['specificZoom-rms'][condition] = sens.calculateRms(workArea['specificZoom-smooth'],
-                                                                       workArea['specificZoom-efficiency-smooth'],
-                                                                       workArea['sz-opacity'][condition],
-                                                                       workArea['sz-temperature'][condition],
-                                                                       hourAngle_min, hourAngle_max, args.per_ha,
-                                                                       nant, args.integration, imageWeights, sind, cosd)
-                # Then derive the global average values in the specific zoom band.
-                szSensRes = sens.calculateSensitivity(workArea['specificZoom-rms'][condition], nant)
+                # The RMS noise in the smoothed specific zoom band, for each channel, and the
+                # global average values in the specific zoom band.
+                workArea['specificZoom-rms'][condition] = szRms[i]
+                szSensRes = szSens[i]
 
             for t in computeBands:
                 if (t == 'zoom'):
@@ -831,6 +856,7 @@ def main(args):
                     # normal bandwidth.
                     sensRes['rms'][t] /= math.sqrt(float(args.zoom_smoothing))
                     workArea['rms'][t][condition] = float("%.3f" % sensRes['rms'][t])
+                    workArea['exact'][condition]['rms'][t] = sensRes['rms'][t]
                     # Calculate the brightness temperature sensitivity using the synthesised beam at
                     # the centre of the continuum band.
                     bts = sens.brightnessTemperatureSensitivity(sensRes['rms'][t], synthBeamContinuum,
@@ -839,12 +865,14 @@ def main(args):
                     # We calculate the continuum and continuum-spectral sensitivities in the
                     # same way.
                     workArea['rms'][t][condition] = float("%.3f" % sensResSmooth['rms'][t])
+                    workArea['exact'][condition]['rms'][t] = sensResSmooth['rms'][t]
                     # Calculate the brightness temperature sensitivity using the synthesised beam at
                     # the centre of the continuum band.
                     bts = sens.brightnessTemperatureSensitivity(sensResSmooth['rms'][t], synthBeamContinuum,
                                                            args.frequency)
                 # We put the brightness sensitivity in mK for readability.
                 workArea['btrms'][t][condition] = float("%.2f" % (bts * 1000.0))
+                workArea['exact'][condition]['btrms'][t] = bts * 1000.0
                 # We keep the SEFDs in Jy.
                 workArea['SEFD'][condition] = {
                     'antenna': float( "%.1f" % (sensRes['sefd']['antenna']) ),
@@ -853,12 +881,14 @@ def main(args):
             if (specificZoomCalc):
                 # The spectral RMS of the specific zoom band.
                 workArea['rms']['specificZoom'][condition] = float("%.3f" % szSensRes['rms']['spectral'])
+                workArea['exact'][condition]['rms']['specificZoom'] = szSensRes['rms']['spectral']
                 # Calculate the brightness temperature sensitivity using the synthesised beam at the
                 # nominated specific zoom band frequency.
                 bts = sens.brightnessTemperatureSensitivity(szSensRes['rms']['spectral'], synthBeamZoom,
                                                        args.zoomfreq)
                 # The brightness sensitivity is again in mK.
                 workArea['btrms']['specificZoom'][condition] = float("%.2f" % (bts * 1000.0))
+                workArea['exact'][condition]['btrms']['specificZoom'] = bts * 1000.0
 
         # Check if we need to adjust the integration time.
         if (args.calculate_time == False):
@@ -887,15 +917,28 @@ def main(args):
             elif (args.target_brightness_temperature):
                 modeTarget = 'btrms'
 
-            compareSensitivity = workArea[modeTarget][bandTarget][conditionTarget]
-            # Calculate the ratio of the obtained sensitivity to that desired.
-            sensRatio = compareSensitivity / args.target
-            # We stop if we're within 1% of the target sensitivity.
-            if (abs(sensRatio - 1.0) < 0.01):
-                sensitivityReached = True
+            if (argsInterpreted['timeSolver'] == "analytic"):
+                if (timeSolved):
+                    # The sensitivities are now those at the required time.
+                    sensitivityReached = True
+                else:
+                    # The RMS noise goes exactly as 1 / sqrt(time), so the time needed
+                    # to reach the target follows from the unrounded sensitivity. We
+                    # go around once more to get everything at that time.
+                    compareSensitivity = workArea['exact'][conditionTarget][modeTarget][bandTarget]
+                    sensRatio = compareSensitivity / args.target
+                    args.integration *= sensRatio * sensRatio
+                    timeSolved = True
             else:
-                # Change the integration time appropriately.
-                args.integration *= sensRatio * sensRatio
+                compareSensitivity = workArea[modeTarget][bandTarget][conditionTarget]
+                # Calculate the ratio of the obtained sensitivity to that desired.
+                sensRatio = compareSensitivity / args.target
+                # We stop if we're within 1% of the target sensitivity.
+                if (abs(sensRatio - 1.0) < 0.01):
+                    sensitivityReached = True
+                else:
+                    # Change the integration time appropriately.
+                    args.integration *= sensRatio * sensRatio
             
 
     # We now stick all this information into the output.
@@ -913,6 +956,12 @@ def main(args):
                   workArea['continuum-rms']['typical']['systemTemperature'],
                   workArea['continuum-rms']['worst']['systemTemperature'] ],
                 "System Temperature", "K")
+    if (argsInterpreted['haNodes'] is not None):
+        # The estimated error in the system temperatures from averaging over the hour angles.
+        sens.addToOutput(output, 'sensitivities', 'hour_angle_average_error',
+                    [ float("%.3g" % workArea['continuum-rms'][c]['haError'])
+                      for c in [ 'best', 'typical', 'worst' ] ],
+                    "Hour Angle Averaging Error", "K")
 
     # The continuum sensitivities, for each weather condition, in mJy/beam.
     sens.addToOutput(output, 'sensitivities', [ 'rms_noise_level', 'continuum' ],
@@ -982,6 +1031,13 @@ def main(args):
     sens.addToOutput(output, 'source_imaging', 'integration_time', inttime,
                 "Time on Source", "minutes")
 
+    if (len(extraSmoothing) > 0):
+        # The continuum sensitivities with each of the other smoothing factors, with the same
+        # integration time.
+        output['smoothing_sweep'] = smoothingSummary(workArea['sensResExtra'], extraSmoothing,
+                                                     workArea['resolutions']['continuum'],
+                                                     synthBeamContinuum, args.frequency)
+
     #\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\\
 
 
@@ -24,10 +24,16 @@
 import os
 import math
 import sys
+import hashlib
+import collections
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 import refract as refract
+import templates as templates
+import rfimask as rfimask
+import tsysstore as tsysstore
+import databundle as databundle
 
 # Define some global parameters.
 frequencyBands = {
@@ -77,6 +83,232 @@ frequencyFlagging = {
              [ 5930.0, 5960.0 ], [ 6440.0, 6480.0 ], [ 7747.0, 7777.0 ], [ 7866.0, 7896.0 ],
              [ 8058.0, 8088.0 ], [ 8177.0, 8207.0 ] ]
 }
+# The aperture efficiency of the antennas at each frequency (MHz), for all the bands.
+efficiencyFrequencies = [
+       900.0,   1200.0,   1500.0,   1800.0,   2100.0,   2300.0,   2500.0,   4400.0,   5900.0,
+      7400.0,   8800.0,  10600.0,  16000.0,  16500.0,  17000.0,  17500.0,  18000.0,  18500.0,
+     19000.0,  19500.0,  20000.0,  20500.0,  21000.0,  21500.0,  22000.0,  22500.0,  23000.0,
+     23500.0,  24000.0,  24500.0,  25000.0,  25400.0,  30000.0,  31000.0,  32000.0,  33000.0,
+     34000.0,  35000.0,  36000.0,  37000.0,  38000.0,  39000.0,  40000.0,  41000.0,  42000.0,
+     43000.0,  44000.0,  45000.0,  46000.0,  47000.0,  48000.0,  49000.0,  50000.0,  83781.1,
+     85556.2,  86834.3,  88680.5,  90526.6,  91946.7,  94005.9,  95852.1,  97272.2,  98976.3,
+    100254.4, 102200.0, 102300.0, 106432.0 ]
+efficiencyValues = [
+      0.57,   0.57,   0.60,   0.53,   0.43,   0.42,   0.44,   0.65,   0.72,
+      0.65,   0.64,   0.65,   0.58,   0.62,   0.63,   0.65,   0.67,   0.70,
+      0.68,   0.64,   0.64,   0.60,   0.53,   0.55,   0.54,   0.51,   0.51,
+      0.53,   0.49,   0.49,   0.46,   0.47,   0.60,   0.60,   0.60,   0.60,
+      0.60,   0.60,   0.60,   0.60,   0.60,   0.60,   0.60,   0.59,   0.58,
+      0.57,   0.56,   0.55,   0.54,   0.53,   0.52,   0.51,   0.50, 0.3297,
+    0.3065, 0.3020, 0.2856, 0.2689, 0.2670, 0.2734, 0.2727, 0.2521, 0.2403,
+    0.2336, 0.2322,   0.14,   0.14 ]
+# The best, typical and worst weather conditions in each season, which are used to
+# calculate the atmosphere.
+weatherConditions = {
+    'JAN': { 'best': { 'temperature': 32.7, 'pressure': 986.8, 'humidity': 27.5 },
+             'typical': { 'temperature': 30.6, 'pressure': 989.8, 'humidity': 50.5 },
+             'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } },
+    'FEB': { 'best': { 'temperature': 29.6, 'pressure': 987.2, 'humidity': 36.0 },
+             'typical': { 'temperature': 24.2, 'pressure': 989.6, 'humidity': 65.0 },
+             'worst': { 'temperature': 23.7, 'pressure': 990.4, 'humidity': 86.0 } },
+    'MAR': { 'best': { 'temperature': 27.4, 'pressure': 989.7, 'humidity': 33.0 },
+             'typical': { 'temperature': 18.9, 'pressure': 995.5, 'humidity': 82.0 },
+             'worst': { 'temperature': 28.2, 'pressure': 988.0, 'humidity': 69.7 } },
+    'APR': { 'best': { 'temperature': 9.5, 'pressure': 1011.7, 'humidity': 76.0 },
+             'typical': { 'temperature': 16.8, 'pressure': 1013.4, 'humidity': 73.0 },
+             'worst': { 'temperature': 19.7, 'pressure': 1001.6, 'humidity': 85.0 } },
+    'MAY': { 'best': { 'temperature': 19.6, 'pressure': 1008.0, 'humidity': 31.0 },
+             'typical': { 'temperature': 9.7, 'pressure': 1009.7, 'humidity': 86.0 },
+             'worst': { 'temperature': 18.7, 'pressure': 1012.3, 'humidity': 78.0 } },
+    'JUN': { 'best': { 'temperature': -1.6, 'pressure': 1016.9, 'humidity': 95.0 },
+             'typical': { 'temperature': 8.1, 'pressure': 1002.7, 'humidity': 95.0 },
+             'worst': { 'temperature': 15.0, 'pressure': 997.7, 'humidity': 101.1 } },
+    'JUL': { 'best': { 'temperature': 1.9, 'pressure': 1019.0, 'humidity': 91.0 },
+             'typical': { 'temperature': 18.8, 'pressure': 999.4, 'humidity': 50.5 },
+             'worst': { 'temperature': 15.6, 'pressure': 1004.2, 'humidity': 100.0 } },
+    'AUG': { 'best': { 'temperature': 3.6, 'pressure': 1017.2, 'humidity': 73.0 },
+             'typical': { 'temperature': 8.2, 'pressure': 1010.5, 'humidity': 87.0 },
+             'worst': { 'temperature': 16.6, 'pressure': 1012.4, 'humidity': 93.0 } },
+    'SEP': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
+             'typical': { 'temperature': 15.4, 'pressure': 993.5, 'humidity': 61.0 },
+             'worst': { 'temperature': 20.3, 'pressure': 993.6, 'humidity': 66.0 } },
+    'OCT': { 'best': { 'temperature': 26.6, 'pressure': 986.6, 'humidity': 22.0 },
+             'typical': { 'temperature': 28.6, 'pressure': 986.5, 'humidity': 33.0 },
+             'worst': { 'temperature': 25.8, 'pressure': 996.6, 'humidity': 57.0 } },
+    'NOV': { 'best': { 'temperature': 32.5, 'pressure': 986.7, 'humidity': 19.7 },
+             'typical': { 'temperature': 22.1, 'pressure': 990.2, 'humidity': 58.0 },
+             'worst': { 'temperature': 24.7, 'pressure': 989.5, 'humidity': 71.9 } },
+    'DEC': { 'best': { 'temperature': 29.5, 'pressure': 986.8, 'humidity': 30.0 },
+             'typical': { 'temperature': 21.8, 'pressure': 987.0, 'humidity': 70.0 },
+             'worst': { 'temperature': 27.9, 'pressure': 984.5, 'humidity': 71.0 } },
+    'SUMMER': { 'best': { 'temperature': 29.5, 'pressure': 986.8, 'humidity': 30.0 },
+                'typical': { 'temperature': 29.9, 'pressure': 989.1, 'humidity': 49.0 },
+                'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } },
+    'AUTUMN': { 'best': { 'temperature': 19.5, 'pressure': 1008.0, 'humidity': 31.0 },
+                'typical': { 'temperature': 23.6, 'pressure': 1016.5, 'humidity': 51.0 },
+                'worst': { 'temperature': 28.2, 'pressure': 988.0, 'humidity': 69.7 } },
+    'WINTER': { 'best': { 'temperature': -1.6, 'pressure': 1016.9, 'humidity': 95.0 },
+                'typical': { 'temperature': 9.7, 'pressure': 1004.6, 'humidity': 83.0 },
+                'worst': { 'temperature': 15.6, 'pressure': 1004.2, 'humidity': 100.0 } },
+    'SPRING': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
+                'typical': { 'temperature': 14.9, 'pressure': 997.5, 'humidity': 68.7 },
+                'worst': { 'temperature': 24.7, 'pressure': 989.5, 'humidity': 71.9 } },
+    'APRS': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
+              'typical': { 'temperature': 12.7, 'pressure': 1011.1, 'humidity': 72.0 },
+              'worst': { 'temperature': 19.7, 'pressure': 1001.6, 'humidity': 85.0 } },
+    'OCTS': { 'best': { 'temperature': 26.6, 'pressure': 986.6, 'humidity': 22.0 },
+              'typical': { 'temperature': 22.1, 'pressure': 988.7, 'humidity': 66.7 },
+              'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } },
+    'ANNUAL': { 'best': { 'temperature': 19.9, 'pressure': 989.9, 'humidity': 27.0 },
+                'typical': { 'temperature': 16.6, 'pressure': 1010.3, 'humidity': 57.5 },
+                'worst': { 'temperature': 26.3, 'pressure': 1001.9, 'humidity': 91.0 } }
+}
+# The w_rms / w_mean weighting factors we determined from simulations, for each
+# array and whether antenna 6 is included in the imaging.
+weightingFactors = [
+    { 'array': [ '6000', '6km', '3000', '3km' ],
+      'factors': [
+          { 'ca06': True,
+            'R2': { 'avg': 1.039, 'min': 1.000, 'max': 1.079, 'beam': 1.32 },
+            'R1': { 'avg': 1.040, 'min': 1.000, 'max': 1.080, 'beam': 1.32 },
+            'R0': { 'avg': 1.871, 'min': 1.350, 'max': 2.781, 'beam': 0.84 },
+            'R-1': { 'avg': 5.791, 'min': 3.685, 'max': 10.987, 'beam': 0.80 },
+            'R-2': { 'avg': 5.847, 'min': 3.688, 'max': 11.240, 'beam': 0.80 } },
+          { 'ca06': False,
+            'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 0.97 },
+            'R1': { 'avg': 1.002, 'min': 1.001, 'max': 1.004, 'beam': 0.89 },
+            'R0': { 'avg': 1.882, 'min': 1.703, 'max': 1.943, 'beam': 0.66 },
+            'R-1': { 'avg': 3.875, 'min': 2.543, 'max': 7.102, 'beam': 0.64 },
+            'R-2': { 'avg': 3.908, 'min': 2.562, 'max': 7.222, 'beam': 0.64 } } ] },
+    { 'array': [ '1500', '1.5km' ],
+      'factors': [
+          { 'ca06': True,
+            'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
+            'R1': { 'avg': 1.000, 'min': 1.000, 'max': 1.001, 'beam': 1.32 },
+            'R0': { 'avg': 1.507, 'min': 1.181, 'max': 1.846, 'beam': 0.84 },
+            'R-1': { 'avg': 7.925, 'min': 5.200, 'max': 16.732, 'beam': 0.80 },
+            'R-2': { 'avg': 8.151, 'min': 5.163, 'max': 19.304, 'beam': 0.80 } },
+          { 'ca06': False,
+            'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 0.96 },
+            'R1': { 'avg': 1.001, 'min': 1.000, 'max': 1.003, 'beam': 0.88 },
+            'R0': { 'avg': 1.854, 'min': 1.576, 'max': 1.953, 'beam': 0.64 },
+            'R-1': { 'avg': 3.900, 'min': 2.524, 'max': 8.218, 'beam': 0.62 },
+            'R-2': { 'avg': 3.923, 'min': 2.506, 'max': 8.707, 'beam': 0.62 } } ] },
+    { 'array': [ '750', '750m' ],
+      'factors': [
+          { 'ca06': True,
+            'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
+            'R1': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
+            'R0': { 'avg': 1.299, 'min': 1.143, 'max': 1.621, 'beam': 0.84 },
+            'R-1': { 'avg': 12.893, 'min': 8.581, 'max': 17.674, 'beam': 0.80 },
+            'R-2': { 'avg': 14.027, 'min': 8.882, 'max': 22.273, 'beam': 0.80 } },
+          { 'ca06': False,
+            'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 0.96 },
+            'R1': { 'avg': 1.001, 'min': 1.000, 'max': 1.002, 'beam': 0.88 },
+            'R0': { 'avg': 1.925, 'min': 1.850, 'max': 1.971, 'beam': 0.62 },
+            'R-1': { 'avg': 3.557, 'min': 2.578, 'max': 5.255, 'beam': 0.59 },
+            'R-2': { 'avg': 3.582, 'min': 2.583, 'max': 5.369, 'beam': 0.59 } } ] },
+    { 'array': [ '367', 'EW352', 'EW367', 'EW352/367' ],
+      'factors': [
+          { 'ca06': True,
+            'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
+            'R1': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
+            'R0': { 'avg': 1.077, 'min': 1.029, 'max': 1.157, 'beam': 0.84 },
+            'R-1': { 'avg': 18.304, 'min': 16.432, 'max': 17.498, 'beam': 0.80 },
+            'R-2': { 'avg': 31.295, 'min': 20.574, 'max': 52.204, 'beam': 0.80 } },
+          { 'ca06': False,
+            'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.09 },
+            'R1': { 'avg': 1.001, 'min': 1.000, 'max': 1.001, 'beam': 1.00 },
+            'R0': { 'avg': 1.917, 'min': 1.838, 'max': 1.965, 'beam': 0.68 },
+            'R-1': { 'avg': 3.271, 'min': 2.537, 'max': 4.639, 'beam': 0.64 },
+            'R-2': { 'avg': 3.298, 'min': 2.550, 'max': 4.718, 'beam': 0.64 } } ] },
+    { 'array': [ 'h214', 'H214', 'h168', 'H168', 'h75', 'H75' ],
+      'factors': [
+          { 'ca06': True,
+            'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32},
+            'R1': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32},
+            'R0': { 'avg': 1.106, 'min': 1.023, 'max': 1.186, 'beam': 0.84},
+            'R-1': { 'avg': 16.865, 'min': 15.629, 'max': 18.294, 'beam': 0.80 },
+            'R-2': { 'avg': 26.926, 'min': 18.717, 'max': 58.094, 'beam': 0.80 } },
+          { 'ca06': False,
+            'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 0.75 },
+            'R1': { 'avg': 1.001, 'min': 1.001, 'max': 1.002, 'beam': 0.74 },
+            'R0': { 'avg': 1.641, 'min': 1.529, 'max': 1.760, 'beam': 0.61 },
+            'R-1': { 'avg': 1.984, 'min': 1.753, 'max': 2.281, 'beam': 0.59 },
+            'R-2': { 'avg': 1.988, 'min': 1.755, 'max': 2.288, 'beam': 0.59 } } ] } ]
+# The positions (X, Y, Z in m) of the ATCA stations.
+stationLocations = {
+    'W0': [ -4752438.459, 2790321.299, -3200483.747 ],
+    'W2': [ -4752422.922, 2790347.675, -3200483.747 ],
+    'W4': [ -4752407.385, 2790374.052, -3200483.747 ],
+    'W6': [ -4752391.848, 2790400.428, -3200483.747 ],
+    'W8': [ -4752376.311, 2790426.804, -3200483.747 ],
+    'W10': [ -4752360.774, 2790453.181, -3200483.747 ],
+    'W12': [ -4752345.237, 2790479.557, -3200483.747 ],
+    'W14': [ -4752329.700, 2790505.934, -3200483.747 ],
+    'W16': [ -4752314.163, 2790532.310, -3200483.747 ],
+    'W32': [ -4752189.868, 2790743.321, -3200483.747 ],
+    'W45': [ -4752088.877, 2790914.767, -3200483.747 ],
+    'W64': [ -4751941.276, 2791165.342, -3200483.747 ],
+    'W84': [ -4751785.907, 2791429.106, -3200483.747 ],
+    'W98': [ -4751677.148, 2791613.741, -3200483.747 ],
+    'W100': [ -4751661.611, 2791640.117, -3200483.747 ],
+    'W102': [ -4751646.074, 2791666.493, -3200483.747 ],
+    'W104': [ -4751630.537, 2791692.870, -3200483.747 ],
+    'W106': [ -4751615.000, 2791719.246, -3200483.747 ],
+    'W109': [ -4751591.695, 2791758.810, -3200483.747 ],
+    'W110': [ -4751583.926, 2791771.999, -3200483.747 ],
+    'W111': [ -4751576.158, 2791785.187, -3200483.747 ],
+    'W112': [ -4751568.389, 2791798.375, -3200483.747 ],
+    'W113': [ -4751560.621, 2791811.563, -3200483.747 ],
+    'W124': [ -4751475.168, 2791956.633, -3200483.747 ],
+    'W125': [ -4751467.399, 2791969.821, -3200483.747 ],
+    'W128': [ -4751444.094, 2792009.386, -3200483.747 ],
+    'W129': [ -4751436.325, 2792022.574, -3200483.747 ],
+    'W140': [ -4751350.872, 2792167.644, -3200483.747 ],
+    'W147': [ -4751296.492, 2792259.961, -3200483.747 ],
+    'W148': [ -4751288.724, 2792273.149, -3200483.747 ],
+    'W163': [ -4751172.197, 2792470.972, -3200483.747 ],
+    'W168': [ -4751133.354, 2792536.913, -3200483.747 ],
+    'W172': [ -4751102.281, 2792589.666, -3200483.747 ],
+    'W173': [ -4751094.512, 2792602.854, -3200483.747 ],
+    'W182': [ -4751024.596, 2792721.547, -3200483.747 ],
+    'W189': [ -4750970.216, 2792813.865, -3200483.747 ],
+    'W190': [ -4750962.448, 2792827.053, -3200483.747 ],
+    'W195': [ -4750923.605, 2792892.994, -3200483.747 ],
+    'W196': [ -4750915.837, 2792906.182, -3200483.747 ],
+    'W392': [ -4749393.198, 2795491.050, -3200483.694 ],
+    'N2': [ -4751628.291, 2791727.075, -3200457.305 ],
+    'N5': [ -4751648.226, 2791738.818, -3200417.642 ],
+    'N7': [ -4751661.517, 2791746.647, -3200391.200 ],
+    'N11': [ -4751688.098, 2791762.304, -3200338.316 ],
+    'N14': [ -4751708.034, 2791774.047, -3200298.653 ] }
+# The stations at the ends of each array, between which the longest baselines are.
+endStations = [
+    { 'array': [ '6000', '6km', '3000', '3km' ],
+      'stations': [ 'W2', 'W196' ] },
+    { 'array': [ '1500', '1.5km' ],
+      'stations': [ 'W98', 'W195' ] },
+    { 'array': [ '750', '750m' ],
+      'stations': [ 'W98', 'W148' ] },
+    { 'array': [ '367', 'EW367', 'EW352/367' ],
+      'stations': [ 'W104', 'W128' ] },
+    { 'array': [ 'EW352' ],
+      'stations': [ 'W102', 'W125' ] },
+    { 'array': [ 'h214', 'H214' ],
+      'stations': [ 'W98', 'W113', 'W104', 'N14' ] },
+    { 'array': [ 'h168', 'H168' ],
+      'stations': [ 'W100', 'W111', 'W104', 'N11' ] },
+    { 'array': [ 'h75', 'H75' ],
+      'stations': [ 'W104', 'W109', 'W104', 'N5' ] } ]
+# The name of the shared data bundle whose tables we use, if any (see useBundle).
+bundleName = None
+# The number of sets of noise factors to keep (see noiseFactors).
+noiseCacheSize = 32
+# The sets of noise factors we have, most recently used last.
+noiseCache = collections.OrderedDict()
+# The number of channels to calculate the excess temperature for at a time.
+noiseChannelBlock = 4096
 # Some conversion factors.
 mhzToHz = 1.0e6 # Convert MHz to Hz
 degreesToArcmin = 60.0 # Convert degrees to arcminutes
@@ -148,49 +380,41 @@ def channelResolution(corrMode):
 def makeTemplate(centreFreq, bandwidth, channelWidth):
     # Make a blank spectrum that covers the specified frequency range with
     # the correct channel resolution.
-    c = []
-    v = []
-    f = []
-    n = []
-    x = []
-    p = []
     if (type(bandwidth) is float):
         lowFreq = centreFreq - (bandwidth - channelWidth) / 2 
         highFreq = centreFreq + (bandwidth - channelWidth) / 2
     elif (type(bandwidth) is list):
         lowFreq = centreFreq - bandwidth[0]
         highFreq = centreFreq + bandwidth[1]
-    cFreq = lowFreq
-    chanNum = 1
-    while (cFreq <= highFreq):
-        c.append(cFreq)
-        v.append(0.0)
-        n.append(0)
-        f.append(False)
-        p.append(0.0)
-        x.append(chanNum)
-        cFreq += channelWidth
-        chanNum += 1
-    nx = np.array(x)
+    # The number of channels that fit, allowing for rounding error in the range.
+    nChannels = int(math.floor((highFreq - lowFreq) / channelWidth + 1e-6)) + 1
+    lsb = False
     for i in range(0, len(sideBands['LSB'])):
         if ((centreFreq >= sideBands['LSB'][i][0]) and
             (centreFreq <= sideBands['LSB'][i][1])):
             # This band is LSB, so we flip the channel numbers.
-            nx = nx[::-1]
+            lsb = True
             break
-
-    return { 'centreFrequency': np.array(c), 'value': np.array(v),
-             'count': np.array(n), 'flags': f,
-             'flaggedBandwidth': p,
-             'channelWidth': channelWidth, 'channelNumber': nx }
+    c, nx = templates.channelGrid(lowFreq, nChannels, channelWidth, lsb)
+
+    return templates.Template(c, channelWidth, channelNumber=nx)
+
+def closestChannel(template, freq):
+    # Return the centre frequency of the channel in the template that is closest to
+    # freq (MHz), and how far away it is. The channels are in frequency order, so
+    # only the channels either side of freq need to be looked at.
+    i = np.searchsorted(template['centreFrequency'], freq)
+    closest = None
+    for j in [ (i - 1), i ]:
+        if (j >= 0 and j < len(template['centreFrequency'])):
+            offs = abs(template['centreFrequency'][j] - freq)
+            if (closest is None or offs < closest[1]):
+                closest = [ template['centreFrequency'][j], offs ]
+    return closest
 
 def averageTemplate(template):
     # Return the average unflagged value of a template.
-    varr = np.array([])
-    for i in range(0, len(template['value'])):
-        if (template['flags'][i] == False):
-            varr = np.append(varr, template['value'][i])
-    return np.mean(varr)
+    return np.mean(template['value'][~template['flags']])
 
 def getFreq(item):
     return item[0]
@@ -287,70 +511,29 @@ def brightnessTemperatureSensitivity(rms, synthBeam, freq):
 def readTsys(filename, lf, hf):
     # Open the filename.
     if (os.path.isfile(filename)):
-        # Read it.
-        d = np.loadtxt(filename)
-        # Sort it.
-        ds = sorted(d, key=getFreq)
-        # Split it.
-        startIndex = 0
-        endIndex = len(ds) - 1
-        llf = lf / 1000.0
-        hhf = hf / 1000.0
-        while ((ds[startIndex][0] < llf) and
-               (startIndex < (len(ds) - 1)) and
-               (ds[startIndex + 1][0] < llf)):
-            startIndex += 1
-        while ((ds[endIndex][0] > hhf) and
-               (endIndex > 0) and
-               (ds[endIndex - 1][0] > hhf)):
-            endIndex -= 1
-        if (startIndex == endIndex):
-            if (startIndex > 0):
-                startIndex -= 1
-            if (endIndex < (len(ds) - 1)):
-                endIndex += 1
-        dds = ds[startIndex:(endIndex + 1)]
-        c = [np.around(row[0] * 1000.0) for row in dds]
-        v = [(10 ** row[1]) for row in dds]
-        n = []
-        f = []
-        for i in range(0, len(v)):
-            n.append(1)
-            f.append(False)
-        return { 'centreFrequency': c, 'value': v, 'count': np.array(n),
-                 'flags': f,
-                 'channelWidth': 1.0 }
+        # Get the compiled table of the file, which is sorted by frequency and has
+        # the system temperatures already exponentiated.
+        store = tsysstore.getStore(filename)
+        d = store['table']
+        # Take the part of it that covers the frequency range.
+        startIndex, endIndex = tsysstore.frequencyRange(d, (lf / 1000.0), (hf / 1000.0))
+        c = np.around(d[0][startIndex:(endIndex + 1)] * 1000.0)
+        v = np.array(d[1][startIndex:(endIndex + 1)])
+        t = templates.Template(c, 1.0, value=v, count=np.ones(len(v)))
+        # Keep the same part of the pyramid of binned temperatures, as templates with
+        # the sum of the temperatures in each bin as the value.
+        t['pyramid'] = [ templates.Template((low + width / 2.0), float(width), value=sums, count=counts)
+                         for width, low, sums, counts in tsysstore.pyramidSlice(store, c, v) ]
+        return t
     else:
         raise CalcError("Can't find Tsys file %s." % filename)
 
-def lowHigh(c, w):
-    return { 'low': c - (w / 2.0), 'high': c + (w / 2.0) }
-
-def overlaps(a, b):
-    if (b['low'] >= a['high']):
-        return False
-    if (b['high'] <= a['low']):
-        return False
-    return True
-
-def templateAverage(t):
-    # Divide the values by the counts.
-    for i in range(0, len(t['centreFrequency'])):
-        if (t['count'][i] > 0):
-            t['value'][i] /= float(t['count'][i])
-            if (isinstance(t['flags'][i], list) == True):
-                # Multiple input flags, we choose the most common.
-                ft = 0
-                ff = 0
-                for j in range(0, len(t['flags'][i])):
-                    if (t['flags'][i][j]):
-                        ft += 1
-                    else:
-                        ff += 1
-                if (ft > ff):
-                    t['flags'][i] = True
-                else:
-                    t['flags'][i] = False
+def templateAverage(t, flagVotes):
+    # Divide the values by the counts. Of the values that went into each channel,
+    # flagVotes were flagged, and we choose the most common flag.
+    filled = (t['count'] > 0)
+    t['value'][filled] /= t['count'][filled]
+    t['flags'][filled] = ((2 * flagVotes[filled]) > t['count'][filled])
 
 def linearInterpolate(p1, p2, pi):
     # Using information from p1 and p2, determine the value at pi.
@@ -376,112 +559,105 @@ def templateInterpolate(t):
     iv = np.interp(rf, cf, vs)
     t['value'][zeroes] = iv
     
+def pyramidLevel(srcTemplate, destTemplate):
+    # Return the coarsest level of the pyramid of srcTemplate that can fill in
+    # destTemplate, or None if there isn't one. The bins of a level must fit exactly
+    # into the destination channels, which they do when the channel width and the
+    # bottom edge of the channels are multiples of the bin width.
+    if ('pyramid' not in srcTemplate or srcTemplate['channelWidth'] != 1.0 or
+        len(destTemplate) == 0 or np.any(srcTemplate['flags'])):
+        return None
+    bottom = destTemplate['centreFrequency'][0] - destTemplate['channelWidth'] / 2.0
+    for level in reversed(srcTemplate['pyramid']):
+        width = level['channelWidth']
+        if ((destTemplate['channelWidth'] % width) == 0 and (bottom % width) == 0):
+            return level
+    return None
+
+def pyramidFill(srcTemplate, destTemplate):
+    # Fill in a template spectrum from the coarsest usable level of the pyramid of
+    # binned system temperatures that came with srcTemplate, which gives the same
+    # averages as filling it from the 1 MHz channels while using far fewer of them.
+    # Return False if there is no usable level, or the edges of destTemplate would
+    # need interpolating, so the 1 MHz channels should be used instead.
+    level = pyramidLevel(srcTemplate, destTemplate)
+    if (level is None):
+        return False
+    plan = templates.fillPlan(level, destTemplate)
+    sums = templates.applyFillPlan(plan, level['value'])
+    counts = templates.applyFillPlan(plan, level['count'])
+    # The 1 MHz channel straddling the bottom of destTemplate goes into its bottom
+    # channel, but the bin it is in is below destTemplate.
+    bottom = destTemplate['centreFrequency'][0] - destTemplate['channelWidth'] / 2.0
+    i, j = np.searchsorted(srcTemplate['centreFrequency'], [ (bottom - 0.5), (bottom + 0.5) ],
+                           side='right')
+    sums[0] += np.sum(srcTemplate['value'][i:j])
+    counts[0] += (j - i)
+    if (counts[0] == 0 or counts[-1] == 0):
+        return False
+    destTemplate['value'] += sums
+    destTemplate['count'] += np.around(counts).astype(np.int64)
+    templateAverage(destTemplate, np.zeros(len(destTemplate), dtype=np.int64))
+    templateInterpolate(destTemplate)
+    return True
+
 def templateFill(srcTemplate, destTemplate):
-    # Fill in a template spectrum with values from another template, and do it with
-    # a single pass of each array (no looping).
-    i = 0 # The index of the destination template bin
-    j = 0 # The index of the source template bin
-    sfs = lowHigh(srcTemplate['centreFrequency'][j], srcTemplate['channelWidth'])
-    dfs = lowHigh(destTemplate['centreFrequency'][i], destTemplate['channelWidth'])
-    while (i < len(destTemplate['centreFrequency']) and
-           j < len(srcTemplate['centreFrequency'])):
-        if (overlaps(dfs, sfs)):
-            destTemplate['value'][i] += srcTemplate['value'][j]
-            destTemplate['count'][i] += 1
-            if (destTemplate['count'][i] > 1):
-                if (destTemplate['count'][i] == 2):
-                    t = [ destTemplate['flags'][i], srcTemplate['flags'][j] ]
-                    destTemplate['flags'][i] = t
-                else:
-                    destTemplate['flags'][i].append(srcTemplate['flags'][j])
-            else:
-                destTemplate['flags'][i] = srcTemplate['flags'][j]
-            j += 1
-            if (j < len(srcTemplate['centreFrequency'])):
-                sfs = lowHigh(srcTemplate['centreFrequency'][j], srcTemplate['channelWidth'])
-        elif (srcTemplate['centreFrequency'][j] < destTemplate['centreFrequency'][i]):
-            j += 1
-            if (j < len(srcTemplate['centreFrequency'])):
-                sfs = lowHigh(srcTemplate['centreFrequency'][j], srcTemplate['channelWidth'])
-        else:
-            i += 1
-            if (i < len(destTemplate['centreFrequency'])):
-                dfs = lowHigh(destTemplate['centreFrequency'][i], destTemplate['channelWidth'])
-
-    templateAverage(destTemplate)
-
-    # Check that the edges aren't empty
-    # Bottom edge.
-    if (destTemplate['count'][0] == 0):
-        # Have to interpolate from the source template.
-        dfs = lowHigh(destTemplate['centreFrequency'][0], destTemplate['channelWidth'])
-        j = 0
-        sfs = lowHigh(srcTemplate['centreFrequency'][j], srcTemplate['channelWidth'])
-        while (sfs['high'] < dfs['low']):
-            j += 1
-            sfs = lowHigh(srcTemplate['centreFrequency'][j], srcTemplate['channelWidth'])
-        j -= 1 # Because the breaking point is when the frequency goes too high.
-        i = 1
-        while (i < (len(destTemplate['count']) - 1) and destTemplate['count'][i] == 0):
-            i += 1
-        destTemplate['value'][0] = linearInterpolate({ 'value': srcTemplate['value'][j],
-                                                       'frequency': srcTemplate['centreFrequency'][j] },
-                                                     { 'value': destTemplate['value'][i],
-                                                       'frequency': destTemplate['centreFrequency'][i] },
-                                                     { 'frequency': destTemplate['centreFrequency'][0] } )
-        destTemplate['count'][0] = 1
-    # Top edge.
-    if (destTemplate['count'][-1] == 0):
-        dfs = lowHigh(destTemplate['centreFrequency'][-1], destTemplate['channelWidth'])
-        j = 0
-        sfs = lowHigh(srcTemplate['centreFrequency'][j], srcTemplate['channelWidth'])
-        while (sfs['high'] <= dfs['low']):
-            j += 1
-            if (j < len(srcTemplate['centreFrequency'])):
-                sfs = lowHigh(srcTemplate['centreFrequency'][j], srcTemplate['channelWidth'])
-            else:
-                j -= 1
-                break
-        # Break point is fine this time.
-        i = -2
-        while (destTemplate['count'][i] == 0 and (abs(i) < (len(destTemplate['centreFrequency'])))):
-            i -= 1
-        destTemplate['value'][-1] = linearInterpolate({ 'value': srcTemplate['value'][j],
-                                                        'frequency': srcTemplate['centreFrequency'][j] },
-                                                      { 'value': destTemplate['value'][i],
-                                                        'frequency': destTemplate['centreFrequency'][i] },
-                                                      { 'frequency': destTemplate['centreFrequency'][-1] } )
-        destTemplate['count'][-1] = 1
+    # Fill in a template spectrum with values from another template. Which source
+    # channels go into which destination channels depends only on the channels of
+    # the two templates, and is worked out (or found again) by templates.fillPlan.
+    # System temperatures are filled from their pyramid when they can be.
+    if (pyramidFill(srcTemplate, destTemplate)):
+        return
+    plan = templates.fillPlan(srcTemplate, destTemplate)
+    destTemplate['value'] += templates.applyFillPlan(plan, srcTemplate['value'])
+    destTemplate['count'] += plan['count']
+    templateAverage(destTemplate, templates.fillPlanVotes(plan, srcTemplate['flags']))
+
+    # Check that the edges aren't empty, and interpolate them if they are.
+    for edge, k in [ ('bottom', 0), ('top', -1) ]:
+        if (plan[edge] is not None):
+            j, i = plan[edge]
+            destTemplate['value'][k] = linearInterpolate({ 'value': srcTemplate['value'][j],
+                                                           'frequency': srcTemplate['centreFrequency'][j] },
+                                                         { 'value': destTemplate['value'][i],
+                                                           'frequency': destTemplate['centreFrequency'][i] },
+                                                         { 'frequency': destTemplate['centreFrequency'][k] } )
+            destTemplate['count'][k] = 1
 
     templateInterpolate(destTemplate)
 
 def templateEfficiency():
     # The template returned by this routine contains all the efficiencies for
     # all the bands.
-    c = [   900.0,   1200.0,   1500.0,   1800.0,  2100.0,  2300.0,  2500.0,  4400.0,  5900.0,
-           7400.0,   8800.0,  10600.0,  16000.0, 16500.0, 17000.0, 17500.0, 18000.0, 18500.0,
-          19000.0,  19500.0,  20000.0,  20500.0, 21000.0, 21500.0, 22000.0, 22500.0, 23000.0,
-          23500.0,  24000.0,  24500.0,  25000.0, 25400.0, 30000.0, 31000.0, 32000.0, 33000.0,
-          34000.0,  35000.0,  36000.0,  37000.0, 38000.0, 39000.0, 40000.0, 41000.0, 42000.0,
-          43000.0,  44000.0,  45000.0,  46000.0, 47000.0, 48000.0, 49000.0, 50000.0, 83781.1,
-          85556.2,  86834.3,  88680.5,  90526.6, 91946.7, 94005.9, 95852.1, 97272.2, 98976.3,
-         100254.4, 102200.0, 102300.0, 106432.0 ]
-    v = [  0.57,     0.57,     0.60,     0.53,    0.43,    0.42,    0.44,    0.65,    0.72,
-           0.65,     0.64,     0.65,     0.58,    0.62,    0.63,    0.65,    0.67,    0.70,
-           0.68,     0.64,     0.64,     0.60,    0.53,    0.55,    0.54,    0.51,    0.51,
-           0.53,     0.49,     0.49,     0.46,    0.47,    0.60,    0.60,    0.60,    0.60,
-           0.60,     0.60,     0.60,     0.60,    0.60,    0.60,    0.60,    0.59,    0.58,
-           0.57,     0.56,     0.55,     0.54,    0.53,    0.52,    0.51,    0.50,    0.3297,
-           0.3065,   0.3020,   0.2856,   0.2689,  0.2670,  0.2734,  0.2727,  0.2521,  0.2403,
-           0.2336,   0.2322,   0.14,     0.14 ]
-    f = []
-    n = []
-    for i in range(0, len(c)):
-        n.append(1)
-        f.append(False)
-    return { 'centreFrequency': np.array(c), 'value': np.array(v),
-             'count': np.array(n), 'flags': f,
-             'channelWidth': 1.0 }
+    return templates.Template(efficiencyFrequencies, 1.0, value=efficiencyValues,
+                              count=np.ones(len(efficiencyFrequencies)))
+
+def bundleContents():
+    # The tables to put into a shared data bundle (see databundle): the Tsys for
+    # each band, the efficiencies, and the weather, weighting factor and station
+    # tables.
+    return { 'tsys': sorted(set(frequencyBands[b]['tsys'] for b in frequencyBands)),
+             'arrays': { 'efficiency': np.array([ efficiencyFrequencies, efficiencyValues ]) },
+             'data': { 'weatherConditions': weatherConditions, 'weightingFactors': weightingFactors,
+                       'stationLocations': stationLocations, 'endStations': endStations } }
+
+def useBundle(name):
+    # Use the tables in the shared data bundle called name instead of our own. The
+    # Tsys and efficiencies are used straight from the shared memory.
+    global bundleName, efficiencyFrequencies, efficiencyValues, weatherConditions
+    global weightingFactors, stationLocations, endStations
+    try:
+        bundle = databundle.attachBundle(name)
+    except (OSError, ValueError):
+        _, e, _ = sys.exc_info()
+        raise CalcError("Can't use data bundle %s: %s" % (name, e))
+    efficiencyFrequencies = bundle['arrays']['efficiency'][0]
+    efficiencyValues = bundle['arrays']['efficiency'][1]
+    weatherConditions = bundle['data']['weatherConditions']
+    weightingFactors = bundle['data']['weightingFactors']
+    stationLocations = bundle['data']['stationLocations']
+    endStations = bundle['data']['endStations']
+    bundleName = name
 
 def fillAtmosphereTemplate(templateOpacity, templateTemperature, t, p, h):
     # Calculate the opacity and atmospheric temperature at the zenith for each frequency
@@ -533,85 +709,246 @@ def plotSpectrum(template, conditions, outname):
             plt.axvspan(x1, x2, alpha=0.2, edgecolor='none', facecolor='red')
     plt.savefig(outname)
 
-def flagTemplate(t, flagType, corrMode, edgeChan):
-    # Set the flags in the template.
+def flagTemplate(t, flagType, corrMode, edgeChan, mask=None):
+    # Set the flags in the template. For RFI flagging, mask can be the name of a
+    # file of RFI ranges to use instead of the known RFI ranges.
     if ((flagType == "continuum") or (flagType == "birdies")):
         # This is channel based flagging.
         flagSrc = channelFlagging[flagType]
         if (corrMode in flagSrc):
-            flagSrc = flagSrc[corrMode]
-            for c in range(0, len(flagSrc)):
-                for i in range(0, len(t['flags'])):
-                    if (t['channelNumber'][i] == flagSrc[c]):
-                        t['flags'][i] = True
-                        break
+            t['flags'][np.isin(t['channelNumber'], flagSrc[corrMode])] = True
     elif (flagType == "rfi"):
-        # This is frequency based flagging.
-        oldi = 0
-        flagSrc = frequencyFlagging[flagType]
-        for r in range(0, len(flagSrc)):
-            for i in range(oldi, len(t['flags'])):
-                f1 = t['centreFrequency'][i] - t['channelWidth'] / 2.0
-                f2 = t['centreFrequency'][i] + t['channelWidth'] / 2.0
-                if (f1 > flagSrc[r][1]):
-                    break
-                t['flaggedBandwidth'][i] += frequencyOverlap(f1, f2, flagSrc[r][0], flagSrc[r][1])
-                oldi = i
+        # This is frequency based flagging, from the known RFI ranges or the ranges
+        # in the specified mask file.
+        if (mask is None):
+            index = rfimask.getIndex(None, frequencyFlagging[flagType])
+        else:
+            try:
+                index = rfimask.getIndex(mask)
+            except (IOError, OSError, ValueError):
+                raise CalcError("Can't read RFI mask file %s." % mask)
+        t['flaggedBandwidth'] += rfimask.flaggedBandwidth(index, t)
         # Check for which channels are above the percentage flagged cut.
-        for i in range(0, len(t['flags'])):
-            p = t['flaggedBandwidth'][i] / t['channelWidth']
-            if (p > 0.5):
-                t['flags'][i] = True
+        t['flags'][(t['flaggedBandwidth'] / t['channelWidth']) > 0.5] = True
     elif (flagType == "edge"):
         # Flag edge channels.
-        for i in range(0, len(t['channelNumber'])):
-            cn = i + 1
-            rcn = len(t['channelNumber']) - i
-            if ((cn <= edgeChan) or
-                (rcn <= edgeChan)):
-                t['flags'][i] = True
+        if (edgeChan > 0):
+            t['flags'][:edgeChan] = True
+            t['flags'][-edgeChan:] = True
+
+def calculateSensitivityConditions(rmsTemplates, nAnts):
+    # Return the sensitivities (see calculateSensitivity) for a list of RMS noise
+    # templates with the same channels, like those for each weather condition, which
+    # are all worked out together.
+    values = np.array([ t['value'] for t in rmsTemplates ])
+    flags = np.array([ t['flags'] for t in rmsTemplates ])
+    # The unflagged channels are added up in order as a running sum, which gives
+    # exactly the same totals as adding them one at a time.
+    rmsTotals = np.cumsum(np.where(flags, 0.0, values), axis=1)[:, -1]
+    rmsNs = np.sum(~flags, axis=1)
+
+    results = []
+    for i in range(0, len(rmsTemplates)):
+        rmsN = int(rmsNs[i])
+        if (rmsN > 0):
+            rmsSpectral = rmsTotals[i] / rmsN
+            totalBandwidth = rmsN * rmsTemplates[i]['channelWidth']
+            rmsContinuum = rmsSpectral / math.sqrt(float(rmsN))
+            rmsZoom = rmsSpectral * math.sqrt(float(nZoomChannels))
+        else:
+            rmsSpectral = None
+            totalBandwidth = None
+            rmsContinuum = None
+            rmsZoom = None
+
+        # Calculate the SEFDs for each antenna and the array as a whole.
+        # We use TMS equation 1.6 for this and convert to Jy.
+        Aone = surfaceArea(antennaDiameter)
+        Aall = nAnts * Aone
+        sefdOne = 2.0 * boltzmann * rmsTemplates[i]['systemp'] / (Aone * 1e-26)
+        sefdAll = 2.0 * boltzmann * rmsTemplates[i]['systemp'] / (Aall * 1e-26)
+
+        results.append({ 'rms': { 'spectral': rmsSpectral, 'continuum': rmsContinuum, 'zoom': rmsZoom },
+                         'bandwidth': { 'unflagged': totalBandwidth }, 'sefd': { 'antenna': sefdOne,
+                                                                                 'array': sefdAll } })
+    return results
 
 def calculateSensitivity(rmsTemplate, nAnts):
     # Given a template filled with the RMS noise in each channel in the continuum
     # band, return the average sensitivity of the continuum band channels (the spectral
     # RMS), and the spectral RMS divided by the bandwidth (the continuum RMS). This
     # routine does this while respecting any flagging present in the template.
-    rmsTotal = 0.0
-    rmsZoomTotal = 0.0
-    rmsN = 0
-    rmsZoomN = 0
-    for i in range(0, len(rmsTemplate['value'])):
-        # We count flagged continuum channels in the zoom RMS calculation.
-        rmsZoomTotal += rmsTemplate['value'][i]
-        rmsZoomN += 1
-        if (rmsTemplate['flags'][i] == False):
-            rmsTotal += rmsTemplate['value'][i]
-            rmsN += 1
-    
-    if (rmsN > 0):
-        rmsSpectral = rmsTotal / rmsN
-        totalBandwidth = rmsN * rmsTemplate['channelWidth']
-        rmsContinuum = rmsSpectral / math.sqrt(float(rmsN))
-        rmsZoom = rmsSpectral * math.sqrt(float(nZoomChannels))
-    else:
-        rmsSpectral = None
-        totalBandwidth = None
-        rmsContinuum = None
-        rmsZoom = None
-
-    # Calculate the SEFDs for each antenna and the array as a whole.
-    # We use TMS equation 1.6 for this and convert to Jy.
-    Aone = surfaceArea(antennaDiameter)
-    Aall = nAnts * Aone
-    sefdOne = 2.0 * boltzmann * rmsTemplate['systemp'] / (Aone * 1e-26)
-    sefdAll = 2.0 * boltzmann * rmsTemplate['systemp'] / (Aall * 1e-26)
-
-    return { 'rms': { 'spectral': rmsSpectral, 'continuum': rmsContinuum, 'zoom': rmsZoom },
-             'bandwidth': { 'unflagged': totalBandwidth }, 'sefd': { 'antenna': sefdOne,
-                                                                     'array': sefdAll } }
+    return calculateSensitivityConditions([ rmsTemplate ], nAnts)[0]
+
+def haElevations(minHa, maxHa, perHa, sind, cosd):
+    # Return the sine of the elevation at each of the hour angles that the
+    # atmosphere is evaluated at, between minHa and maxHa (hours) with perHa
+    # evaluations per hour, for a source with the specified sine and cosine of
+    # declination.
+    nIntegrations = math.ceil((maxHa - minHa) * perHa)
+    sinels = []
+    for j in range(0, int(nIntegrations + 1)):
+        # The hour angle at this integration.
+        jHa = minHa + float(j) / perHa
+        # The elevation at this hour angle.
+        cosha = math.cos(math.radians(jHa * 15.0))
+        sinels.append(sinl * sind + cosl * cosd * cosha)
+    return sinels
+
+def haSamples(minHa, maxHa, perHa, sind, cosd, nodes=None):
+    # Return the sine of the elevation at each of the hour angles that the
+    # atmosphere is evaluated at ('sinel'), and how the values there are averaged
+    # over the hour angle range. Without nodes, these are the perHa evaluations per
+    # hour from haElevations, which are all weighted equally ('weights' is None).
+    # Otherwise the average is a Gauss-Legendre quadrature with that many nodes. The
+    # nodes of the rule with half as many nodes follow them, so the error of the
+    # quadrature can be estimated from the difference between the two rules; each
+    # rule's weights ('weights' and 'check') are zero at the other rule's nodes.
+    if (nodes is None):
+        return { 'sinel': np.array(haElevations(minHa, maxHa, perHa, sind, cosd)),
+                 'weights': None, 'check': None }
+    ha = []
+    weights = []
+    for n in [ nodes, max(1, (nodes // 2)) ]:
+        x, w = np.polynomial.legendre.leggauss(n)
+        ha.append((0.5 * (minHa + maxHa)) + (0.5 * (maxHa - minHa) * x))
+        # The weights add up to 2, and we want the average.
+        weights.append(w / 2.0)
+    ha = np.concatenate(ha)
+    sinel = sinl * sind + cosl * cosd * np.cos(np.radians(ha * 15.0))
+    return { 'sinel': sinel,
+             'weights': np.concatenate((weights[0], np.zeros(len(weights[1])))),
+             'check': np.concatenate((np.zeros(len(weights[0])), weights[1])) }
+
+def noiseKey(tsys, efficiency, opacity, temperature, minHa, maxHa, perHa, weighting,
+             sind, cosd, haNodes=None):
+    # A name for the noise factors made from these inputs.
+    nChannels = len(tsys['centreFrequency'])
+    k = hashlib.sha1()
+    k.update(np.array([ nChannels, tsys['channelWidth'], minHa, maxHa, perHa, weighting['avg'],
+                        sind, cosd ], dtype=np.float64).tobytes())
+    if (haNodes is not None):
+        k.update(np.array([ haNodes ], dtype=np.int64).tobytes())
+    for a in [ tsys['centreFrequency'], tsys['value'], tsys['flags'], tsys['channelNumber'],
+               efficiency['centreFrequency'], efficiency['value'], efficiency['flags'],
+               opacity['value'][:nChannels], temperature['value'][:nChannels] ]:
+        k.update(np.ascontiguousarray(a).tobytes())
+    return k.hexdigest()
+
+def noiseFactorsConditions(tsys, efficiency, opacities, temperatures, minHa, maxHa, perHa,
+                           weighting, sind, cosd, haNodes=None):
+    # Return the noise factors (see noiseFactors) for a number of weather conditions,
+    # given as lists of the opacity and temperature templates. The
+    # conditions we don't already have the factors for are calculated together, as
+    # (condition, channel, hour angle) arrays.
+    keys = [ noiseKey(tsys, efficiency, opacities[i], temperatures[i], minHa, maxHa, perHa,
+                      weighting, sind, cosd, haNodes) for i in range(0, len(opacities)) ]
+    missing = [ i for i in range(0, len(keys)) if keys[i] not in noiseCache ]
+    if (len(missing) > 0):
+        # The opacity and temperature templates can have more channels than the tsys
+        # template (like when the smoothed noise is calculated), in which case only as
+        # many of their channels as there are in the tsys template are used.
+        nChannels = len(tsys['centreFrequency'])
+        samples = haSamples(minHa, maxHa, perHa, sind, cosd, haNodes)
+        sinel = samples['sinel']
+        calc = list(range(0, len(missing)))
+
+        # Get the average excess temperature over the hour angles, a block of channels
+        # at a time to limit the size of the arrays.
+        excessTemp = np.empty((len(missing), nChannels))
+        excessError = None
+        if (samples['weights'] is not None):
+            excessError = np.empty((len(missing), nChannels))
+        for start in range(0, nChannels, noiseChannelBlock):
+            end = min((start + noiseChannelBlock), nChannels)
+            Texcess = np.empty((len(missing), (end - start), len(sinel)))
+            if (len(calc) > 0):
+                # Calculate the excess temperature due to the atmosphere and CMB.
+                opacity = np.array([ opacities[missing[k]]['value'][start:end] for k in calc ])
+                temperature = np.array([ temperatures[missing[k]]['value'][start:end] for k in calc ])
+                elFactor = np.exp(-1.0 * opacity[:, :, np.newaxis] / sinel[np.newaxis, np.newaxis, :])
+                cbFactor = 2.7 * elFactor
+                ivFactor = 1.0 - elFactor
+                atFactor = temperature[:, :, np.newaxis] * ivFactor
+                Texcess[calc] = atFactor + cbFactor
+            if (samples['weights'] is None):
+                excessTemp[:, start:end] = np.sum(Texcess, axis=2) / float(Texcess.shape[2])
+            else:
+                excessTemp[:, start:end] = np.dot(Texcess, samples['weights'])
+                excessError[:, start:end] = np.abs(np.dot(Texcess, (samples['weights'] -
+                                                                    samples['check'])))
+
+        # Check that the frequencies are the same in both templates.
+        good = (tsys['centreFrequency'] == efficiency['centreFrequency'])
+
+        Tmeas = tsys['value'][good] + excessTemp[:, good]
+        TmeasEff = Tmeas / efficiency['value'][good]
+        flags = (tsys['flags'][good] | efficiency['flags'][good])
+        numerator = (math.sqrt(2.0) * boltzmann * Tmeas * weighting['avg'])
+        denominator = (1e-26 * surfaceArea(antennaDiameter) * efficiency['value'][good])
+        systemp = np.mean(TmeasEff[:, ~flags], axis=1)
+        # The largest error in the system temperature of any unflagged channel that comes
+        # from averaging over the hour angles, if we can estimate it.
+        haError = [ None ] * len(missing)
+        if (excessError is not None and np.any(~flags)):
+            haError = np.max(excessError[:, good][:, ~flags] /
+                             efficiency['value'][good][~flags], axis=1)
+
+        for k in range(0, len(missing)):
+            noise = { 'centreFrequency': tsys['centreFrequency'][good], 'flags': flags,
+                      'channelNumber': tsys['channelNumber'][good],
+                      'numerator': numerator[k], 'denominator': denominator,
+                      'systemp': systemp[k], 'haError': haError[k] }
+            for q in [ 'centreFrequency', 'flags', 'channelNumber', 'numerator', 'denominator' ]:
+                noise[q].setflags(write=False)
+            noiseCache[keys[missing[k]]] = noise
+
+    noises = [ noiseCache[k] for k in keys ]
+    for k in keys:
+        noiseCache.move_to_end(k)
+    while (len(noiseCache) > noiseCacheSize):
+        noiseCache.popitem(last=False)
+    return noises
+
+def noiseFactors(tsys, efficiency, opacity, temperature, minHa, maxHa, perHa, weighting,
+                 sind, cosd, haNodes=None):
+    # Everything in the RMS noise of each channel (see calculateRms) that doesn't depend
+    # on the integration time or the number of antennas: the measured system temperature
+    # (in the numerator) and the efficiency weighted collecting area (in the denominator).
+    # The RMS noise for any integration time can then be found without repeating the
+    # atmosphere calculations, and the most recently used factors are kept so that
+    # asking again with only a different time is quick.
+    return noiseFactorsConditions(tsys, efficiency, [ opacity ], [ temperature ], minHa, maxHa,
+                                  perHa, weighting, sind, cosd, haNodes=haNodes)[0]
+
+def calculateRmsConditions(tsys, efficiency, opacities, temperatures, minHa, maxHa, perHa,
+                           nAntenna, totalTime, weighting, sind, cosd, haNodes=None):
+    # Return the RMS noise templates (see calculateRms) for a number of weather
+    # conditions, given as lists of the opacity and temperature templates.
+    # The noise in every channel for all the conditions is calculated at once.
+    noises = noiseFactorsConditions(tsys, efficiency, opacities, temperatures, minHa, maxHa,
+                                    perHa, weighting, sind, cosd, haNodes=haNodes)
+
+    # The units of this is actually mJy since we keep the frequency
+    # in MHz rather than converting to Hz (convenient isn't it!).
+    v = (np.array([ noise['numerator'] for noise in noises ]) /
+         (np.array([ noise['denominator'] for noise in noises ]) *
+          math.sqrt(float(nAntenna) * float(nAntenna - 1) *
+                    tsys['channelWidth'] * (totalTime * 60.0))))
+
+    rms = []
+    for i, noise in enumerate(noises):
+        t = templates.Template(noise['centreFrequency'], tsys['channelWidth'], value=v[i],
+                               count=np.ones(len(v[i])), flags=noise['flags'].copy(),
+                               channelNumber=noise['channelNumber'])
+        t['systemp'] = noise['systemp']
+        t['systemTemperature'] = float("%.1f" % noise['systemp'])
+        t['haError'] = noise['haError']
+        rms.append(t)
+    return rms
 
 def calculateRms(tsys, efficiency, opacity, temperature, minHa, maxHa, perHa, nAntenna,
-                 totalTime, weighting, sind, cosd):
+                 totalTime, weighting, sind, cosd, haNodes=None):
     # Given the tsys and efficiency templates, the number of antennas involved in the
     # imaging, the total integration time and the image weighting scheme, this routine
     # will return another template with each channel being the RMS noise expected in
@@ -619,69 +956,44 @@ def calculateRms(tsys, efficiency, opacity, temperature, minHa, maxHa, perHa, nA
     # digitisation) but A is multiplied by our efficiency factor. That equation is
     # for only a single polarisation though, so for an unpolarised source, the noise
     # level is sqrt(2) lower, which is where the sqrt(2) factor in the numerator comes from
-    # instead of the 2.
-
-    # The variables for our output template.
-    c = []
-    v = []
-    n = []
-    f = []
-
-    # Figure out how much time is spent in each integration period.
-    haRange = maxHa - minHa
-    nIntegrations = math.ceil(haRange * perHa)
-    intTime = totalTime / nIntegrations
-
-    Texcess = []
-    systemTemperature = []
-    for j in range(0, int(nIntegrations + 1)):
-        # The hour angle at this integration.
-        jHa = minHa + float(j) / perHa
-        
-        # The elevation at this hour angle.
-        cosha = math.cos(math.radians(jHa * 15.0))
-        sinel = sinl * sind + cosl * cosd * cosha
-        
-        # Calculate the excess temperature due to the atmosphere
-        # and CMB.
-        elFactor = np.exp(-1.0 * opacity['value'] / sinel)
-        cbFactor = 2.7 * elFactor
-        ivFactor = 1.0 - elFactor
-        atFactor = temperature['value'] * ivFactor
-        Texcess.append(atFactor + cbFactor)
-
-    for i in range(0, len(tsys['centreFrequency'])):
-        # Check that the frequencies are the same in both templates.
-        if (tsys['centreFrequency'][i] == efficiency['centreFrequency'][i]):
-            # All's good.
-            c.append(tsys['centreFrequency'][i])
-
-            # Get the average excess temperature now.
-            exTemp = [ row[i] for row in Texcess ]
-            excessTemp = np.sum(exTemp) / float(len(exTemp))
-
-            Tmeas = tsys['value'][i] + excessTemp
-            TmeasEff = Tmeas / efficiency['value'][i]
-            
-            # The units of this is actually mJy since we keep the frequency
-            # in MHz rather than converting to Hz (convenient isn't it!).
-            v.append((math.sqrt(2.0) * boltzmann * Tmeas * weighting['avg']) /
-                     (1e-26 * surfaceArea(antennaDiameter) *
-                      efficiency['value'][i] *
-                      math.sqrt(float(nAntenna) * float(nAntenna - 1) *
-                                tsys['channelWidth'] * (totalTime * 60.0))))
-            n.append(1)
-            if (tsys['flags'][i] or efficiency['flags'][i]):
-                f.append(True)
-            else:
-                f.append(False)
-                systemTemperature.append(TmeasEff)
-
-    return { 'centreFrequency': np.array(c), 'value': np.array(v),
-             'count': np.array(n), 'flags': f,
-             'channelWidth': tsys['channelWidth'], 'channelNumber': tsys['channelNumber'],
-             'systemp': np.mean(systemTemperature),
-             'systemTemperature': float("%.1f" % np.mean(systemTemperature))}
+    # instead of the 2. The atmosphere is averaged over the hour angles as described
+    # in haSamples, with haNodes nodes.
+    return calculateRmsConditions(tsys, efficiency, [ opacity ], [ temperature ], minHa, maxHa,
+                                  perHa, nAntenna, totalTime, weighting, sind, cosd,
+                                  haNodes=haNodes)[0]
+
+def smoothRms(rmsTemplate, smoothTemplate):
+    # Given a template with the RMS noise in each channel, return the RMS noise in each
+    # of the (wider) channels of smoothTemplate, which is otherwise empty. The channels
+    # that are averaged into each smoothed channel are the same ones templateFill would
+    # use, and the noise of that average is the square root of the sum of their squared
+    # noise levels divided by the number of channels. Only unflagged channels are
+    # averaged if there are any, and the smoothed channel is flagged if most of the
+    # channels in it are.
+    plan = templates.fillPlan(rmsTemplate, smoothTemplate)
+    good = ~rmsTemplate['flags']
+    squared = rmsTemplate['value'] * rmsTemplate['value']
+    nAll = plan['count']
+    nGood = templates.applyFillPlan(plan, good.astype(np.float64))
+    sumAll = templates.applyFillPlan(plan, squared)
+    sumGood = templates.applyFillPlan(plan, np.where(good, squared, 0.0))
+    value = np.zeros(len(nAll))
+    useGood = (nGood > 0)
+    useAll = (~useGood & (nAll > 0))
+    value[useGood] = np.sqrt(sumGood[useGood]) / nGood[useGood]
+    value[useAll] = np.sqrt(sumAll[useAll]) / nAll[useAll]
+    empty = (nAll == 0)
+    if (np.any(empty) and np.any(~empty)):
+        # Interpolate any channels at the edges that nothing went into.
+        value[empty] = np.interp(smoothTemplate['centreFrequency'][empty],
+                                 smoothTemplate['centreFrequency'][~empty], value[~empty])
+    t = templates.Template(smoothTemplate['centreFrequency'], smoothTemplate['channelWidth'],
+                           value=value, count=np.ones(len(value)),
+                           flags=((2 * templates.fillPlanVotes(plan, rmsTemplate['flags'])) > nAll),
+                           channelNumber=smoothTemplate['channelNumber'])
+    for q in [ 'systemp', 'systemTemperature', 'haError' ]:
+        t[q] = rmsTemplate[q]
+    return t
 
 def surfaceArea(d):
     # Given the diameter of a dish (m), return its surface area (m^2).
@@ -691,92 +1003,19 @@ def weightingFactor(weighting, array, ant6):
     # Return the w_rms / w_mean weighting factors given the weighting scheme,
     # the array configuration and whether antenna 6 is included in the imaging.
     
-    # The weighting factors we determined from simulations.
-    factors = [
-        { 'array': [ '6000', '6km', '3000', '3km' ],
-          'factors': [
-              { 'ca06': True,
-                'R2': { 'avg': 1.039, 'min': 1.000, 'max': 1.079, 'beam': 1.32 },
-                'R1': { 'avg': 1.040, 'min': 1.000, 'max': 1.080, 'beam': 1.32 },
-                'R0': { 'avg': 1.871, 'min': 1.350, 'max': 2.781, 'beam': 0.84 },
-                'R-1': { 'avg': 5.791, 'min': 3.685, 'max': 10.987, 'beam': 0.80 },
-                'R-2': { 'avg': 5.847, 'min': 3.688, 'max': 11.240, 'beam': 0.80 } },
-              { 'ca06': False,
-                'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 0.97 },
-                'R1': { 'avg': 1.002, 'min': 1.001, 'max': 1.004, 'beam': 0.89 },
-                'R0': { 'avg': 1.882, 'min': 1.703, 'max': 1.943, 'beam': 0.66 },
-                'R-1': { 'avg': 3.875, 'min': 2.543, 'max': 7.102, 'beam': 0.64 },
-                'R-2': { 'avg': 3.908, 'min': 2.562, 'max': 7.222, 'beam': 0.64 } } ] },
-        { 'array': [ '1500', '1.5km' ],
-          'factors': [
-              { 'ca06': True,
-                'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
-                'R1': { 'avg': 1.000, 'min': 1.000, 'max': 1.001, 'beam': 1.32 },
-                'R0': { 'avg': 1.507, 'min': 1.181, 'max': 1.846, 'beam': 0.84 },
-                'R-1': { 'avg': 7.925, 'min': 5.200, 'max': 16.732, 'beam': 0.80 },
-                'R-2': { 'avg': 8.151, 'min': 5.163, 'max': 19.304, 'beam': 0.80 } },
-              { 'ca06': False,
-                'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 0.96 },
-                'R1': { 'avg': 1.001, 'min': 1.000, 'max': 1.003, 'beam': 0.88 },
-                'R0': { 'avg': 1.854, 'min': 1.576, 'max': 1.953, 'beam': 0.64 },
-                'R-1': { 'avg': 3.900, 'min': 2.524, 'max': 8.218, 'beam': 0.62 },
-                'R-2': { 'avg': 3.923, 'min': 2.506, 'max': 8.707, 'beam': 0.62 } } ] },
-        { 'array': [ '750', '750m' ],
-          'factors': [
-              { 'ca06': True,
-                'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
-                'R1': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
-                'R0': { 'avg': 1.299, 'min': 1.143, 'max': 1.621, 'beam': 0.84 },
-                'R-1': { 'avg': 12.893, 'min': 8.581, 'max': 17.674, 'beam': 0.80 },
-                'R-2': { 'avg': 14.027, 'min': 8.882, 'max': 22.273, 'beam': 0.80 } },
-              { 'ca06': False,
-                'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 0.96 },
-                'R1': { 'avg': 1.001, 'min': 1.000, 'max': 1.002, 'beam': 0.88 },
-                'R0': { 'avg': 1.925, 'min': 1.850, 'max': 1.971, 'beam': 0.62 },
-                'R-1': { 'avg': 3.557, 'min': 2.578, 'max': 5.255, 'beam': 0.59 },
-                'R-2': { 'avg': 3.582, 'min': 2.583, 'max': 5.369, 'beam': 0.59 } } ] },
-        { 'array': [ '367', 'EW352', 'EW367', 'EW352/367' ],
-          'factors': [
-              { 'ca06': True,
-                'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
-                'R1': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32 },
-                'R0': { 'avg': 1.077, 'min': 1.029, 'max': 1.157, 'beam': 0.84 },
-                'R-1': { 'avg': 18.304, 'min': 16.432, 'max': 17.498, 'beam': 0.80 },
-                'R-2': { 'avg': 31.295, 'min': 20.574, 'max': 52.204, 'beam': 0.80 } },
-              { 'ca06': False,
-                'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.09 },
-                'R1': { 'avg': 1.001, 'min': 1.000, 'max': 1.001, 'beam': 1.00 },
-                'R0': { 'avg': 1.917, 'min': 1.838, 'max': 1.965, 'beam': 0.68 },
-                'R-1': { 'avg': 3.271, 'min': 2.537, 'max': 4.639, 'beam': 0.64 },
-                'R-2': { 'avg': 3.298, 'min': 2.550, 'max': 4.718, 'beam': 0.64 } } ] },
-        { 'array': [ 'h214', 'H214', 'h168', 'H168', 'h75', 'H75' ],
-          'factors': [
-              { 'ca06': True,
-                'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32},
-                'R1': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 1.32},
-                'R0': { 'avg': 1.106, 'min': 1.023, 'max': 1.186, 'beam': 0.84},
-                'R-1': { 'avg': 16.865, 'min': 15.629, 'max': 18.294, 'beam': 0.80 },
-                'R-2': { 'avg': 26.926, 'min': 18.717, 'max': 58.094, 'beam': 0.80 } },
-              { 'ca06': False,
-                'R2': { 'avg': 1.000, 'min': 1.000, 'max': 1.000, 'beam': 0.75 },
-                'R1': { 'avg': 1.001, 'min': 1.001, 'max': 1.002, 'beam': 0.74 },
-                'R0': { 'avg': 1.641, 'min': 1.529, 'max': 1.760, 'beam': 0.61 },
-                'R-1': { 'avg': 1.984, 'min': 1.753, 'max': 2.281, 'beam': 0.59 },
-                'R-2': { 'avg': 1.988, 'min': 1.755, 'max': 2.288, 'beam': 0.59 } } ] } ]
-
     # Search through the array.
-    for f in range(0, len(factors)):
+    for f in range(0, len(weightingFactors)):
         arrayFound = False
-        for i in range(0, len(factors[f]['array'])):
-            if (array == factors[f]['array'][i]):
+        for i in range(0, len(weightingFactors[f]['array'])):
+            if (array == weightingFactors[f]['array'][i]):
                 arrayFound = True
                 break
         if (arrayFound):
             g = 1
             if (ant6):
                 g = 0
-            if (weighting in factors[f]['factors'][g]):
-                return (factors[f]['factors'][g][weighting])
+            if (weighting in weightingFactors[f]['factors'][g]):
+                return (weightingFactors[f]['factors'][g][weighting])
     # We couldn't find the appropriate weighting factors.
     raise CalcError("Weighting factors are not available.")
 
@@ -784,71 +1023,6 @@ def maximumBaseline(array):
     # Return the maximum baseline length for a named array, both on the track
     # only, and including CA06.
 
-    stationLocations = {
-        'W0': [ -4752438.459, 2790321.299, -3200483.747 ],
-        'W2': [ -4752422.922, 2790347.675, -3200483.747 ],
-        'W4': [ -4752407.385, 2790374.052, -3200483.747 ],
-        'W6': [ -4752391.848, 2790400.428, -3200483.747 ],
-        'W8': [ -4752376.311, 2790426.804, -3200483.747 ],
-        'W10': [ -4752360.774, 2790453.181, -3200483.747 ],
-        'W12': [ -4752345.237, 2790479.557, -3200483.747 ],
-        'W14': [ -4752329.700, 2790505.934, -3200483.747 ],
-        'W16': [ -4752314.163, 2790532.310, -3200483.747 ],
-        'W32': [ -4752189.868, 2790743.321, -3200483.747 ],
-        'W45': [ -4752088.877, 2790914.767, -3200483.747 ],
-        'W64': [ -4751941.276, 2791165.342, -3200483.747 ],
-        'W84': [ -4751785.907, 2791429.106, -3200483.747 ],
-        'W98': [ -4751677.148, 2791613.741, -3200483.747 ],
-        'W100': [ -4751661.611, 2791640.117, -3200483.747 ],
-        'W102': [ -4751646.074, 2791666.493, -3200483.747 ],
-        'W104': [ -4751630.537, 2791692.870, -3200483.747 ],
-        'W106': [ -4751615.000, 2791719.246, -3200483.747 ],
-        'W109': [ -4751591.695, 2791758.810, -3200483.747 ],
-        'W110': [ -4751583.926, 2791771.999, -3200483.747 ],
-        'W111': [ -4751576.158, 2791785.187, -3200483.747 ],
-        'W112': [ -4751568.389, 2791798.375, -3200483.747 ],
-        'W113': [ -4751560.621, 2791811.563, -3200483.747 ],
-        'W124': [ -4751475.168, 2791956.633, -3200483.747 ],
-        'W125': [ -4751467.399, 2791969.821, -3200483.747 ],
-        'W128': [ -4751444.094, 2792009.386, -3200483.747 ],
-        'W129': [ -4751436.325, 2792022.574, -3200483.747 ],
-        'W140': [ -4751350.872, 2792167.644, -3200483.747 ],
-        'W147': [ -4751296.492, 2792259.961, -3200483.747 ],
-        'W148': [ -4751288.724, 2792273.149, -3200483.747 ],
-        'W163': [ -4751172.197, 2792470.972, -3200483.747 ],
-        'W168': [ -4751133.354, 2792536.913, -3200483.747 ],
-        'W172': [ -4751102.281, 2792589.666, -3200483.747 ],
-        'W173': [ -4751094.512, 2792602.854, -3200483.747 ],
-        'W182': [ -4751024.596, 2792721.547, -3200483.747 ],
-        'W189': [ -4750970.216, 2792813.865, -3200483.747 ],
-        'W190': [ -4750962.448, 2792827.053, -3200483.747 ],
-        'W195': [ -4750923.605, 2792892.994, -3200483.747 ],
-        'W196': [ -4750915.837, 2792906.182, -3200483.747 ],
-        'W392': [ -4749393.198, 2795491.050, -3200483.694 ],
-        'N2': [ -4751628.291, 2791727.075, -3200457.305 ],
-        'N5': [ -4751648.226, 2791738.818, -3200417.642 ],
-        'N7': [ -4751661.517, 2791746.647, -3200391.200 ],
-        'N11': [ -4751688.098, 2791762.304, -3200338.316 ],
-        'N14': [ -4751708.034, 2791774.047, -3200298.653 ] }
-
-    endStations = [
-        { 'array': [ '6000', '6km', '3000', '3km' ],
-          'stations': [ 'W2', 'W196' ] },
-        { 'array': [ '1500', '1.5km' ],
-          'stations': [ 'W98', 'W195' ] },
-        { 'array': [ '750', '750m' ],
-          'stations': [ 'W98', 'W148' ] },
-        { 'array': [ '367', 'EW367', 'EW352/367' ],
-          'stations': [ 'W104', 'W128' ] },
-        { 'array': [ 'EW352' ],
-          'stations': [ 'W102', 'W125' ] },
-        { 'array': [ 'h214', 'H214' ],
-          'stations': [ 'W98', 'W113', 'W104', 'N14' ] },
-        { 'array': [ 'h168', 'H168' ],
-          'stations': [ 'W100', 'W111', 'W104', 'N11' ] },
-        { 'array': [ 'h75', 'H75' ],
-          'stations': [ 'W104', 'W109', 'W104', 'N5' ] } ]
-
     # Search through the array.
     for s in range(0, len(endStations)):
         if (array in endStations[s]['array']):
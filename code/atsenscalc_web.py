@@ -146,6 +146,14 @@ if __name__ == "__main__":
     else:
         fargs['per_ha'] = 5.0
 
+    # How the atmosphere is averaged over the hour angles ("sample" or "quadrature"),
+    # and the number of quadrature nodes.
+    # Default "sample".
+    if ("ha_average" in form):
+        fargs['ha_average'] = form['ha_average'].value
+    if ("ha_nodes" in form):
+        fargs['ha_nodes'] = int(form['ha_nodes'].value)
+
     # Do not output progress messages.
     # Default true (because we run on the server).
     fargs['quiet'] = True
@@ -158,12 +166,13 @@ if __name__ == "__main__":
     fargs['rfi'] = ("rfi" in form)
 
     # The number of continuum spectral channels to bin together in the
-    # output.
+    # output. The continuum sensitivities are also given for any other
+    # numbers of channels, if the field is repeated.
     # Default 1.
     if ("smoothing" in form):
-        fargs['smoothing'] = int(form['smoothing'].value)
+        fargs['smoothing'] = [ int(v) for v in form.getlist('smoothing') ]
     else:
-        fargs['smoothing'] = 1
+        fargs['smoothing'] = [ 1 ]
 
     # The conditions to assume for weather dependence
     # [ "JAN", "FEB", "MAR", "APR", "MAY", "JUN",
@@ -251,6 +260,9 @@ if __name__ == "__main__":
 
     fargs['human_readable'] = False
 
+    # The shared data bundle the server has loaded the tables into, if any.
+    fargs['data_bundle'] = os.environ.get('ATSENSCALC_DATA_BUNDLE')
+
     # The location to write the plots.
     fargs['plot_location'] = "/var/www/vhosts/www.narrabri.atnf.csiro.au/writeable/cgi-bin/obstools"
     
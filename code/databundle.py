@@ -0,0 +1,190 @@
+######################################################################
+# The ATCA Sensitivity Calculator
+# Shared data bundle.
+# Copyright 2015 Jamie Stevens, CSIRO
+#
+# This file is part of the ATCA Sensitivity Calculator.
+#
+# The ATCA Sensitivity Calculator is free software: you can
+# redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# The ATCA Sensitivity Calculator is distributed in the hope
+# that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with the ATCA Sensitivity Calculator.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# A server running many calculations can load all the tables the
+# calculator needs once, into a single block of shared memory, and have
+# every worker process attach to that block instead of each reading and
+# keeping its own copy. The bundle holds the compiled Tsys table and
+# pyramid for each band (see tsysstore) and the efficiency curve, which the
+# workers use in place without copying, along with the weather, weighting
+# factor and station tables.
+#
+# The block starts with a header: a magic string, the bundle version and
+# the length of a JSON manifest that follows it. The manifest describes
+# where each array is in the block, and holds the tables that aren't
+# arrays. The arrays follow the manifest, each starting on a 64 byte
+# boundary.
+#
+# A bundle for a server is made (and kept until interrupted) by running
+# this file:
+#   python databundle.py [name]
+# which prints the name of the block for the calculator to use.
+
+import sys
+import json
+import signal
+import struct
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+import tsysstore as tsysstore
+
+# Change this whenever the layout of the bundle changes.
+bundleVersion = 1
+# The start of every bundle.
+bundleMagic = b"ATSENSDB"
+# The magic string, bundle version and length of the manifest.
+headerFormat = "<8sQQ"
+# The alignment (bytes) of each array in the bundle.
+arrayAlignment = 64
+
+# The bundles this process has made or attached to, by name.
+attachedBundles = {}
+
+def alignOffset(offset):
+    return ((offset + arrayAlignment - 1) // arrayAlignment) * arrayAlignment
+
+def createBundle(contents, name=None):
+    # Make a bundle in a new block of shared memory from contents, which has the
+    # names of the Tsys files to include ('tsys'), any other arrays by name
+    # ('arrays'), and the tables that aren't arrays ('data'). The block is named
+    # name, or is given a name if that is None. Whoever made the bundle should
+    # remove it with closeBundle when it is no longer needed.
+    arrays = {}
+    tsys = {}
+    for filename in contents['tsys']:
+        store = tsysstore.getStore(filename)
+        key = "tsys:%s" % filename
+        arrays[key] = store['table']
+        levels = []
+        for k in range(0, len(store['pyramid'])):
+            levels.append("%s:%d" % (key, (k + 1)))
+            arrays[levels[-1]] = store['pyramid'][k]
+        tsys[filename] = { 'stamp': store['stamp'], 'table': key, 'pyramid': levels }
+    for key in contents['arrays']:
+        arrays[key] = np.ascontiguousarray(contents['arrays'][key])
+
+    # Lay out the arrays, relative to the end of the manifest.
+    layout = {}
+    offset = 0
+    for key in arrays:
+        offset = alignOffset(offset)
+        layout[key] = { 'offset': offset, 'dtype': arrays[key].dtype.str,
+                        'shape': list(arrays[key].shape) }
+        offset += arrays[key].nbytes
+    manifest = json.dumps({ 'tsysVersion': tsysstore.storeVersion, 'arrays': layout,
+                            'tsys': tsys, 'data': contents['data'] }).encode()
+    headerSize = struct.calcsize(headerFormat)
+    dataStart = alignOffset(headerSize + len(manifest))
+
+    memory = shared_memory.SharedMemory(name=name, create=True, size=(dataStart + offset))
+    struct.pack_into(headerFormat, memory.buf, 0, bundleMagic, bundleVersion, len(manifest))
+    memory.buf[headerSize:(headerSize + len(manifest))] = manifest
+    for key in arrays:
+        a = np.ndarray(arrays[key].shape, dtype=arrays[key].dtype, buffer=memory.buf,
+                       offset=(dataStart + layout[key]['offset']))
+        a[...] = arrays[key]
+    bundle = readBundle(memory)
+    bundle['owner'] = True
+    installBundle(bundle)
+    return bundle
+
+def readBundle(memory):
+    # Read the manifest of the bundle in a block of shared memory, and make a
+    # read-only array for each of the arrays in it.
+    headerSize = struct.calcsize(headerFormat)
+    magic, version, manifestLength = struct.unpack_from(headerFormat, memory.buf, 0)
+    if (magic != bundleMagic):
+        raise ValueError("%s is not a data bundle" % memory.name)
+    if (version != bundleVersion):
+        raise ValueError("data bundle %s has version %d, not %d" % (memory.name, version, bundleVersion))
+    manifest = json.loads(bytes(memory.buf[headerSize:(headerSize + manifestLength)]).decode())
+    if (manifest['tsysVersion'] != tsysstore.storeVersion):
+        raise ValueError("data bundle %s has Tsys tables of the wrong version" % memory.name)
+    dataStart = alignOffset(headerSize + manifestLength)
+    arrays = {}
+    for key in manifest['arrays']:
+        layout = manifest['arrays'][key]
+        a = np.ndarray(tuple(layout['shape']), dtype=np.dtype(layout['dtype']), buffer=memory.buf,
+                       offset=(dataStart + layout['offset']))
+        a.setflags(write=False)
+        arrays[key] = a
+    return { 'name': memory.name, 'memory': memory, 'owner': False, 'arrays': arrays,
+             'tsys': manifest['tsys'], 'data': manifest['data'] }
+
+def installBundle(bundle):
+    # Have tsysstore use the Tsys tables in the bundle. They are still only used
+    # while the Tsys files haven't changed since the bundle was made.
+    for filename in bundle['tsys']:
+        t = bundle['tsys'][filename]
+        tsysstore.loadedStores[filename] = { 'stamp': t['stamp'], 'table': bundle['arrays'][t['table']],
+                                             'pyramid': [ bundle['arrays'][k] for k in t['pyramid'] ] }
+    attachedBundles[bundle['name']] = bundle
+
+def attachBundle(name):
+    # Return the bundle in the block of shared memory called name, attaching to it
+    # if this process hasn't already. A process forked from one that has the bundle
+    # already has it.
+    if (name in attachedBundles):
+        return attachedBundles[name]
+    try:
+        memory = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Older versions of Python always track the block, and would remove it when
+        # this process exits.
+        memory = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+    bundle = readBundle(memory)
+    installBundle(bundle)
+    return bundle
+
+def closeBundle(bundle):
+    # Stop using a bundle, and remove it if this process made it.
+    for filename in bundle['tsys']:
+        if (filename in tsysstore.loadedStores and
+            tsysstore.loadedStores[filename]['table'] is bundle['arrays'][bundle['tsys'][filename]['table']]):
+            del tsysstore.loadedStores[filename]
+    attachedBundles.pop(bundle['name'], None)
+    if (bundle['owner']):
+        bundle['memory'].unlink()
+    bundle['arrays'] = {}
+    try:
+        bundle['memory'].close()
+    except BufferError:
+        # Something still has one of the arrays, so the memory stays mapped until
+        # this process exits.
+        pass
+
+if __name__ == "__main__":
+    # Make a bundle of the tables of the calculator, and keep it until we are stopped.
+    import atsenscalc_bigcat_routines as sens
+    name = sys.argv[1] if (len(sys.argv) > 1) else None
+    bundle = createBundle(sens.bundleContents(), name)
+    print("%s: %d bytes" % (bundle['name'], bundle['memory'].size))
+    sys.stdout.flush()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        signal.pause()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        closeBundle(bundle)
@@ -24,6 +24,199 @@
 import math
 import numpy as np
 
+# The number of frequencies refractArray evaluates in each block.
+refractChunk = 256
+# The largest number of (elevation, frequency, layer) elements handled at once
+# when refractArray is given many elevations.
+refractElevationBlock = 1 << 20
+
+# Table of microwave oxygen lines and their parameters (Liebe 1985), used by
+# the dry refractivity routines.
+dryNu0 = np.array([ 49.452379, 49.962257, 50.474238, 50.987748, 51.503350, 52.021409,
+                    52.542393, 53.066906, 53.595748, 54.129999, 54.671157, 55.221365,
+                    55.783800, 56.264777, 56.363387, 56.968180, 57.612481, 58.323874,
+                    58.446589, 59.164204, 59.590982, 60.306057, 60.434775, 61.150558,
+                    61.800152, 62.411212, 62.486253, 62.997974, 63.568515, 64.127764,
+                    64.678900, 65.224067, 65.764769, 66.302088, 66.836827, 67.369595,
+                    67.900862, 68.431001, 68.960306, 69.489021, 70.017342, 18.750341,
+                    68.498350, 24.763120, 87.249370, 15.393150, 73.838730, 34.145330 ])
+dryA1 = np.array([    0.12E-6,    0.34E-6,    0.94E-6,    2.46E-6,    6.08E-6,   14.14E-6,
+                      31.02E-6,   64.10E-6,  124.70E-6,  228.00E-6,  391.80E-6,  631.60E-6,
+                      953.50E-6,  548.90E-6, 1344.00E-6, 1763.00E-6, 2141.00E-6, 2386.00E-6,
+                      1457.00E-6, 2404.00E-6, 2112.00E-6, 2124.00E-6, 2461.00E-6, 2504.00E-6,
+                      2298.00E-6, 1933.00E-6, 1517.00E-6, 1503.00E-6, 1087.00E-6,  733.50E-6,
+                      463.50E-6,  274.80E-6,  153.00E-6,   80.09E-6,   39.46E-6,   18.32E-6,
+                      8.01E-6,    3.30E-6,    1.28E-6,    0.47E-6,    0.16E-6,  945.00E-6,
+                      67.90E-6,  638.00E-6,  235.00E-6,   99.60E-6,  671.00E-6,  180.00E-6 ])
+dryA2 = np.array([  11.830, 10.720,  9.690,  8.690,  7.740,  6.840,
+                    6.000,  5.220,  4.480,  3.810,  3.190,  2.620,
+                    2.115,  0.010,  1.655,  1.255,  0.910,  0.621,
+                    0.079,  0.386,  0.207,  0.207,  0.386,  0.621,
+                    0.910,  1.255,  0.078,  1.660,  2.110,  2.620,
+                    3.190,  3.810,  4.480,  5.220,  6.000,  6.840,
+                    7.740,  8.690,  9.690, 10.720, 11.830,  0.000,
+                    0.020,  0.011,  0.011,  0.089,  0.079,  0.079 ])
+dryA3 = np.array([   8.40E-3,  8.50E-3,  8.60E-3,  8.70E-3,  8.90E-3,  9.20E-3,
+                     9.40E-3,  9.70E-3, 10.00E-3, 10.20E-3, 10.50E-3, 10.79E-3,
+                     11.10E-3, 16.46E-3, 11.44E-3, 11.81E-3, 12.21E-3, 12.66E-3,
+                     14.49E-3, 13.19E-3, 13.60E-3, 13.82E-3, 12.97E-3, 12.48E-3,
+                     12.07E-3, 11.71E-3, 14.68E-3, 11.39E-3, 11.08E-3, 10.78E-3,
+                     10.50E-3, 10.20E-3, 10.00E-3,  9.70E-3,  9.40E-3,  9.20E-3,
+                     8.90E-3,  8.70E-3,  8.60E-3,  8.50E-3,  8.40E-3, 15.92E-3,
+                     19.20E-3, 19.16E-3, 19.20E-3, 18.10E-3, 18.10E-3, 18.10E-3 ])
+dryA4 = np.array([  0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                    0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                    0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                    0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                    0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                    0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                    0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                    0.6, 0.6, 0.6, 0.6, 0.6, 0.6 ])
+dryA5 = np.array([  5.60E-3,  5.60E-3,  5.60E-3,  5.50E-3,  5.60E-3,  5.50E-3,
+                    5.70E-3,  5.30E-3,  5.40E-3,  4.80E-3,  4.80E-3,  4.17E-3,
+                    3.75E-3,  7.74E-3,  2.97E-3,  2.12E-3,  0.94E-3, -0.55E-3,
+                    5.97E-3, -2.44E-3,  3.44E-3, -4.13E-3,  1.32E-3, -0.36E-3,
+                    -1.59E-3, -2.66E-3, -4.77E-3, -3.34E-3, -4.17E-3, -4.48E-3,
+                    -5.10E-3, -5.10E-3, -5.70E-3, -5.50E-3, -5.90E-3, -5.60E-3,
+                    -5.80E-3, -5.70E-3, -5.60E-3, -5.60E-3, -5.60E-3, -0.44E-3,
+                    0.00E00,  0.00E00,  0.00E00,  0.00E00,  0.00E00,  0.00E00 ])
+dryA6 = np.array([  1.7,  1.7,  1.7,  1.7,  1.8,  1.8,
+                    1.8,  1.9,  1.8,  2.0,  1.9,  2.1,
+                    2.1,  0.9,  2.3,  2.5,  3.7, -3.1,
+                    0.8,  0.1,  0.5,  0.7, -1.0,  5.8,
+                    2.9,  2.3,  0.9,  2.2,  2.0,  2.0,
+                    1.8,  1.9,  1.8,  1.8,  1.7,  1.8,
+                    1.7,  1.7,  1.7,  1.7,  1.7,  0.9,
+                    1.0,  1.0,  1.0,  1.0,  1.0,  1.0 ])
+
+# Table of the microwave water lines, used by the water vapour refractivity
+# routines.
+vapNu0 = np.array([  22.235080,  67.813960, 119.995940, 183.310117, 321.225644, 325.152919,
+                     336.187000, 380.197372, 390.134508, 437.346667, 439.150812, 443.018295,
+                     448.001075, 470.888947, 474.689127, 488.491133, 503.568532, 504.482692,
+                     556.936002, 620.700807, 658.006500, 752.033227, 841.073593, 859.865000,
+                     899.407000, 902.555000, 906.205524, 916.171582, 970.315022, 987.926764 ])
+vapB1 = np.array([   0.1090,  0.0011,  0.0007,   2.3000,  0.0464,  1.5400,
+                     0.0010, 11.9000,  0.0044,   0.0637,  0.9210,  0.1940,
+                     10.6000,  0.3300,  1.2800,   0.2530,  0.0374,  0.0125,
+                     510.0000,  5.0900,  0.2740, 250.0000,  0.0130,  0.1330,
+                     0.0550,  0.0380,  0.1830,   8.5600,  9.1600, 138.000 ])
+vapB2 = np.array([ 2.143, 8.730, 8.347, 0.653, 6.156, 1.515,
+                   9.802, 1.018, 7.318, 5.015, 3.561, 5.015,
+                   1.370, 3.561, 2.342, 2.814, 6.693, 6.693,
+                   0.114, 2.150, 7.767, 0.336, 8.113, 7.989,
+                   7.845, 8.360, 5.039, 1.369, 1.842, 0.178 ])
+vapB3 = np.array([ 27.84E-3, 27.60E-3, 27.00E-3, 28.35E-3, 21.40E-3, 27.00E-3,
+                   26.50E-3, 27.60E-3, 19.00E-3, 13.70E-3, 16.40E-3, 14.40E-3,
+                   23.80E-3, 18.20E-3, 19.80E-3, 24.90E-3, 11.50E-3, 11.90E-3,
+                   30.00E-3, 22.30E-3, 30.00E-3, 28.60E-3, 14.10E-3, 28.60E-3,
+                   28.60E-3, 26.40E-3, 23.40E-3, 25.30E-3, 24.00E-3, 28.60E-3 ])
+
+# Quantities derived from the line tables that the refractivity calculations
+# would otherwise recompute for every layer and frequency.
+dryInvNu0 = 1.0 / dryNu0
+dryThetaPower = 0.8 - dryA4
+vapInvNu0 = 1.0 / vapNu0
+
+class LayerState:
+    # The parts of Liebe's model of the refractivity of air that depend only
+    # on the state of each atmospheric layer, and not on frequency. These are
+    # the line strengths, widths and mixing terms of all the oxygen and water
+    # lines, and the temperature and pressure factors of the continuum terms.
+    # They are computed once for a (T, Pdry, Pvap) profile, and then the
+    # refdry and refvap methods evaluate the line shapes at any frequencies.
+    #
+    # Input:
+    #  T = temperatures of the layers (K), scalar or array of length L
+    #  Pdry = partial pressures of dry components of the layers (Pa)
+    #  Pvap = partial pressures of water vapour of the layers (Pa)
+    def __init__(self, T, Pdry, Pvap):
+        # Convert to the units of Liebe. Layer quantities are column vectors
+        # so they broadcast against the line tables.
+        theta = 300.0 / np.atleast_1d(np.asarray(T, dtype=float))
+        e = 0.001 * np.atleast_1d(np.asarray(Pvap, dtype=float))
+        p = 0.001 * np.atleast_1d(np.asarray(Pdry, dtype=float))
+        self.nLayers = len(theta)
+
+        # The dry continuum terms.
+        self.dryInvGamma0 = 1.0 / (5.6e-3 * (p + 1.1 * e) * theta ** 0.8)
+        self.dryNr0 = 2.588 * p * theta
+        self.dryPTheta2 = p * theta * theta
+        self.dryPTheta25 = p * theta ** 2.5
+
+        # The oxygen line parameters, with shape (L, lines).
+        pc = p[:, np.newaxis]
+        ec = e[:, np.newaxis]
+        tc = theta[:, np.newaxis]
+        S = dryA1 * pc * tc ** 3 * np.exp(dryA2 * (1.0 - tc))
+        gamma = dryA3 * (pc * np.power(tc, dryThetaPower)) + 1.1 * ec * tc
+        delta = dryA5 * pc * np.power(tc, dryA6)
+        self.dryS = S
+        self.dryGamma2 = gamma * gamma
+        self.dryZ = dryNu0 + self.dryGamma2 * dryInvNu0
+        self.drySGamma = S * gamma * dryInvNu0
+        self.drySDelta = S * delta * dryInvNu0
+        self.drySDeltaGamma = self.drySDelta * gamma
+        self.dryNrLines = -2.0 * np.sum(S * dryInvNu0, axis=1)
+
+        # The water vapour continuum terms.
+        self.vapNr0 = 2.39 * e * theta + 41.6 * e * theta * theta
+        self.vapNrF = 6.47e-6 * e * theta ** 2.4
+        self.vapNi = (0.915 * 1.40e-6 * p + 5.41e-5 * e * theta * theta * theta) * e * theta ** 2.5
+
+        # The water line parameters, with shape (L, lines).
+        S = vapB1 * ec * tc ** 3.5 * np.exp(vapB2 * (1.0 - tc))
+        gamma = vapB3 * (pc * tc ** 0.8 + 4.80 * ec * tc)
+        self.vapS = S
+        self.vapGamma2 = gamma * gamma
+        self.vapZ = vapNu0 + self.vapGamma2 * vapInvNu0
+        self.vapSGamma = S * gamma * vapInvNu0
+        self.vapNrLines = -2.0 * np.sum(S * vapInvNu0, axis=1)
+
+    def refdry(self, nu):
+        # Determine the complex refractivity of the dry components of the
+        # atmosphere at each of the frequencies nu (Hz), for every layer.
+        # Returns a complex array with shape (F, L).
+        f = np.atleast_1d(np.asarray(nu, dtype=float))[:, np.newaxis] * 1e-9
+
+        ap = 1.4e-10 * (1.0 - 1.2e-5 * f ** 1.5)
+        fg2 = 1.0 + (f * self.dryInvGamma0) ** 2
+        nr = self.dryNr0 + 3.07e-4 * (1.0 / fg2 - 1.0) * self.dryPTheta2
+        ni = (2.0 * 3.07e-4 * self.dryInvGamma0 / (fg2 * (1.0 + (f / 60.0) ** 2)) +
+              ap * self.dryPTheta25) * f * self.dryPTheta2
+
+        # Sum the contributions of the lines, which are along the third axis.
+        fl = f[:, :, np.newaxis]
+        ix = 1.0 / ((dryNu0 - fl) * (dryNu0 - fl) + self.dryGamma2)
+        iy = 1.0 / ((dryNu0 + fl) * (dryNu0 + fl) + self.dryGamma2)
+        nr = (nr + self.dryNrLines +
+              np.sum(self.dryS * ((self.dryZ - fl) * ix + (self.dryZ + fl) * iy), axis=2) +
+              f * np.sum(self.drySDeltaGamma * (ix - iy), axis=2))
+        ni = ni + f * (np.sum(self.drySGamma * (ix + iy), axis=2) -
+                       np.sum(self.drySDelta * ((dryNu0 - fl) * ix + (dryNu0 + fl) * iy), axis=2))
+
+        # Return the result.
+        return nr + 1j * ni
+
+    def refvap(self, nu):
+        # Determine the complex refractivity of the water vapour monomers at
+        # each of the frequencies nu (Hz), for every layer. Returns a complex
+        # array with shape (F, L).
+        f = np.atleast_1d(np.asarray(nu, dtype=float))[:, np.newaxis] * 1e-9
+
+        nr = self.vapNr0 + self.vapNrF * f ** 2.05
+        ni = self.vapNi * f
+
+        # Sum the contributions of the lines, which are along the third axis.
+        fl = f[:, :, np.newaxis]
+        ix = 1.0 / ((vapNu0 - fl) * (vapNu0 - fl) + self.vapGamma2)
+        iy = 1.0 / ((vapNu0 + fl) * (vapNu0 + fl) + self.vapGamma2)
+        nr = nr + self.vapNrLines + np.sum(self.vapS * ((self.vapZ - fl) * ix + (self.vapZ + fl) * iy), axis=2)
+        ni = ni + f * np.sum(self.vapSGamma * (ix + iy), axis=2)
+
+        # Return the result.
+        return nr + 1j * ni
+
 def refdry(nu, T, Pdry, Pvap):
     # From Miriad: Determine the complex refractivity of the dry components
     # of the atmosphere.
@@ -33,100 +226,7 @@ def refdry(nu, T, Pdry, Pvap):
     #  T = temperature (K)
     #  Pdry = partial pressure of dry components (Pa)
     #  Pvap = partial pressure of water vapour (Pa)
-
-    # Table of microwave oxygen lines and their parameters.
-    nu0 = np.array([ 49.452379, 49.962257, 50.474238, 50.987748, 51.503350, 52.021409,
-                     52.542393, 53.066906, 53.595748, 54.129999, 54.671157, 55.221365,
-                     55.783800, 56.264777, 56.363387, 56.968180, 57.612481, 58.323874,
-                     58.446589, 59.164204, 59.590982, 60.306057, 60.434775, 61.150558,
-                     61.800152, 62.411212, 62.486253, 62.997974, 63.568515, 64.127764,
-                     64.678900, 65.224067, 65.764769, 66.302088, 66.836827, 67.369595,
-                     67.900862, 68.431001, 68.960306, 69.489021, 70.017342, 18.750341,
-                     68.498350, 24.763120, 87.249370, 15.393150, 73.838730, 34.145330 ])
-    a1 = np.array([    0.12E-6,    0.34E-6,    0.94E-6,    2.46E-6,    6.08E-6,   14.14E-6,
-                       31.02E-6,   64.10E-6,  124.70E-6,  228.00E-6,  391.80E-6,  631.60E-6,
-                       953.50E-6,  548.90E-6, 1344.00E-6, 1763.00E-6, 2141.00E-6, 2386.00E-6,
-                       1457.00E-6, 2404.00E-6, 2112.00E-6, 2124.00E-6, 2461.00E-6, 2504.00E-6,
-                       2298.00E-6, 1933.00E-6, 1517.00E-6, 1503.00E-6, 1087.00E-6,  733.50E-6,
-                       463.50E-6,  274.80E-6,  153.00E-6,   80.09E-6,   39.46E-6,   18.32E-6,
-                       8.01E-6,    3.30E-6,    1.28E-6,    0.47E-6,    0.16E-6,  945.00E-6,
-                       67.90E-6,  638.00E-6,  235.00E-6,   99.60E-6,  671.00E-6,  180.00E-6 ])
-    a2 = np.array([  11.830, 10.720,  9.690,  8.690,  7.740,  6.840,
-                     6.000,  5.220,  4.480,  3.810,  3.190,  2.620,
-                     2.115,  0.010,  1.655,  1.255,  0.910,  0.621,
-                     0.079,  0.386,  0.207,  0.207,  0.386,  0.621,
-                     0.910,  1.255,  0.078,  1.660,  2.110,  2.620,
-                     3.190,  3.810,  4.480,  5.220,  6.000,  6.840,
-                     7.740,  8.690,  9.690, 10.720, 11.830,  0.000,
-                     0.020,  0.011,  0.011,  0.089,  0.079,  0.079 ])
-    a3 = np.array([   8.40E-3,  8.50E-3,  8.60E-3,  8.70E-3,  8.90E-3,  9.20E-3,
-                      9.40E-3,  9.70E-3, 10.00E-3, 10.20E-3, 10.50E-3, 10.79E-3,
-                      11.10E-3, 16.46E-3, 11.44E-3, 11.81E-3, 12.21E-3, 12.66E-3,
-                      14.49E-3, 13.19E-3, 13.60E-3, 13.82E-3, 12.97E-3, 12.48E-3,
-                      12.07E-3, 11.71E-3, 14.68E-3, 11.39E-3, 11.08E-3, 10.78E-3,
-                      10.50E-3, 10.20E-3, 10.00E-3,  9.70E-3,  9.40E-3,  9.20E-3,
-                      8.90E-3,  8.70E-3,  8.60E-3,  8.50E-3,  8.40E-3, 15.92E-3,
-                      19.20E-3, 19.16E-3, 19.20E-3, 18.10E-3, 18.10E-3, 18.10E-3 ])
-    a4 = np.array([  0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-                     0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-                     0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-                     0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-                     0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-                     0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-                     0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-                     0.6, 0.6, 0.6, 0.6, 0.6, 0.6 ])
-    a5 = np.array([  5.60E-3,  5.60E-3,  5.60E-3,  5.50E-3,  5.60E-3,  5.50E-3,
-                     5.70E-3,  5.30E-3,  5.40E-3,  4.80E-3,  4.80E-3,  4.17E-3,
-                     3.75E-3,  7.74E-3,  2.97E-3,  2.12E-3,  0.94E-3, -0.55E-3,
-                     5.97E-3, -2.44E-3,  3.44E-3, -4.13E-3,  1.32E-3, -0.36E-3,
-                     -1.59E-3, -2.66E-3, -4.77E-3, -3.34E-3, -4.17E-3, -4.48E-3,
-                     -5.10E-3, -5.10E-3, -5.70E-3, -5.50E-3, -5.90E-3, -5.60E-3,
-                     -5.80E-3, -5.70E-3, -5.60E-3, -5.60E-3, -5.60E-3, -0.44E-3,
-                     0.00E00,  0.00E00,  0.00E00,  0.00E00,  0.00E00,  0.00E00 ])
-    a6 = np.array([  1.7,  1.7,  1.7,  1.7,  1.8,  1.8,
-                     1.8,  1.9,  1.8,  2.0,  1.9,  2.1,
-                     2.1,  0.9,  2.3,  2.5,  3.7, -3.1,
-                     0.8,  0.1,  0.5,  0.7, -1.0,  5.8,
-                     2.9,  2.3,  0.9,  2.2,  2.0,  2.0,
-                     1.8,  1.9,  1.8,  1.8,  1.7,  1.8,
-                     1.7,  1.7,  1.7,  1.7,  1.7,  0.9,
-                     1.0,  1.0,  1.0,  1.0,  1.0,  1.0 ])
-
-    # Convert to the units of Liebe.
-    theta = 300.0 / T
-    e = 0.001 * Pvap
-    p = 0.001 * Pdry
-    f = nu * 1e-9
-
-    ap = 1.4e-10 * (1.0 - 1.2e-5 * f ** 1.5)
-    gamma0 = 5.6e-3 * (p + 1.1 * e) * theta ** 0.8
-    nr = 2.588 * p * theta + 3.07e-4 * (1.0 / (1.0 + (f / gamma0) ** 2) - 1.0) * p * theta * theta
-    ni = (2.0 * 3.07e-4 / (gamma0 * (1.0 + (f / gamma0) ** 2) * (1.0 + (f / 60.0) ** 2)) +
-          ap * p * theta ** 2.5) * f * p * theta * theta
-
-    # Sum the contributions of the lines.
-    S = a1 * p * theta ** 3 * np.exp(a2 * (1.0 - theta))
-    gamma = a3 * (p * np.power(theta, (0.8 - a4))) + 1.1 * e * theta
-    delta = a5 * p * np.power(theta, a6)
-    x = (nu0 - f) * (nu0 - f) + gamma * gamma
-    y = (nu0 + f) * (nu0 + f) + gamma * gamma
-    z = (nu0 + gamma * gamma / nu0)
-    nr = nr + np.sum(S * ((z - f) / x + (z + f) / y - 2 / nu0 + delta * (1.0 / x - 1.0 / y) * gamma * f / nu0))
-    ni = ni + np.sum(S * ((1.0 / x + 1.0 / y) * gamma * f / nu0 - delta * ((nu0 - f) / x + (nu0 + f) / y) * f / nu0))
-#    for i in xrange(0, len(nu0)):
-#        S = a1[i] * p * theta ** 3 * math.exp(a2[i] * (1.0 - theta))
-#        gamma = a3[i] * (p * theta ** (0.8 - a4[i])) + 1.1 * e * theta
-#        delta = a5[i] * p * theta ** a6[i]
-#        x = (nu0[i] - f) * (nu0[i] - f) + gamma * gamma
-#        y = (nu0[i] + f) * (nu0[i] + f) + gamma * gamma
-#        z = (nu0[i] + gamma * gamma / nu0[i])
-#        nr = nr + S * ((z - f) / x + (z + f) / y - 2 / nu0[i] + delta *
-#                       (1.0 / x - 1.0 / y) * gamma * f / nu0[i])
-#        ni = ni + S * ((1.0 / x + 1.0 / y) * gamma * f / nu0[i] - delta *
-#                       ((nu0[i] - f) / x + (nu0[i] + f) / y) * f / nu0[i])
-
-    # Return the result.
-    return complex(nr, ni)
+    return complex(LayerState(T, Pdry, Pvap).refdry(nu)[0, 0])
 
 def refvap(nu, T, Pdry, Pvap):
     # From Miriad; Determine the complex refractivity of the water vapour monomers.
@@ -136,58 +236,8 @@ def refvap(nu, T, Pdry, Pvap):
     #  T = temperature (K)
     #  Pdry = partial pressure of dry components (Pa)
     #  Pvap = partial pressure of water vapour (Pa)
+    return complex(LayerState(T, Pdry, Pvap).refvap(nu)[0, 0])
 
-    # Table of the microwave water lines.
-    mnu0 = np.array([  22.235080,  67.813960, 119.995940, 183.310117, 321.225644, 325.152919,
-                       336.187000, 380.197372, 390.134508, 437.346667, 439.150812, 443.018295,
-                       448.001075, 470.888947, 474.689127, 488.491133, 503.568532, 504.482692,
-                       556.936002, 620.700807, 658.006500, 752.033227, 841.073593, 859.865000,
-                       899.407000, 902.555000, 906.205524, 916.171582, 970.315022, 987.926764 ])
-    b1 = np.array([   0.1090,  0.0011,  0.0007,   2.3000,  0.0464,  1.5400,
-                      0.0010, 11.9000,  0.0044,   0.0637,  0.9210,  0.1940,
-                      10.6000,  0.3300,  1.2800,   0.2530,  0.0374,  0.0125,
-                      510.0000,  5.0900,  0.2740, 250.0000,  0.0130,  0.1330,
-                      0.0550,  0.0380,  0.1830,   8.5600,  9.1600, 138.000 ])
-    b2 = np.array([ 2.143, 8.730, 8.347, 0.653, 6.156, 1.515,
-                    9.802, 1.018, 7.318, 5.015, 3.561, 5.015,
-                    1.370, 3.561, 2.342, 2.814, 6.693, 6.693,
-                    0.114, 2.150, 7.767, 0.336, 8.113, 7.989,
-                    7.845, 8.360, 5.039, 1.369, 1.842, 0.178 ])
-    b3 = np.array([ 27.84E-3, 27.60E-3, 27.00E-3, 28.35E-3, 21.40E-3, 27.00E-3,
-                    26.50E-3, 27.60E-3, 19.00E-3, 13.70E-3, 16.40E-3, 14.40E-3,
-                    23.80E-3, 18.20E-3, 19.80E-3, 24.90E-3, 11.50E-3, 11.90E-3,
-                    30.00E-3, 22.30E-3, 30.00E-3, 28.60E-3, 14.10E-3, 28.60E-3,
-                    28.60E-3, 26.40E-3, 23.40E-3, 25.30E-3, 24.00E-3, 28.60E-3 ])
-
-    # Convert to the units of Liebe.
-    theta = 300.0 / T
-    e = 0.001 * Pvap
-    p = 0.001 * Pdry
-    f = nu * 1e-9
-
-    nr = 2.39 * e * theta + 41.6 * e * theta * theta + 6.47e-6 * f ** 2.05 * e * theta ** 2.4
-    ni = (0.915 * 1.40e-6 * p + 5.41e-5 * e * theta * theta * theta) * f * e * theta ** 2.5
-
-    # Sum the contributions of the lines.
-    S = b1 * e * theta ** 3.5 * np.exp(b2 * (1.0 - theta))
-    gamma = b3 * (p * theta ** 0.8 + 4.80 * e * theta)
-    x = (mnu0 - f) * (mnu0 - f) + gamma * gamma
-    y = (mnu0 + f) * (mnu0 + f) + gamma * gamma
-    z = (mnu0 + gamma * gamma / mnu0)
-    nr = nr + np.sum(S * ((z - f) / x + (z + f) / y - 2 / mnu0))
-    ni = ni + np.sum(S * ((1.0 / x + 1.0 / y) * gamma * f / mnu0))
-#    for i in xrange(0, len(mnu0)):
-#        S = b1[i] * e * theta ** 3.5 * math.exp(b2[i] * (1.0 - theta))
-#        gamma = b3[i] * (p * theta ** 0.8 + 4.80 * e * theta)
-#        x = (mnu0[i] - f) * (mnu0[i] - f) + gamma * gamma
-#        y = (mnu0[i] + f) * (mnu0[i] + f) + gamma * gamma
-#        z = (mnu0[i] + gamma * gamma / mnu0[i])
-#        nr = nr + S * ((z - f) / x + (z + f) / y - 2 / mnu0[i])
-#        ni = ni + S * ((1.0 / x + 1.0 / y) * gamma * f / mnu0[i])
-
-    # Return the result.
-    return complex(nr, ni)
-    
 def pvapsat(T):
     # From Miriad; Determine the saturation pressure of water vapour.
     # Input:
@@ -235,6 +285,12 @@ def refract(t, pdry, pvap, z, n, nu, T0, el):
     Ldry = 0.0
     Lvap = 0.0
 
+    # The line strengths and widths of every layer, which don't depend on
+    # the frequency.
+    layers = LayerState(t[1:(n + 1)], pdry[1:(n + 1)], pvap[1:(n + 1)])
+    Ndrys = layers.refdry(nu)[0]
+    Nvaps = layers.refvap(nu)[0]
+
     snell = math.sin(el)
     for i in range(n, 0, -1):
         if (i == 1):
@@ -243,8 +299,8 @@ def refract(t, pdry, pvap, z, n, nu, T0, el):
             dz = 0.5 * (z[n] - z[n - 1])
         else:
             dz = 0.5 * (z[i + 1] - z[i - 1])
-        Ndry = refdry(nu, t[i], pdry[i], pvap[i])
-        Nvap = refvap(nu, t[i], pdry[i], pvap[i])
+        Ndry = Ndrys[i - 1]
+        Nvap = Nvaps[i - 1]
         nr = 1 + (Ndry.real + Nvap.real) * 1e-6
         ni = (Ndry.imag + Nvap.imag) * 1e-6
         l = dz * nr / math.sqrt(nr * nr + (snell * snell) - 1.0)
@@ -256,16 +312,125 @@ def refract(t, pdry, pvap, z, n, nu, T0, el):
 
     return { 'Tb': Tb, 'tau': tau, 'Ldry': Ldry, 'Lvap': Lvap }
 
-def calcOpacity(freq, el, t0, p0, h0):
+def refractArray(t, pdry, pvap, z, n, nu, T0, el, layers=None):
+    # Compute the sky brightness and excess path lengths for a parallel slab
+    # atmosphere, for a whole array of frequencies at once. This gives the same
+    # numbers as calling refract for each frequency, but the refractivity of
+    # every (frequency, layer) pair is evaluated in one array operation. Only
+    # the radiative transfer through the layers is done as a loop, since each
+    # layer depends on the one above it, but each step in that loop handles
+    # all the frequencies.
+    #
+    # Input:
+    #  t, pdry, pvap, z, n, T0, el = as for refract
+    #  nu = frequencies of interest (Hz), array of length F
+    #  el = elevation angle (rad), or an array of elevation angles
+    #  layers = a LayerState for layers 1 to n of the profile, if one has
+    #           already been made for it
+    #
+    # Output:
+    #  { 'Tb' = brightness temperature (K), array of length F,
+    #    'tau' = opacity (nepers), array of length F,
+    #    'Ldry' = excess path, dry component (m), array of length F,
+    #    'Lvap' = excess path, water vapour component (m), array of length F }
+    #  or, if el is an array, arrays with the shape of el followed by F.
+
+    # Some constants.
+    HMKS = 6.6260755e-34 # Planck constant, J.s
+    KMKS = 1.380658e-23 # Boltzmann constant, J/K
+
+    nu = np.asarray(nu, dtype=float)
+    t = np.asarray(t, dtype=float)
+    z = np.asarray(z, dtype=float)
+
+    # The layer thicknesses, for layers 1 to n.
+    dz = np.empty(n)
+    dz[0] = 0.5 * (z[1] - z[0])
+    dz[1:(n - 1)] = 0.5 * (z[3:(n + 1)] - z[1:(n - 1)])
+    dz[n - 1] = 0.5 * (z[n] - z[n - 1])
+
+    # The refractivities of each layer at each frequency, done in blocks of
+    # frequencies so the (frequency, layer, line) arrays stay small.
+    if (layers is None):
+        layers = LayerState(t[1:(n + 1)], pdry[1:(n + 1)], pvap[1:(n + 1)])
+    Ndry = np.empty((len(nu), n), dtype=complex)
+    Nvap = np.empty((len(nu), n), dtype=complex)
+    for i in range(0, len(nu), refractChunk):
+        fs = nu[i:(i + refractChunk)]
+        Ndry[i:(i + refractChunk)] = layers.refdry(fs)
+        Nvap[i:(i + refractChunk)] = layers.refvap(fs)
+
+    Tb0 = HMKS * nu / (KMKS * (np.exp(HMKS * nu / (KMKS * T0)) - 1))
+    snell = np.sin(np.asarray(el, dtype=float))
+    if (snell.ndim == 0):
+        return slabTransfer(t, dz, n, nu, Ndry, Nvap, float(snell), Tb0)
+
+    # For many elevations, the refractivities are the same and only the path
+    # through each layer changes, so the elevations become another array axis.
+    # They are done in blocks so the (elevation, frequency, layer) arrays stay
+    # small.
+    shape = snell.shape
+    snell = snell.ravel()
+    nBlock = max(1, refractElevationBlock // (len(nu) * n))
+    res = { 'Tb': [], 'tau': [], 'Ldry': [], 'Lvap': [] }
+    for i in range(0, len(snell), nBlock):
+        r = slabTransfer(t, dz, n, nu, Ndry, Nvap, snell[i:(i + nBlock), np.newaxis, np.newaxis], Tb0)
+        for q in res:
+            res[q].append(r[q])
+    return dict((q, np.concatenate(res[q]).reshape(shape + (len(nu),))) for q in res)
+
+def slabTransfer(t, dz, n, nu, Ndry, Nvap, snell, Tb0):
+    # Do the radiative transfer down through the layers of a slab atmosphere, for
+    # the refractivities Ndry and Nvap of each (frequency, layer), and the sine of
+    # the elevation snell. If snell is an array of shape (E, 1, 1), the outputs
+    # have an extra leading axis for the elevations.
+    CMKS = 299792458 # Speed of light, m/s
+
+    nr = 1 + (Ndry.real + Nvap.real) * 1e-6
+    ni = (Ndry.imag + Nvap.imag) * 1e-6
+    l = dz * nr / np.sqrt(nr * nr + (snell * snell) - 1.0)
+    dtau = l * 4.0 * math.pi * nu[:, np.newaxis] / CMKS * ni
+    edtau = np.exp(-dtau)
+    dLdry = l * Ndry.real * 1e-6
+    dLvap = l * Nvap.real * 1e-6
+
+    tau = np.zeros(dtau.shape[:-1])
+    Tb = Tb0 + tau
+    Ldry = np.zeros(dtau.shape[:-1])
+    Lvap = np.zeros(dtau.shape[:-1])
+    for i in range(n, 0, -1):
+        Tb = (Tb - t[i]) * edtau[..., (i - 1)] + t[i]
+        tau = tau + dtau[..., (i - 1)]
+        Ldry = Ldry + dLdry[..., (i - 1)]
+        Lvap = Lvap + dLvap[..., (i - 1)]
+
+    return { 'Tb': Tb, 'tau': tau, 'Ldry': Ldry, 'Lvap': Lvap }
+
+def layerHeight(i, n, zmax, spacing):
+    # The height (m) of level i of n in a model atmosphere that goes up to zmax
+    # (m). The levels are either evenly spaced (as in Miriad), or "stretched"
+    # so they get closer together towards the ground, where the water vapour
+    # is. The radiative transfer in refract leaves out the ground level, which
+    # makes the error of the evenly spaced atmosphere fall only as 1/n; with
+    # the stretched spacing the lowest layer is so thin that the error falls
+    # as 1/n^2.
+    if (spacing == "stretched"):
+        return zmax * (float(i) / float(n)) ** 2
+    return float(i) * zmax / float(n)
+
+def calcOpacity(freq, el, t0, p0, h0, nLayers=50, spacing="uniform"):
     # From Miriad; Compute sky brightness and opacity of a model atmosphere.
     # Returns the transmissivity of the atmosphere given frequency, elevation
     # angle and meteorological data. This uses a simple model of the atmosphere
     # and Liebe's model (1985) of the complex refractive index of air.
     # Input:
     #  freq = frequency (Hz)
-    #  el = elevation angle (radians)
+    #  el = elevation angle (radians), or an array of them, in which case the
+    #       outputs have the shape of el followed by the frequency axis
     #  t0,p0,h0 = Met data; observatory temperature, pressure and humidity
     #             (K, Pa, fraction)
+    #  nLayers = number of layers in the model atmosphere
+    #  spacing = how the layers are spaced in height (see layerHeight)
     # Output:
     #  { 'fac' = transmissivity (fraction between 0 and 1)
     #    'Tb' = sky brightness temperature (K) }
@@ -287,18 +452,13 @@ def calcOpacity(freq, el, t0, p0, h0):
     # Generate a model of the atmosphere - T is temperature, Pdry is
     # partial pressure of "dry" constituents, Pvap is the partial
     # pressure of the water vapour.
-    N = 50 # Number of iterations through the atmosphere in height
+    N = nLayers # Number of iterations through the atmosphere in height
     z = []
     T = []
     Pvap = []
     Pdry = []
-    fac = []
-    Tb = []
-    tau = []
-    ofreq = []
-    pwv = []
     for i in range(0, (N + 1)):
-        zd = float(i) * zmax / float(N)
+        zd = layerHeight(i, N, zmax, spacing)
         z.append(zd)
         T.append(t0 / (1 + d / t0 * zd))
         P = p0 * math.exp(-1.0 * M * g / (R * t0) * (zd + 0.5 * d * zd * zd / t0))
@@ -306,13 +466,100 @@ def calcOpacity(freq, el, t0, p0, h0):
                         pvapsat(T[i])))
         Pdry.append(P - Pvap[i])
 
-    # Determine the transmissivity and sky brightness.
-    for i in range(0, len(freq)):
-        resref = refract(T, Pdry, Pvap, z, N, freq[i], 2.7, el)
-        fac.append(math.exp(-1.0 * resref['tau']))
-        Tb.append(resref['Tb'])
-        tau.append(resref['tau'])
-        ofreq.append(freq[i])
-        pwv.append((resref['Lvap'] * 1e6) / (103.0 * 461.0 * (16.48 + 3.776e5 / (70.03 + 0.726 * t0))))
+    # Determine the transmissivity and sky brightness, for all the frequencies
+    # at once.
+    ofreq = np.array(freq, dtype=float)
+    resref = refractArray(T, Pdry, Pvap, z, N, ofreq, 2.7, el)
+    fac = np.exp(-1.0 * resref['tau'])
+    pwv = (resref['Lvap'] * 1e6) / (103.0 * 461.0 * (16.48 + 3.776e5 / (70.03 + 0.726 * t0)))
+
+    return { 'fac': fac, 'Tb': resref['Tb'], 'tau': resref['tau'], 'freq': ofreq, 'pwv': pwv }
+
+def calcOpacityAdaptive(freq, el, t0, p0, h0, nLayers=50, tolerance=1e-3, minStep=None,
+                        startStep=1e9, spacing="uniform"):
+    # Compute the same quantities as calcOpacity for the (ascending) frequencies
+    # freq, but only run the model at as many frequencies as are needed to
+    # reproduce the opacity and sky brightness temperature to within a
+    # fractional tolerance by linear interpolation.
+    # The frequency range is first sampled every startStep (Hz) or so. Each
+    # interval between samples is then tested by running the model at its
+    # midpoint: if the curvature of the opacity or brightness temperature makes
+    # the midpoint differ from the straight line between the ends by more than
+    # the tolerance, the interval is halved and both halves are tested again.
+    # Intervals are never split below minStep (Hz), which defaults to the
+    # spacing of freq. So flat parts of the band get few samples, and the
+    # samples concentrate on the water and oxygen lines.
+    # The output is as for calcOpacity, interpolated onto freq, with the
+    # additional key 'samples', the number of frequencies the model was run at.
+    ofreq = np.array(freq, dtype=float)
+    if (len(ofreq) < 3):
+        atmos = calcOpacity(ofreq, el, t0, p0, h0, nLayers, spacing)
+        atmos['samples'] = len(ofreq)
+        return atmos
+    if (minStep is None):
+        minStep = np.min(np.diff(ofreq))
+    nStart = max(int(math.ceil((ofreq[-1] - ofreq[0]) / startStep)), 2)
+    nodeFreq = np.linspace(ofreq[0], ofreq[-1], (nStart + 1))
+    atmos = calcOpacity(nodeFreq, el, t0, p0, h0, nLayers, spacing)
+    nodeTau = atmos['tau']
+    nodeTb = atmos['Tb']
+    pwv = atmos['pwv'][0]
+
+    # The intervals still to be tested, as indices into the nodes.
+    left = np.arange(0, nStart)
+    while (len(left) > 0):
+        right = left + 1
+        # Don't split intervals that are already as fine as we need.
+        wide = np.where((nodeFreq[right] - nodeFreq[left]) >= (2.0 * minStep))
+        left = left[wide]
+        right = right[wide]
+        if (len(left) == 0):
+            break
+        midFreq = 0.5 * (nodeFreq[left] + nodeFreq[right])
+        mid = calcOpacity(midFreq, el, t0, p0, h0, nLayers, spacing)
+        errorTau = np.abs(mid['tau'] - 0.5 * (nodeTau[left] + nodeTau[right])) / mid['tau']
+        errorTb = np.abs(mid['Tb'] - 0.5 * (nodeTb[left] + nodeTb[right])) / mid['Tb']
+        bad = (errorTau > tolerance) | (errorTb > tolerance)
+        # Keep all the midpoints we computed, in frequency order.
+        nodeFreq = np.concatenate((nodeFreq, midFreq))
+        nodeTau = np.concatenate((nodeTau, mid['tau']))
+        nodeTb = np.concatenate((nodeTb, mid['Tb']))
+        order = np.argsort(nodeFreq, kind='mergesort')
+        rank = np.empty(len(order), dtype=int)
+        rank[order] = np.arange(0, len(order))
+        nodeFreq = nodeFreq[order]
+        nodeTau = nodeTau[order]
+        nodeTb = nodeTb[order]
+        # Both halves of each bad interval get tested next time.
+        badMid = rank[(len(order) - len(midFreq)):][bad]
+        left = np.sort(np.concatenate(((badMid - 1), badMid)))
+
+    tau = np.interp(ofreq, nodeFreq, nodeTau)
+    Tb = np.interp(ofreq, nodeFreq, nodeTb)
+    return { 'fac': np.exp(-1.0 * tau), 'Tb': Tb, 'tau': tau, 'freq': ofreq,
+             'pwv': np.full(len(ofreq), pwv), 'samples': len(nodeFreq) }
 
-    return { 'fac': fac, 'Tb': Tb, 'tau': tau, 'freq': ofreq, 'pwv': pwv }
+def convergedLayers(freq, el, t0, p0, h0, tolerance, minLayers=16, maxLayers=1024, nProbes=16):
+    # Return the smallest number of stretched layers (see layerHeight) for which
+    # the opacity and sky brightness temperature at the frequencies freq are
+    # within a fractional tolerance of the values for an infinitely finely
+    # layered atmosphere.
+    # The model is only run at up to nProbes frequencies spread across freq.
+    # With n and 2n layers, the error of the n layer model is 4/3 of the
+    # difference between them, since the error falls as 1/n^2. From that we
+    # can say how many layers reach the tolerance; if that is more than 2n
+    # the estimate is repeated with 2n and 4n layers.
+    ofreq = np.array(freq, dtype=float)
+    probes = ofreq[np.unique(np.linspace(0, (len(ofreq) - 1), nProbes).astype(int))]
+    n = minLayers
+    coarse = calcOpacity(probes, el, t0, p0, h0, n, "stretched")
+    while (n < maxLayers):
+        fine = calcOpacity(probes, el, t0, p0, h0, (2 * n), "stretched")
+        error = (4.0 / 3.0) * max(np.max(np.abs(coarse['tau'] - fine['tau']) / fine['tau']),
+                                  np.max(np.abs(coarse['Tb'] - fine['Tb']) / fine['Tb']))
+        needed = int(math.ceil(n * math.sqrt(error / tolerance)))
+        if (needed <= (2 * n)):
+            return min(max(needed, minLayers), maxLayers)
+        n *= 2
+        coarse = fine
+    return maxLayers
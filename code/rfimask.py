@@ -0,0 +1,110 @@
+######################################################################
+# The ATCA Sensitivity Calculator
+# RFI masks.
+# Copyright 2015 Jamie Stevens, CSIRO
+#
+# This file is part of the ATCA Sensitivity Calculator.
+#
+# The ATCA Sensitivity Calculator is free software: you can
+# redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# The ATCA Sensitivity Calculator is distributed in the hope
+# that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with the ATCA Sensitivity Calculator.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# An RFI mask is a list of frequency ranges affected by RFI. A mask can be
+# the known RFI ranges built into the calculator, or be read from a file
+# (like the results of an RFI occupancy survey) with the low and high
+# frequency (MHz) of a range on each line; lines starting with # are
+# ignored, as are any columns after the first two.
+#
+# Each mask is turned into an index once: its ranges are sorted and any
+# that overlap are merged, so the ranges that overlap any channel can be
+# found by binary searches. The amount of each channel's bandwidth that is
+# covered by the mask is then kept for each set of channels it has been
+# applied to.
+
+import os
+import collections
+import numpy as np
+import templates as templates
+
+# The indexes we have made, by mask name.
+maskIndexes = {}
+# The number of flagged bandwidth arrays to keep.
+flaggedCacheSize = 64
+# The flagged bandwidth arrays we have, most recently used last.
+flaggedCache = collections.OrderedDict()
+
+def makeIndex(ranges):
+    # Sort the ranges (low, high in MHz) and merge any that overlap.
+    r = np.sort(np.array(ranges, dtype=np.float64).reshape(-1, 2), axis=1)
+    r = r[np.argsort(r[:, 0], kind='stable')]
+    if (len(r) == 0):
+        return { 'low': r[:, 0], 'high': r[:, 1] }
+    # A merged range starts wherever a range starts above all the ranges before it.
+    starts = np.ones(len(r), dtype=bool)
+    starts[1:] = (r[1:, 0] > np.maximum.accumulate(r[:-1, 1]))
+    starts = np.flatnonzero(starts)
+    return { 'low': np.ascontiguousarray(r[starts, 0]),
+             'high': np.maximum.reduceat(r[:, 1], starts) }
+
+def readMask(filename):
+    # Read the ranges from an RFI mask file.
+    return np.loadtxt(filename, comments="#", usecols=(0, 1), ndmin=2)
+
+def getIndex(name, ranges=None):
+    # Return the index for the named mask. A mask that isn't given by its ranges is
+    # read from the file called name, and is read again if the file changes. The
+    # known RFI ranges have the name None.
+    version = None
+    if (ranges is None):
+        version = os.path.getmtime(name)
+    if (name not in maskIndexes or maskIndexes[name]['version'] != version):
+        if (ranges is None):
+            ranges = readMask(name)
+        index = makeIndex(ranges)
+        index['name'] = name
+        index['version'] = version
+        maskIndexes[name] = index
+    return maskIndexes[name]
+
+def channelOverlap(index, centreFrequency, channelWidth):
+    # Return how much of each channel (MHz) is covered by the ranges in the index.
+    # For each channel, the ranges that overlap it are those from the first range
+    # ending above the bottom of the channel, up to the last range starting below
+    # the top of the channel.
+    f1 = centreFrequency - channelWidth / 2.0
+    f2 = centreFrequency + channelWidth / 2.0
+    first = np.searchsorted(index['high'], f1, side='right')
+    last = np.searchsorted(index['low'], f2, side='left')
+    n = np.maximum((last - first), 0)
+    # Make a list of every (channel, range) pair that overlaps.
+    channel = np.repeat(np.arange(0, len(centreFrequency)), n)
+    r = first[channel] + (np.arange(0, len(channel)) - np.repeat((np.cumsum(n) - n), n))
+    overlap = (np.minimum(f2[channel], index['high'][r]) -
+               np.maximum(f1[channel], index['low'][r]))
+    return np.bincount(channel, weights=overlap, minlength=len(centreFrequency))
+
+def flaggedBandwidth(index, template):
+    # Return how much of each channel in the template is covered by the mask, which
+    # we only work out once for each set of channels.
+    key = (index['name'], index['version'], templates.channelKey(template))
+    if (key in flaggedCache):
+        flaggedCache.move_to_end(key)
+        return flaggedCache[key]
+    flagged = channelOverlap(index, template['centreFrequency'], template['channelWidth'])
+    flagged.setflags(write=False)
+    flaggedCache[key] = flagged
+    while (len(flaggedCache) > flaggedCacheSize):
+        flaggedCache.popitem(last=False)
+    return flagged
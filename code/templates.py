@@ -0,0 +1,209 @@
+######################################################################
+# The ATCA Sensitivity Calculator
+# Spectrum templates.
+# Copyright 2015 Jamie Stevens, CSIRO
+#
+# This file is part of the ATCA Sensitivity Calculator.
+#
+# The ATCA Sensitivity Calculator is free software: you can
+# redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# The ATCA Sensitivity Calculator is distributed in the hope
+# that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with the ATCA Sensitivity Calculator.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# A template is a spectrum: a value for each of a set of equally wide
+# channels, along with how many values have been added into each channel,
+# whether each channel is flagged and how much of each channel's bandwidth
+# falls in known RFI. Each of these is kept as a contiguous NumPy array, with
+# the flags as a boolean mask, so that a template with many thousands of
+# channels stays compact and can be worked on without looping in Python.
+#
+# Templates can still be used as if they were dicts (t['value'] and so on),
+# and anything else stored in them (like the system temperature or the way
+# the atmosphere was calculated) is kept in the properties dict.
+#
+# Filling one template from another (see templateFill in the calculation
+# routines) depends only on the two sets of channels, and the same pairs
+# come up again and again: the Tsys and efficiency both go onto each
+# continuum grid, and the opacity and sky temperature onto the same grids
+# for every weather condition. So the mapping between two grids is worked
+# out once as a fill plan, and the most recently used plans are kept.
+#
+# Many templates are also made on the same channels, so the channel
+# frequencies and numbers for each set of channels are made once and shared
+# (read-only) between all the templates that use them; only the values,
+# counts and flags belong to each template.
+
+import hashlib
+import collections
+import numpy as np
+
+# The array fields of a template, and the type of each.
+fieldTypes = {
+    'centreFrequency': np.float64, # MHz
+    'value': np.float64,
+    'count': np.int64,
+    'flags': np.bool_,
+    'flaggedBandwidth': np.float64, # MHz
+    'channelNumber': np.int64
+}
+
+# The number of fill plans to keep.
+fillPlanCacheSize = 64
+# The fill plans we have, most recently used last.
+fillPlans = collections.OrderedDict()
+# The number of sets of channels to keep.
+gridCacheSize = 64
+# The sets of channels we have, most recently used last.
+grids = collections.OrderedDict()
+
+class Template(object):
+    __slots__ = ( 'centreFrequency', 'value', 'count', 'flags', 'flaggedBandwidth',
+                  'channelWidth', 'channelNumber', 'properties' )
+
+    def __init__(self, centreFrequency, channelWidth, value=None, count=None, flags=None,
+                 channelNumber=None):
+        # Make a template with channels at the specified centre frequencies (MHz),
+        # each channelWidth (MHz) wide. Any arrays not given start as zero values
+        # and counts, no flags, and channels numbered from 1 in frequency order.
+        self.centreFrequency = centreFrequency
+        n = len(self.centreFrequency)
+        self.value = np.zeros(n) if value is None else value
+        self.count = np.zeros(n) if count is None else count
+        self.flags = np.zeros(n) if flags is None else flags
+        self.flaggedBandwidth = np.zeros(n)
+        self.channelWidth = channelWidth
+        self.channelNumber = np.arange(1, (n + 1)) if channelNumber is None else channelNumber
+        self.properties = {}
+
+    def __setattr__(self, name, value):
+        # Make sure each of the arrays is contiguous and of the right type.
+        if (name in fieldTypes):
+            value = np.ascontiguousarray(value, dtype=fieldTypes[name])
+        object.__setattr__(self, name, value)
+
+    def __len__(self):
+        return len(self.centreFrequency)
+
+    def __getitem__(self, key):
+        if (key in Template.__slots__ and key != 'properties'):
+            return getattr(self, key)
+        return self.properties[key]
+
+    def __setitem__(self, key, value):
+        if (key in Template.__slots__ and key != 'properties'):
+            setattr(self, key, value)
+        else:
+            self.properties[key] = value
+
+    def __contains__(self, key):
+        return ((key in Template.__slots__ and key != 'properties') or
+                (key in self.properties))
+
+def channelGrid(lowFreq, nChannels, channelWidth, reverseNumbers=False):
+    # Return the centre frequencies and channel numbers of nChannels channels,
+    # channelWidth wide, starting at lowFreq. The channels are numbered from 1,
+    # upwards in frequency unless reverseNumbers is True. The arrays are shared by
+    # all the templates with these channels, so they can't be changed.
+    key = (float(lowFreq), int(nChannels), float(channelWidth), bool(reverseNumbers))
+    if (key in grids):
+        grids.move_to_end(key)
+        return grids[key]
+    centreFrequency = lowFreq + channelWidth * np.arange(0, nChannels, dtype=np.float64)
+    channelNumber = np.arange(1, (nChannels + 1), dtype=np.int64)
+    if (reverseNumbers):
+        channelNumber = np.ascontiguousarray(channelNumber[::-1])
+    centreFrequency.setflags(write=False)
+    channelNumber.setflags(write=False)
+    grids[key] = (centreFrequency, channelNumber)
+    while (len(grids) > gridCacheSize):
+        grids.popitem(last=False)
+    return grids[key]
+
+def lowHigh(c, w):
+    return { 'low': c - (w / 2.0), 'high': c + (w / 2.0) }
+
+def channelKey(template):
+    # A name for the channels of a template, which depends on the channel width
+    # and the exact channel frequencies.
+    k = hashlib.sha1()
+    k.update(np.array([ template.channelWidth ], dtype=np.float64).tobytes())
+    k.update(np.array([ len(template) ], dtype=np.int64).tobytes())
+    k.update(template.centreFrequency.tobytes())
+    return k.hexdigest()
+
+def fillPlanKey(srcTemplate, destTemplate):
+    # The fill plan depends on the channels of both templates.
+    return channelKey(srcTemplate) + channelKey(destTemplate)
+
+def makeFillPlan(srcTemplate, destTemplate):
+    # Work out how the channels of srcTemplate are added into the channels of an
+    # empty destTemplate. Each source channel goes into the lowest destination channel
+    # that it overlaps, which we find with a binary search on the channel edges. The
+    # plan is a sparse matrix with (at most) a single entry per source channel: the
+    # source channels that are used, and the destination channel each goes into.
+    # Empty destination channels at the edges are interpolated between a nearby
+    # source channel and the nearest filled destination channel; the plan keeps
+    # which channels those are.
+    src = lowHigh(srcTemplate.centreFrequency, srcTemplate.channelWidth)
+    dest = lowHigh(destTemplate.centreFrequency, destTemplate.channelWidth)
+    nDest = len(destTemplate)
+    # The first destination channel with a top edge above the bottom edge of each
+    # source channel; the source channel goes there if it also overlaps it.
+    index = np.searchsorted(dest['high'], src['low'], side='right')
+    used = (index < nDest)
+    used[used] = (dest['low'][index[used]] < src['high'][used])
+    index = index[used]
+    count = np.bincount(index, minlength=nDest)
+    filled = np.flatnonzero(count[1:-1])
+    plan = { 'used': used, 'index': index, 'count': count, 'destLength': nDest,
+             'bottom': None, 'top': None }
+    if (count[0] == 0):
+        # Use the source channel just below the bottom destination channel, and the
+        # first filled destination channel.
+        j = np.searchsorted(src['high'], dest['low'][0], side='left') - 1
+        i = (filled[0] + 1) if (len(filled) > 0) else (nDest - 1)
+        plan['bottom'] = [ int(j), int(i) ]
+    if (count[-1] == 0):
+        # Use the first source channel above the bottom of the top destination channel,
+        # and the last filled destination channel.
+        j = min(np.searchsorted(src['high'], dest['low'][-1], side='right'),
+                (len(srcTemplate) - 1))
+        i = (filled[-1] + 1) if (len(filled) > 0) else 0
+        plan['top'] = [ int(j), int(i) ]
+    # Plans are shared, so make sure they can't be changed.
+    for q in [ 'used', 'index', 'count' ]:
+        plan[q].setflags(write=False)
+    return plan
+
+def fillPlan(srcTemplate, destTemplate):
+    # Return the plan for filling destTemplate from srcTemplate, making it only if we
+    # haven't recently made the same one.
+    key = fillPlanKey(srcTemplate, destTemplate)
+    if (key in fillPlans):
+        fillPlans.move_to_end(key)
+        return fillPlans[key]
+    plan = makeFillPlan(srcTemplate, destTemplate)
+    fillPlans[key] = plan
+    while (len(fillPlans) > fillPlanCacheSize):
+        fillPlans.popitem(last=False)
+    return plan
+
+def applyFillPlan(plan, values):
+    # Add up the values of the source channels into the destination channels
+    # according to the plan.
+    return np.bincount(plan['index'], weights=values[plan['used']], minlength=plan['destLength'])
+
+def fillPlanVotes(plan, flags):
+    # Count how many flagged source channels go into each destination channel.
+    return np.bincount(plan['index'][flags[plan['used']]], minlength=plan['destLength'])
@@ -0,0 +1,269 @@
+######################################################################
+# The ATCA Sensitivity Calculator
+# Compiled receiver system temperature tables.
+# Copyright 2015 Jamie Stevens, CSIRO
+#
+# This file is part of the ATCA Sensitivity Calculator.
+#
+# The ATCA Sensitivity Calculator is free software: you can
+# redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# The ATCA Sensitivity Calculator is distributed in the hope
+# that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with the ATCA Sensitivity Calculator.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+# The measured system temperatures are kept in the systemps directory as
+# text files, with a frequency (GHz) and the log10 of the system
+# temperature (K) on each line, in no particular order. Each file is
+# compiled once into a binary array: row 0 has the frequencies in
+# ascending order, and row 1 the system temperatures themselves. The
+# compiled array is memory-mapped, so only the part of it that is needed
+# is read, and the rows for any frequency range are found by binary
+# searches.
+#
+# The calculator uses the system temperatures 1 MHz apart, but often only
+# needs them averaged over much wider channels. So each table is also
+# binned into a pyramid of coarser levels, with bins 2, 4, 8, ... MHz wide
+# at multiples of their width; each bin keeps the sum of the temperatures
+# in it and how many there are, so averages made from the bins are the
+# same as those made from the 1 MHz rows they cover. Each level is
+# compiled and memory-mapped the same way as the table itself.
+#
+# Alongside each compiled array is a small description of the text file it
+# was made from: its modification time, size and SHA1 hash. If the time or
+# size of the text file changes, its hash is checked, and the array is only
+# compiled again if the contents really did change.
+#
+# The arrays are made once by running this file:
+#   python tsysstore.py [file ...]
+# and are otherwise made the first time they are needed.
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+# Where the compiled arrays are kept.
+storeDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tsys_tables")
+# Change this whenever the layout of the compiled arrays changes.
+storeVersion = 2
+# The number of levels in each pyramid; the bins of level k are 2 ** k MHz wide.
+pyramidLevels = 7
+
+# The compiled arrays already mapped by this process, by text file name.
+loadedStores = {}
+
+def storeFilenames(filename):
+    # The names of the compiled array and its description for a text file.
+    base = os.path.join(storeDirectory, os.path.splitext(os.path.basename(filename))[0])
+    return (base + ".npy", base + ".json")
+
+def pyramidFilename(filename, level):
+    # The name of the compiled array for one level of the pyramid for a text file.
+    base = os.path.splitext(storeFilenames(filename)[0])[0]
+    return "%s_%dMHz.npy" % (base, (2 ** level))
+
+def fileStamp(filename):
+    # The modification time (ns) and size of a file.
+    st = os.stat(filename)
+    return [ st.st_mtime_ns, st.st_size ]
+
+def fileHash(filename):
+    k = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            k.update(block)
+    return k.hexdigest()
+
+def compileTsys(filename):
+    # Read a text file of system temperatures, and return the frequencies (GHz) sorted
+    # in ascending order and the system temperatures (K) as a 2 row array. Rows with
+    # the same frequency stay in the order they were in the file. Each temperature is
+    # exponentiated one at a time, exactly as it was when the text file was read
+    # directly.
+    d = np.loadtxt(filename, ndmin=2)
+    d = d[np.argsort(d[:, 0], kind='stable')]
+    return np.array([ d[:, 0], [ (10 ** v) for v in d[:, 1] ] ], dtype=np.float64)
+
+def rowBins(c, width):
+    # The bin, width MHz wide, that each 1 MHz row (at c MHz) goes into: the one with
+    # the bottom edge of the row in it, as that is where templateFill would put it.
+    return np.floor((c - 0.5) / width)
+
+def compilePyramid(table):
+    # Bin a compiled table into each level of the pyramid. Each level is a 3 row
+    # array: the bottom edge of each bin (MHz) that has any rows in it, the sum of
+    # the system temperatures (K) in it, and how many rows there are.
+    c = np.around(table[0] * 1000.0)
+    levels = []
+    for k in range(1, (pyramidLevels + 1)):
+        width = 2 ** k
+        b = rowBins(c, width)
+        starts = np.flatnonzero(np.concatenate(([ True ], (b[1:] != b[:-1]))))
+        counts = np.diff(np.append(starts, len(c)))
+        levels.append(np.array([ (b[starts] * width), np.add.reduceat(table[1], starts), counts ],
+                               dtype=np.float64))
+    return levels
+
+def writeFile(name, write):
+    # Write the file name with the function write, making its directory if need be.
+    # It is written to a temporary file in the same directory first and then renamed,
+    # so a reader never sees a partially written file. The atmosphere tables and
+    # cache (see atmostable and atmoscache) are written this way too; any error is
+    # raised, after the temporary file is removed.
+    directory = os.path.dirname(os.path.abspath(name))
+    if (not os.path.isdir(directory)):
+        os.makedirs(directory)
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, name)
+    except (IOError, OSError):
+        if (os.path.exists(tmpname)):
+            os.remove(tmpname)
+        raise
+
+def writeDescription(filename, description):
+    writeFile(storeFilenames(filename)[1], lambda f: f.write(json.dumps(description).encode()))
+
+def writeStore(filename, table, pyramid):
+    # Store the compiled arrays for a text file, and then its description, so the
+    # description never refers to an array that isn't there.
+    writeFile(storeFilenames(filename)[0], lambda f: np.save(f, table))
+    for k in range(0, len(pyramid)):
+        writeFile(pyramidFilename(filename, (k + 1)), lambda f: np.save(f, pyramid[k]))
+    writeDescription(filename, { 'version': storeVersion, 'source': os.path.abspath(filename),
+                                 'stamp': fileStamp(filename), 'sha1': fileHash(filename) })
+
+def readDescription(filename):
+    # Return the description of the compiled array for a text file, or None if there
+    # isn't one we can use.
+    try:
+        with open(storeFilenames(filename)[1]) as f:
+            description = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if (description.get('version') != storeVersion):
+        return None
+    return description
+
+def mapArray(name, rows):
+    # Memory-map a compiled array, or return None if it can't be read.
+    try:
+        a = np.load(name, mmap_mode='r')
+    except (IOError, OSError, ValueError):
+        return None
+    if (a.ndim != 2 or a.shape[0] != rows):
+        return None
+    return a
+
+def mapStore(filename):
+    # Memory-map the compiled arrays for a text file, or return None if any of them
+    # can't be read.
+    table = mapArray(storeFilenames(filename)[0], 2)
+    pyramid = [ mapArray(pyramidFilename(filename, k), 3) for k in range(1, (pyramidLevels + 1)) ]
+    if (table is None or any((p is None) for p in pyramid)):
+        return None
+    return { 'table': table, 'pyramid': pyramid }
+
+def getStore(filename):
+    # Return the compiled table and pyramid for a text file of system temperatures,
+    # compiling them if they haven't been, or if the text file has changed since. If
+    # the compiled arrays can't be written, they are just kept in memory.
+    stamp = fileStamp(filename)
+    if (filename in loadedStores and loadedStores[filename]['stamp'] == stamp):
+        return loadedStores[filename]
+    store = None
+    description = readDescription(filename)
+    if (description is not None):
+        if (description['stamp'] != stamp):
+            # The file has been touched, but it may not have changed.
+            digest = fileHash(filename)
+            if (description['sha1'] == digest):
+                description['stamp'] = stamp
+                try:
+                    writeDescription(filename, description)
+                except (IOError, OSError):
+                    pass
+            else:
+                description = None
+        if (description is not None):
+            store = mapStore(filename)
+    if (store is None):
+        table = compileTsys(filename)
+        store = { 'table': table, 'pyramid': compilePyramid(table) }
+        try:
+            writeStore(filename, store['table'], store['pyramid'])
+        except (IOError, OSError):
+            pass
+        else:
+            mapped = mapStore(filename)
+            if (mapped is not None):
+                store = mapped
+    store['stamp'] = stamp
+    loadedStores[filename] = store
+    return store
+
+def frequencyRange(table, lf, hf):
+    # Return the first and last indices of the rows to use for the frequency range
+    # lf - hf (GHz): from the last row below lf (or the first row) up to the first row
+    # above hf (or the last row). At least two rows are used if there are two.
+    n = table.shape[1]
+    startIndex = max((int(np.searchsorted(table[0], lf, side='left')) - 1), 0)
+    endIndex = min(int(np.searchsorted(table[0], hf, side='right')), (n - 1))
+    if (startIndex == endIndex):
+        if (startIndex > 0):
+            startIndex -= 1
+        if (endIndex < (n - 1)):
+            endIndex += 1
+    return startIndex, endIndex
+
+def pyramidSlice(store, c, v):
+    # Return the bins of each level of the pyramid that hold the rows of a part of
+    # the table, with frequencies c (MHz, rounded as in compilePyramid) and system
+    # temperatures v, as (width, bottom edges, sums, counts). The bins at each end
+    # can have rows that aren't in the part, so they are made again from the part.
+    levels = []
+    for k in range(1, (pyramidLevels + 1)):
+        width = 2 ** k
+        b0, b1 = rowBins(c[[ 0, -1 ]], width)
+        if (b0 == b1):
+            levels.append((width, np.array([ b0 * width ]), np.array([ np.sum(v) ]),
+                           np.array([ len(v) ])))
+            continue
+        level = store['pyramid'][k - 1]
+        # The rows in the first bin, and the first row in the last bin.
+        n0 = np.searchsorted(c, ((b0 + 1) * width + 0.5), side='left')
+        n1 = np.searchsorted(c, (b1 * width + 0.5), side='left')
+        # The whole bins in between.
+        lo = np.searchsorted(level[0], ((b0 + 1) * width), side='left')
+        hi = np.searchsorted(level[0], (b1 * width), side='left')
+        levels.append((width, np.concatenate(([ b0 * width ], level[0][lo:hi], [ b1 * width ])),
+                       np.concatenate(([ np.sum(v[:n0]) ], level[1][lo:hi], [ np.sum(v[n1:]) ])),
+                       np.concatenate(([ n0 ], level[2][lo:hi], [ len(v) - n1 ]))))
+    return levels
+
+if __name__ == "__main__":
+    # Compile the named text files, or all those in the systemps directory.
+    filenames = sys.argv[1:]
+    if (len(filenames) == 0):
+        filenames = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  "systemps", "*.avg")))
+    for filename in filenames:
+        table = compileTsys(filename)
+        writeStore(filename, table, compilePyramid(table))
+        print("%s: %d rows, %.3f - %.3f GHz" % (filename, table.shape[1], table[0][0], table[0][-1]))